@@ -0,0 +1,54 @@
+# Vectorized CPW calculators vs. the former scalar loop
+# python benchmarks/cpw_calculators.py [N]
+import math, os, sys, time
+import numpy as np
+from scipy.constants import c
+from scipy.special import ellipk
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'util'))
+from functions import calculate_resonator_frequency, calculate_resonator_length
+
+# Scalar reference (the per-point implementation the vectorized one replaces)
+def scalar_effective_permittivity(w, s, h, eps_r):
+    k0 = w/(w + 2*s)
+    k0_prime = math.sqrt(1-pow(k0, 2))
+    k3 = math.tanh((math.pi*w)/(4*h))/math.tanh((math.pi*(w+2*s))/(4*h))
+    k3_prime = math.sqrt(1-pow(k3, 2))
+    K_tilde = (ellipk(k0_prime**2)/ellipk(k0**2))*(ellipk(k3**2)/ellipk(k3_prime**2))
+    return (1 + eps_r * K_tilde)/(1 + K_tilde)
+
+def scalar_resonator_length(frequency, core_width, gap_width, height, eps_r):
+    eps_eff = scalar_effective_permittivity(core_width*1e-6, gap_width*1e-6, height*1e-6, eps_r)
+    return c / math.sqrt(eps_eff) / (4*frequency*1e+6) * 1e+6
+
+def scalar_resonator_frequency(length, core_width, gap_width, height, eps_r):
+    eps_eff = scalar_effective_permittivity(core_width*1e-6, gap_width*1e-6, height*1e-6, eps_r)
+    return c / math.sqrt(eps_eff) / (4*length*1e-6) * 1e-6
+
+def timed(f):
+    t = time.perf_counter()
+    result = f()
+    return result, time.perf_counter() - t
+
+def main(n = 10000):
+    rng = np.random.default_rng(0)
+    frequency = rng.uniform(4000, 10000, n)
+    width = rng.uniform(5, 20, n)
+    gap = rng.uniform(3, 12, n)
+    height = rng.choice([380, 525, 650], n)
+    material = rng.choice(["silicon", "sapphire"], n)
+    eps_r = np.where(material == "silicon", 11.9, 9.4)
+
+    for name, scalar, vector, first in (
+        ("length", scalar_resonator_length, calculate_resonator_length, frequency),
+        ("frequency", scalar_resonator_frequency, calculate_resonator_frequency, rng.uniform(2000, 8000, n)),
+    ):
+        ref, t_scalar = timed(lambda: np.array([scalar(*args) for args in zip(first, width, gap, height, eps_r)]))
+        out, t_vector = timed(lambda: vector(first, width, gap, height, material))
+        err = np.max(np.abs(out - ref) / np.abs(ref))
+        print(f"{name:10s} n={n}  scalar {t_scalar*1e3:8.1f} ms  vector {t_vector*1e3:7.2f} ms  "
+              f"speedup {t_scalar/t_vector:7.1f}x  max rel err {err:.1e}")
+        assert np.allclose(out, ref, rtol = 1e-12, atol = 0)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,220 @@
+# Timings of the device builders for every shipped config, the wafer, the qiskit-metal export and the notebooks
+# python benchmarks/suite.py [--repeat N] [--only NAME] [--output results.json]
+# python benchmarks/suite.py --compare baseline.json [--tolerance 0.2]
+import argparse, contextlib, io, json, os, platform, shutil, sys, tempfile, time, tracemalloc
+from datetime import datetime, timezone
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(root, 'util'))
+import numpy as np
+import phidl
+import phidl.geometry as pg
+import functions
+import qubit_templates
+from qubit_templates import *
+from cell_cache import cell_cache
+from render import render_policy
+
+render_policy.mode = 'off'
+
+def config_path(name):
+    return os.path.join(root, 'config', name)
+
+# Config files in the order the notebooks load them
+overlays = ['dolan_3D_sapphire', 'dolan_3D_silicon', 'manhattan_3D_sapphire', 'manhattan_3D_silicon',
+            'dolan_3D_silicon_photolitho', 'manhattan_3D_sapphire_photolitho', 'manhattan_3D_silicon_photolitho']
+config_sets = {'common' : ['common.yaml'], 'common_Tc' : ['common_Tc.yaml'], 'FeedLine_Qubit' : ['FeedLine_Qubit.yaml']}
+config_sets.update({name : ['common.yaml', f'{name}.yaml'] for name in overlays})
+
+builders = {
+    'device_JJ[manhattan]'        : lambda config: device_JJ(width = 0.135, JJtype = "manhattan", squid = False, bandage = True, config = config),
+    'device_JJ[manhattan,squid]'  : lambda config: device_JJ(width = 0.3, JJtype = "manhattan", squid = True, bandage = False, config = config),
+    'device_JJ[dolan,squid]'      : lambda config: device_JJ(width = 1.0, JJtype = "dolan", squid = True, bandage = False, config = config),
+    'device_JJ[manhattan,photolitho]' : lambda config: device_JJ(width = 1.0, JJtype = "manhattan", squid = True, bandage = False, photolitho = True, config = config),
+    'device_JJ[dolan,photolitho]' : lambda config: device_JJ(bridge_width = 0.3, finger_width = 1.0, JJtype = "dolan", squid = True, bandage = False, photolitho = True, config = config),
+    'device_Resonator'            : lambda config: device_Resonator(resonator_straight1 = 220, resonator_straight2 = 260, resonator_straight3 = 475,
+                                                                    resonator_straight4 = 700, n_step = 3, mirror = True, config = config),
+    'device_Resonator[side]'      : lambda config: device_Resonator(resonator_straight1 = 310, resonator_straight2 = 360, resonator_straight3 = 475,
+                                                                    resonator_straight4 = 1030, side = True, config = config),
+    'device_FeedLine'             : lambda config: device_FeedLine(config = config),
+    'device_Grid'                 : lambda config: device_Grid(inch = 4, config = config),
+    'device_Wafer'                : lambda config: device_Wafer(inch = 4, config = config),
+}
+
+# Builders that apply to each config set (the others miss the keys they read)
+builder_sets = {
+    'common'                           : ['device_JJ[manhattan]', 'device_JJ[manhattan,squid]', 'device_Resonator',
+                                          'device_Resonator[side]', 'device_FeedLine', 'device_Grid', 'device_Wafer'],
+    'common_Tc'                        : ['device_Resonator', 'device_FeedLine', 'device_Grid', 'device_Wafer'],
+    'FeedLine_Qubit'                   : ['device_FeedLine'],
+    'dolan_3D_sapphire'                : ['device_JJ[dolan,squid]'],
+    'dolan_3D_silicon'                 : ['device_JJ[dolan,squid]'],
+    'manhattan_3D_sapphire'            : ['device_JJ[manhattan]', 'device_JJ[manhattan,squid]'],
+    'manhattan_3D_silicon'             : ['device_JJ[manhattan]', 'device_JJ[manhattan,squid]'],
+    'dolan_3D_silicon_photolitho'      : ['device_JJ[dolan,photolitho]'],
+    # has the dolan grid (bridge_width) and no JJ_finger_rounding
+    'manhattan_3D_sapphire_photolitho' : ['device_JJ[dolan,photolitho]'],
+    'manhattan_3D_silicon_photolitho'  : ['device_JJ[manhattan,photolitho]'],
+}
+
+def export_devices(config):
+    # FeedLine and resonators of Tc_sample.ipynb, built before the export is timed
+    R1 = device_Resonator(resonator_straight1 = 220, resonator_straight2 = 260, resonator_straight3 = 475,
+                          resonator_straight4 = 700, n_step = 3, mirror = True, config = config)
+    R1.rotate(-90).move((300, 500))
+    R2 = device_Resonator(resonator_straight1 = 220, resonator_straight2 = 260, resonator_straight3 = 475,
+                          resonator_straight4 = 1100, n_step = 3, config = config)
+    R2.rotate(90).move((300, -500))
+    return [dict(device = device_FeedLine(config = config), name = "FeedLine"),
+            dict(device = R1, name = "Resonator1"), dict(device = R2, name = "Resonator2")]
+
+def export(device_list):
+    functions.phidl_to_metal(device_list = device_list, outname = "TcSampleDesign")
+    return os.path.join('output', 'qiskit-metal', 'TcSampleDesign.gds')
+
+# (name, function, config set, setup): setup(config) runs before every timed call and its result is passed instead of the config
+exports = [
+    ('phidl_to_metal', export, 'common_Tc', export_devices),
+]
+
+# The notebook pipelines run from the code cells of the notebooks, with the configs they load themselves
+notebooks = ['Tc_sample', 'Tc_sample_grid', 'FeedLine_Qubit', 'transmon2D', 'transmon3D', 'transmon3D_photolitho']
+
+def notebook_cells(name):
+    # Compiled code cells without the ipython magics
+    with open(os.path.join(root, f'{name}.ipynb')) as f:
+        cells = json.load(f)['cells']
+    sources = ['\n'.join(line for line in ''.join(c['source']).split('\n') if not line.lstrip().startswith(('%', '!')))
+               for c in cells if c['cell_type'] == 'code']
+    return [compile(source, f'{name}.ipynb[{i}]', 'exec') for i, source in enumerate(sources)]
+
+def no_plot(*args, **kwargs):
+    pass
+
+def notebook(name):
+    cells = notebook_cells(name)
+    def run_notebook(config):
+        # Cold run: nothing in output/cell_cache and no recorded reads. The cells run one by one like in a kernel,
+        # the quickplots draw nothing (qp is imported by the first cells, so it is replaced before every cell).
+        shutil.rmtree(os.path.join('output', 'cell_cache'), ignore_errors = True)
+        cell_cache.graph.clear()
+        namespace = dict(__name__ = '__main__')
+        try:
+            for cell in cells:
+                namespace['qp'] = no_plot
+                exec(cell, namespace)
+        finally:
+            cell_cache.disk = None
+        return namespace['wafer'] if 'wafer' in namespace else namespace['chipdesign']
+    return run_notebook
+
+def layout(result):
+    if isinstance(result, BaseDevice):
+        return result.device
+    if isinstance(result, str):
+        # a written gds file
+        return pg.import_gds(result)
+    return result
+
+def geometry_counts(device):
+    polygons = device.get_polygons()
+    return len(polygons), int(sum(len(p) for p in polygons))
+
+def measure(function, config, repeat, setup = None):
+    # Best wall time of repeat cold builds, peak traced memory of one more build
+    times = []
+    for _ in range(repeat):
+        cell_cache.invalidate()
+        argument = config if setup is None else setup(config)
+        t = time.perf_counter()
+        result = function(argument)
+        times.append(time.perf_counter() - t)
+    cell_cache.invalidate()
+    argument = config if setup is None else setup(config)
+    tracemalloc.start()
+    function(argument)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    polygons, vertices = geometry_counts(layout(result))
+    return dict(time = min(times), times = times, peak_memory = peak, polygons = polygons, vertices = vertices)
+
+def cases():
+    for config_name, files in config_sets.items():
+        for builder in builder_sets[config_name]:
+            yield f'{builder}@{config_name}', config_name, builders[builder], None
+    for name, function, config_name, setup in exports:
+        yield f'{name}@{config_name}', config_name, function, setup
+    for name in notebooks:
+        yield f'{name}.ipynb', None, notebook(name), None
+
+def run(repeat = 3, only = None):
+    configs = {name : load_config(*[config_path(f) for f in files]) for name, files in config_sets.items()}
+    results = {}
+    # Pipelines write their gds files to output/ of a scratch directory, the notebooks load config/ from there
+    with tempfile.TemporaryDirectory() as scratch:
+        os.makedirs(os.path.join(scratch, 'output', 'qiskit-metal'))
+        os.symlink(os.path.join(root, 'config'), os.path.join(scratch, 'config'))
+        cwd = os.getcwd()
+        os.chdir(scratch)
+        try:
+            for name, config_name, function, setup in cases():
+                if only is not None and only not in name:
+                    continue
+                with contextlib.redirect_stdout(io.StringIO()):
+                    results[name] = measure(function, configs.get(config_name), repeat, setup)
+                r = results[name]
+                print(f"{name:62s} {r['time']*1e3:10.1f} ms  peak {r['peak_memory']/2**20:8.1f} MiB  "
+                      f"{r['polygons']:8d} polygons  {r['vertices']:9d} vertices", flush = True)
+        finally:
+            os.chdir(cwd)
+    return dict(
+        meta = dict(date = datetime.now(timezone.utc).isoformat(timespec = 'seconds'), python = platform.python_version(),
+                    phidl = phidl.__version__, numpy = np.__version__, machine = platform.machine(), repeat = repeat),
+        results = results,
+    )
+
+def compare(current, baseline, tolerance = 0.2, slack = 0.005):
+    # Slower than the baseline by more than tolerance (and slack seconds against timer noise),
+    # more peak memory, or different geometry
+    regressions = []
+    for name, r in current['results'].items():
+        b = baseline['results'].get(name)
+        if b is None:
+            continue
+        if r['time'] > b['time']*(1 + tolerance) + slack:
+            regressions.append(f"{name}: time {b['time']*1e3:.1f} ms -> {r['time']*1e3:.1f} ms")
+        if r['peak_memory'] > b['peak_memory']*(1 + tolerance) + 2**16:
+            regressions.append(f"{name}: peak memory {b['peak_memory']/2**20:.1f} MiB -> {r['peak_memory']/2**20:.1f} MiB")
+        for key in ('polygons', 'vertices'):
+            if r[key] != b[key]:
+                regressions.append(f"{name}: {key} {b[key]} -> {r[key]}")
+    return regressions
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--only', default = None, help = 'run the cases whose name contains this string')
+    parser.add_argument('--output', default = 'benchmark_results.json')
+    parser.add_argument('--compare', default = None, help = 'baseline json to check for regressions')
+    parser.add_argument('--tolerance', type = float, default = 0.2)
+    parser.add_argument('--slack', type = float, default = 0.005, help = 'seconds added to the allowed time')
+    args = parser.parse_args(argv)
+
+    current = run(repeat = args.repeat, only = args.only)
+    with open(args.output, 'w') as f:
+        json.dump(current, f, indent = 1)
+    print(f"results written to {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.tolerance, args.slack)
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            return 1
+        print(f"no regressions against {args.compare}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,12 @@
+import os
+import sys
+
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(root, 'util'))
+os.environ.setdefault('QGDS_RENDER', 'off')
+
+@pytest.fixture(scope = 'session')
+def config_path():
+    return lambda name: os.path.join(root, 'config', f'{name}.yaml')
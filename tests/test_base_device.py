@@ -0,0 +1,47 @@
+import phidl.geometry as pg
+import pytest
+
+from BaseDevice import BaseDevice
+
+class Pad(BaseDevice):
+    def __init__(self):
+        super().__init__('pad')
+        self.device.add_ref(pg.rectangle((10, 10), layer = 1))
+        self.pocket.add_ref(pg.rectangle((30, 30), layer = 1))
+        self.derive_metal(2)
+
+def test_metal_is_derived_on_first_access():
+    b = Pad()
+    assert not b._metal.references
+    assert b.metal.area() == 800
+    assert b.metal.layers == {2}
+
+def test_metal_is_kept_through_transforms():
+    b = Pad()
+    metal = b.metal
+    b.move((5, 5)).rotate(90)
+    assert b.metal is metal
+    assert b.metal.area() == 800
+
+def test_metal_follows_added_geometry():
+    b = Pad()
+    assert b.metal.area() == 800
+    b.pocket.add_ref(pg.rectangle((30, 30), layer = 1)).movex(30)
+    assert b.metal.area() == pytest.approx(1700)
+
+@pytest.mark.parametrize('change', [
+    lambda b: setattr(b.pocket.references[0], 'origin', (-100, -100)),
+    lambda b: setattr(b.device.references[0], 'origin', (100, 100)),
+    lambda b: setattr(b.device.references[0], 'x_reflection', True),
+])
+def test_metal_follows_references_moved_in_place(change):
+    b = Pad()
+    assert b.metal.area() == 800
+    change(b)
+    assert b.metal.area() == pytest.approx(900)
+
+def test_metal_follows_polygons_scaled_in_place():
+    b = Pad()
+    assert b.metal.area() == 800
+    b.pocket.references[0].parent.polygons[0].scale(2)
+    assert b.metal.area() == pytest.approx(3500)
@@ -0,0 +1,195 @@
+import os
+import zipfile
+from collections import deque
+
+import numpy as np
+import phidl.geometry as pg
+import pytest
+from phidl import Device
+
+import ChipDesign
+import qubit_templates
+from BaseDevice import BaseDevice
+from cell_cache import CellCache, DependencyGraph, DiskCellCache
+from functions import load_config
+
+# not a config value, so the module globals keep the same cache key
+builds = deque()
+
+def ring(radius):
+    builds.append(radius)
+    D = pg.ring(radius = radius, width = 5, layer = 1)
+    D.add_port(name = 'in', midpoint = (-radius, 0), width = 5, orientation = 180)
+    return D
+
+def entries(directory):
+    return [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.npz')]
+
+def test_corrupt_entry_is_rebuilt(tmp_path):
+    disk = DiskCellCache(str(tmp_path))
+    first = disk(ring, 40)
+    [path] = entries(str(tmp_path))
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+
+    builds.clear()
+    cell = disk(ring, 40)
+    assert list(builds) == [40]
+    assert disk.rebuilds == 1
+    assert cell.area() == first.area()
+
+    # the rebuilt entry is valid again
+    builds.clear()
+    cell = disk(ring, 40)
+    assert list(builds) == []
+    assert disk.hits == 1
+    assert list(cell.ports) == ['in']
+
+def test_tampered_entry_fails_the_checksum(tmp_path):
+    disk = DiskCellCache(str(tmp_path))
+    disk(ring, 40)
+    [path] = entries(str(tmp_path))
+    with np.load(path) as f:
+        data = {k: f[k] for k in f.files}
+    data['points'] = data['points'] + 1
+    with open(path, 'wb') as f:
+        np.savez(f, **data)
+    assert zipfile.is_zipfile(path)
+
+    builds.clear()
+    disk(ring, 40)
+    assert list(builds) == [40]
+    assert disk.rebuilds == 1
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    disk = DiskCellCache(str(tmp_path))
+    disk(ring, 40)
+    [first] = entries(str(tmp_path))
+    disk.max_bytes = 2*os.path.getsize(first) + 100
+    disk(ring, 50)
+    # both stored long ago, a hit marks 40 as used
+    for path in entries(str(tmp_path)):
+        os.utime(path, (1, 1))
+    disk(ring, 40)
+    disk(ring, 60)
+    assert len(entries(str(tmp_path))) == 2
+
+    builds.clear()
+    disk(ring, 40)
+    disk(ring, 50)
+    assert list(builds) == [50]
+
+class Pocket(BaseDevice):
+    def __init__(self, width):
+        super().__init__('pocket')
+        self.device.add_ref(pg.rectangle((width, 10), layer = 1))
+        self.pocket.add_ref(pg.rectangle((width + 20, 30), layer = 1))
+        self.pocket.add_port(name = 'in', midpoint = (0, 15), width = 10, orientation = 180)
+        self.derive_metal(2)
+        self.width = width
+
+def test_restored_cell_keeps_class_attributes_and_ports(tmp_path):
+    DiskCellCache(str(tmp_path))(Pocket, 40)
+    cell = DiskCellCache(str(tmp_path))(Pocket, 40)
+    assert type(cell) is Pocket
+    assert cell.width == 40
+    assert list(cell.pocket.ports) == ['in']
+    assert cell.metal.area() == 60*30 - 40*10
+
+def labelled(n):
+    D = Device('labelled')
+    D.add_ref(pg.rectangle((10, 10), layer = 1), alias = 'box').move((5, 0))
+    D.add_array(pg.rectangle((2, 2), layer = 1), columns = n, rows = 2, spacing = (4, 4)).rotate(90)
+    D.add_label('chip', position = (1, 2), layer = 3, anchor = 'sw')
+    return D
+
+def test_hierarchy_labels_and_aliases_are_restored(tmp_path):
+    DiskCellCache(str(tmp_path))(labelled, 3)
+    cell = DiskCellCache(str(tmp_path))(labelled, 3)
+    built = labelled(3)
+    assert [type(r).__name__ for r in cell.references] == ['DeviceReference', 'CellArray']
+    assert cell['box'] is cell.references[0]
+    assert cell.area() == built.area()
+    assert np.allclose(cell.bbox, built.bbox)
+    [label] = cell.labels
+    assert (label.text, tuple(label.position), label.layer, label.anchor) == ('chip', (1, 2), 3, built.labels[0].anchor)
+
+def test_entry_removed_by_another_process_is_a_miss(tmp_path, monkeypatch):
+    disk = DiskCellCache(str(tmp_path))
+    disk(ring, 40)
+    [path] = entries(str(tmp_path))
+    key = os.path.basename(path)[:-len('.npz')]
+    os.remove(path)
+    assert disk.load(key, ring) is None
+    assert disk.rebuilds == 0
+
+    # an entry listed by evict is gone before it is read or removed
+    listdir = os.listdir
+    monkeypatch.setattr(os, 'listdir', lambda d: listdir(d) + ['gone.npz'])
+    disk.max_bytes = 0
+    disk(ring, 50)
+    monkeypatch.undo()
+    assert entries(str(tmp_path)) == []
+
+@pytest.fixture(scope = 'module')
+def tc_config(config_path):
+    return load_config(config_path('common'), config_path('common_Tc'))
+
+def test_memory_invalidate_keeps_the_recorded_reads(tmp_path, tc_config):
+    cache = CellCache(disk = DiskCellCache(str(tmp_path)))
+    cache(ChipDesign.chipdesign_TcSample, None, config = tc_config)
+    graph = os.path.join(str(tmp_path), DependencyGraph.filename)
+    assert os.path.exists(graph)
+
+    cache.invalidate()
+    assert os.path.exists(graph) and cache.graph.sites
+    cache(ChipDesign.chipdesign_TcSample, None, config = tc_config)
+    assert cache.disk.hits == 1
+
+    cache.clear_disk()
+    assert not os.path.exists(graph) and entries(str(tmp_path)) == []
+
+@pytest.fixture
+def module_globals(tc_config, monkeypatch):
+    # the notebooks put the config into the module globals instead of passing config =
+    for module in (qubit_templates, ChipDesign):
+        for k, v in tc_config.items():
+            monkeypatch.setitem(vars(module), k, v)
+
+def test_module_globals_are_keyed_on_the_keys_read(tmp_path, tc_config, module_globals, monkeypatch):
+    cache = CellCache(disk = DiskCellCache(str(tmp_path)))
+    cache(ChipDesign.chipdesign_TcSample, None)
+    keys = {k for entry in cache.graph.sites.values() for k in entry['keys']}
+    assert 'Frame_size_width' in keys and 'Resonator_gap_width' not in keys
+
+    for module in (qubit_templates, ChipDesign):
+        monkeypatch.setitem(vars(module), 'Resonator_gap_width', tc_config.Resonator_gap_width + 1)
+    cache(ChipDesign.chipdesign_TcSample, None)
+    assert cache.hits == 1
+
+def test_changed_module_globals_are_rebuilt(tc_config, module_globals, monkeypatch):
+    cache = CellCache()
+    first = cache(ChipDesign.chipdesign_TcSample, None)
+
+    # only qubit_templates is updated, ChipDesign keeps its copy from "from qubit_templates import *"
+    monkeypatch.setitem(vars(qubit_templates), 'Frame_size_width', tc_config.Frame_size_width + 1000)
+    cell = cache(ChipDesign.chipdesign_TcSample, None)
+    assert cache.misses == 2
+    uncached = ChipDesign.chipdesign_TcSample(None)
+    assert cell.xsize == uncached.xsize == first.xsize + 1000
+    assert cell.area() == uncached.area()
+
+    cache(ChipDesign.chipdesign_TcSample, None)
+    assert cache.hits == 1
+
+def test_ports_of_sub_cells_survive_the_disk(tmp_path, tc_config):
+    # ChipDesign places the feed line through cell_cache, phidl_to_metal reads its ports with get_ports()
+    built = DiskCellCache(str(tmp_path))(qubit_templates.device_FeedLine, config = tc_config)
+    disk = DiskCellCache(str(tmp_path))
+    cell = disk(qubit_templates.device_FeedLine, config = tc_config)
+    assert disk.hits == 1
+    for layout in ('device', 'metal', 'pocket'):
+        ports = lambda d: [(p.name, tuple(np.round(p.midpoint, 9)), p.width, p.orientation)
+                           for p in getattr(d, layout).get_ports()]
+        assert ports(cell) == ports(built)
+    assert [p.name for p in cell.pocket.get_ports()].count('connect') == 4
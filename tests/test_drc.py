@@ -0,0 +1,37 @@
+import phidl.geometry as pg
+from phidl import Device
+
+from drc import check_design
+from functions import configurable
+
+@configurable
+def pad(size):
+    return pg.rectangle((size, size), layer = 3)
+
+rules = [dict(name = 'pads apart', rule = 'spacing', layer = 3, min = 5, between = ['pad'])]
+
+def two_pads(offset):
+    D = Device('wafer')
+    D.add_ref(pad(100))
+    D.add_ref(pad(100)).movex(offset)
+    # not built by pad, so not checked against the pads
+    D.add_ref(pg.rectangle((10, 10), layer = 3)).movex(-12)
+    return D
+
+def test_overlapping_pads_are_reported_with_builder_names():
+    violations = check_design(two_pads(60), rules)
+    assert violations
+    for v in violations:
+        assert v.rule == 'pads apart'
+        assert v.distance == 0
+        assert v.builders == ('pad', 'pad')
+        assert 60 <= v.x <= 100 and 0 <= v.y <= 100
+
+def test_gap_below_the_minimum_is_measured():
+    violations = check_design(two_pads(103), rules)
+    assert violations
+    assert {v.distance for v in violations} == {3}
+    assert all(100 <= v.x <= 103 for v in violations)
+
+def test_pads_far_enough_apart_are_clean():
+    assert check_design(two_pads(106), rules) == []
@@ -0,0 +1,29 @@
+import gdspy
+import phidl.geometry as pg
+
+from cell_cache import CellCache
+from gds_stream import GdsStreamWriter, stream_array
+
+def pad(size):
+    return pg.rectangle((size, size), layer = 1)
+
+def written_area(path):
+    library = gdspy.GdsLibrary(infile = path)
+    return library.cells['toplevel'].area()
+
+def test_cached_cells_are_not_released(tmp_path):
+    cache = CellCache()
+    path = str(tmp_path / 'pads.gds')
+    with GdsStreamWriter(path) as writer:
+        writer.add(cache(pad, size = 10))
+        writer.add(cache(pad, size = 20), release_device = True)
+        stream_array(writer, cache.cached(pad), [[dict(size = 30)]], pitch = 100)
+    assert [cache(pad, size = size).area() for size in (10, 20, 30)] == [100, 400, 900]
+    assert cache.misses == 3
+    assert written_area(path) == 1400
+
+def test_chips_nobody_else_uses_are_released(tmp_path):
+    chip = pad(10)
+    with GdsStreamWriter(str(tmp_path / 'pad.gds')) as writer:
+        writer.add(chip, release_device = True)
+    assert chip.area() == 0
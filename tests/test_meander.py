@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+import qubit_templates
+from functions import bind_config, calculate_resonator_length, load_config
+
+@pytest.fixture(scope = 'module')
+def templates(config_path):
+    config = load_config(config_path('common'))
+    return config, bind_config('qubit_templates', config)
+
+@pytest.mark.parametrize('frequency', [6500, 7000, 7500, 8000])
+def test_solved_length_matches_path(templates, frequency):
+    config, templates = templates
+    params = templates['meander_solve'](frequency, box = (900, 2400), min_pitch = 50)
+    target = calculate_resonator_length(frequency = frequency, core_width = config.Resonator_width,
+                                        gap_width = config.Resonator_gap_width)
+    P = templates['make_Path'](**params)
+
+    assert P.length() == pytest.approx(float(target), abs = 1e-6)
+    assert templates['meander_length'](**params) == pytest.approx(P.length(), abs = 1e-6)
+
+def test_sweep_array_is_solved_at_once(templates):
+    _, templates = templates
+    frequencies = np.array([[6500, 7500], [7000, 8000]])
+    params = templates['meander_solve'](frequencies, box = (900, 2400))
+    assert np.shape(params['resonator_straight4']) == frequencies.shape
+    for index in np.ndindex(frequencies.shape):
+        single = templates['meander_solve'](frequencies[index], box = (900, 2400))
+        for name, value in single.items():
+            assert np.broadcast_to(params[name], frequencies.shape)[index] == pytest.approx(value)
+
+def test_unreachable_length_raises(templates):
+    _, templates = templates
+    with pytest.raises(ValueError, match = "no meander"):
+        templates['meander_solve'](1000, box = (900, 600))
@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import phidl.geometry as pg
+import pytest
+import yaml
+
+from BaseDevice import BaseDevice
+from functions import phidl_to_metal
+from metal_arrays import MetalArrays
+
+class Qubit(BaseDevice):
+    # Two pads with a junction between them and a launch pad port
+    def __init__(self, x, width):
+        super().__init__('qubit')
+        self.device.add_ref(pg.rectangle((100, 40), layer = 1)).move((x, 0))
+        self.device.add_ref(pg.rectangle((100, 40), layer = 1)).move((x, 60))
+        self.pocket.add_ref(pg.rectangle((140, 140), layer = 1)).move((x - 20, -20))
+        self.pocket.add_port(name = 'Junction_up', midpoint = (x + 50, 60), width = width, orientation = 90)
+        self.pocket.add_port(name = 'Junction_down', midpoint = (x + 50, 40), width = width, orientation = 270)
+        self.pocket.add_port(name = 'LaunchPad1_6', midpoint = (x - 20, 50), width = 10, orientation = 180)
+        self.derive_metal(2)
+
+class Line(BaseDevice):
+    def __init__(self):
+        super().__init__('line')
+        self.device.add_ref(pg.rectangle((500, 10), layer = 1)).move((0, 400))
+        self.pocket.add_ref(pg.rectangle((500, 30), layer = 1)).move((0, 390))
+        self.derive_metal(2)
+
+@pytest.fixture
+def export(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('output/qiskit-metal')
+    device_list = [dict(name = 'Q1', device = Qubit(0, 0.2)), dict(name = 'line', device = Line()),
+                   dict(name = 'Q2', device = Qubit(300, 0.3))]
+    phidl_to_metal(device_list, 'design', workers = 1)
+    with open('output/qiskit-metal/design.yaml') as f:
+        data = yaml.safe_load(f)
+    return data, MetalArrays('output/qiskit-metal/design.npz')
+
+def test_junctions_match_the_yaml(export):
+    data, arrays = export
+    assert arrays.names == list(data)
+    for name, entry in data.items():
+        device = arrays.device(name)
+        assert device['layer'] == entry['layer']
+        if 'jj' not in entry:
+            assert device['jj'] is None
+            continue
+        assert device['jj']['start'].tolist() == entry['jj']['start']
+        assert device['jj']['end'].tolist() == entry['jj']['end']
+        assert device['jj']['width'] == entry['jj']['width']
+
+def test_polygons_match_the_gds(export):
+    _, arrays = export
+    gds = pg.import_gds('output/qiskit-metal/design.gds').get_polygons(by_spec = True)
+    for name in arrays.names:
+        layer = arrays.device(name)['layer']
+        ours = sorted(np.round(p, 3).tolist() for p in arrays.polygons(name))
+        theirs = sorted(np.round(p, 3).tolist() for p in gds.get((layer, 0), []))
+        assert ours == theirs
+    assert isinstance(arrays['metal_points'], np.memmap)
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from simplify import simplify_polygon, segment_distance
+
+def boundary_distance(points, polygon):
+    # Distance of every point to the closed polygon outline
+    start, end = polygon, np.roll(polygon, -1, axis = 0)
+    return np.array([segment_distance(np.repeat(p[None], len(polygon), axis = 0), start, end).min() for p in points])
+
+def wobbly_circle(n = 2000, radius = 100, amplitude = 2e-3, seed = 0):
+    # A finely discretized circle with noise below the simplification tolerance
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0, 2*np.pi, n, endpoint = False)
+    r = radius + amplitude*rng.standard_normal(n)
+    return np.stack([r*np.cos(t), r*np.sin(t)], axis = 1)
+
+@pytest.mark.parametrize('tolerance', [1e-3, 1e-2, 0.1, 1.0])
+def test_deviation_stays_within_tolerance(tolerance):
+    grid = 1e-3
+    points = wobbly_circle()
+    simplified = simplify_polygon(points, tolerance = tolerance, grid = grid)
+
+    assert 3 <= len(simplified) < len(points)
+    # the removed vertices stay within tolerance of the new outline, snapping moves them by half a grid step at most
+    assert boundary_distance(points, simplified).max() <= tolerance + np.sqrt(0.5)*grid + 1e-9
+
+def test_collinear_vertices_are_removed():
+    square = [(0, 0), (5, 0), (10, 0), (10, 5), (10, 10), (0, 10), (0, 5)]
+    simplified = simplify_polygon(square)
+    assert sorted(map(tuple, simplified.tolist())) == [(0, 0), (0, 10), (10, 0), (10, 10)]
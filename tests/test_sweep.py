@@ -0,0 +1,78 @@
+import numpy as np
+import phidl.geometry as pg
+import pytest
+from phidl import Device
+
+from sweep import block_points, build_parallel, parameter_sweep
+
+def chip(w, h):
+    return pg.rectangle((w, h), layer = 1)
+
+def placed_rectangles(D):
+    # (center, size) of every rectangle in the sweep
+    rectangles = []
+    for p in D.get_polygons():
+        lower, upper = p.min(axis = 0), p.max(axis = 0)
+        rectangles.append((tuple(np.round(0.5*(lower + upper), 6)), tuple(np.round(upper - lower, 6))))
+    return rectangles
+
+def check_manifest(D, manifest, points):
+    rectangles = placed_rectangles(D)
+    assert len(manifest) == sum(p is not None for p in np.asarray(points, dtype = object).flat) == len(rectangles)
+    for entry in manifest:
+        params = entry['parameters']
+        assert np.asarray(points, dtype = object)[entry['index']] == params
+        center = tuple(np.round(entry['center'], 6))
+        assert (center, (params['w'], params['h'])) in rectangles
+
+def test_manifest_of_a_2d_sweep_matches_the_references():
+    D, manifest = parameter_sweep(chip, axes = {'h' : [10, 20, 30], 'w' : [5, 15]}, spacing = (100, 100),
+                                  label_layer = None, center = (0, 0))
+    points = [[dict(h = h, w = w) for w in (5, 15)] for h in (10, 20, 30)]
+    check_manifest(D, manifest, points)
+    # row 0 on top
+    first, last = manifest[0], manifest[-1]
+    assert first['index'] == (0, 0) and last['index'] == (2, 1)
+    assert first['center'][1] > last['center'][1] and first['center'][0] < last['center'][0]
+
+def test_manifest_of_blocks_with_shared_and_empty_points():
+    points = block_points({'w' : [[5, 15], [25, 35]]}, {'h' : [[10, 20], [30, 40]]})
+    # a repeated point and an empty slot
+    points[1][0][0][0] = dict(points[0][0][0][0])
+    points[1][1][1][0] = None
+    D, manifest = parameter_sweep(chip, points = points, spacing = [(50, 50), (200, 200)], separation = [False, True],
+                                  label_layer = None)
+    check_manifest(D, manifest, points)
+    builds = {entry['build'] for entry in manifest}
+    assert len(builds) == len({(e['parameters']['w'], e['parameters']['h']) for e in manifest})
+
+def test_sweep_without_points_raises():
+    with pytest.raises(ValueError):
+        parameter_sweep(chip, axes = {'w' : []})
+
+def feed(length):
+    # ports and a label on a sub cell
+    D = Device('feed')
+    line = pg.rectangle((length, 10), layer = 1)
+    line.add_port(name = 'in', midpoint = (0, 5), width = 10, orientation = 180)
+    line.add_label(text = f'length={length}', position = (0, 0), layer = 255)
+    D.add_ref(line, alias = 'line')
+    return D
+
+def tagged(length):
+    D = feed(length)
+    D.shape = {1, 2}
+    return D
+
+def test_parallel_cells_keep_sub_cell_ports_and_labels():
+    cells = build_parallel(feed, [dict(length = 100), None, dict(length = 200)], workers = 2)
+    assert cells[1] is None
+    for cell, length in zip(cells[::2], (100, 200)):
+        assert [(p.name, tuple(p.midpoint)) for p in cell.get_ports()] == [('in', (0, 5))]
+        assert [l.text for l in cell.get_labels()] == [f'length={length}']
+        assert cell['line'].parent.xsize == length
+
+def test_cells_the_arrays_cannot_hold_are_built_in_process():
+    cells = build_parallel(tagged, [dict(length = 100), dict(length = 200)], workers = 2)
+    assert [cell.shape for cell in cells] == [{1, 2}, {1, 2}]
+    assert [cell.xsize for cell in cells] == [100, 200]
@@ -1,109 +1,262 @@
-
+import numpy as np
 from phidl import Device
+from functions import boolean_with_ports, bind_config, config_modules, DesignConfig
+from profiling import profiler
+
+def geometry_state(d):
+    # What a boolean of d depends on: the cells below it, their polygon point lists, reference placements and ports.
+    # gdspy replaces the point lists when a polygon is moved, scaled or filleted, so they are compared by identity.
+    state = []
+    for c in [d, *d.get_dependencies(True)]:
+        state.append(c)
+        state.extend(p.polygons for p in c.polygons)
+        state.extend(c.paths)
+        for r in c.references:
+            state.append((r.ref_cell, tuple(np.ravel(r.origin)), r.rotation, r.magnification, r.x_reflection,
+                          getattr(r, 'columns', 1), getattr(r, 'rows', 1), tuple(np.ravel(getattr(r, 'spacing', ())))))
+    state.extend((p, tuple(np.ravel(p.midpoint)), p.width, p.orientation) for p in d.ports.values())
+    return state
+
+def same_state(a, b):
+    return a is not None and len(a) == len(b) and all(x is y or (type(x) is tuple and x == y) for x, y in zip(a, b))
+
+class ConfigurableDevice(type):
+    # device_X(..., config = DesignConfig(...)) builds with an explicit config instead of the module globals
+    def __call__(cls, *args, **kwargs):
+        # device_EntangleLine takes its own config dict, only a DesignConfig is intercepted
+        if isinstance(kwargs.get('config'), DesignConfig) and cls.__module__ in config_modules:
+            cls = bind_config(cls.__module__, kwargs.pop('config'))[cls.__name__]
+        if profiler.enabled:
+            with profiler.section(cls.__name__):
+                obj = super().__call__(*args, **kwargs)
+        else:
+            obj = super().__call__(*args, **kwargs)
+        # builder name for the DRC, see tag_builder
+        for d in (obj._device, obj._metal, obj._pocket):
+            if getattr(d, 'builder', None) is None:
+                d.builder = cls.__name__
+        return obj
 
-class BaseDevice:
+class BaseDevice(metaclass = ConfigurableDevice):
     count = 0
 
     def __init__(self, name):
-        self.device = Device(name)
-        self.metal  = Device(f'{name}_metal')
-        self.pocket = Device(f'{name}_pocket')
-        self.devices = [self.device, self.metal, self.pocket]
-        cls = self.__class__ 
+        self._device = Device(name)
+        self._metal  = Device(f'{name}_metal')
+        self._pocket = Device(f'{name}_pocket')
+        # Pending affine transform x -> M x + t, applied to all three devices at once
+        self._M = np.eye(2)
+        self._t = np.zeros(2)
+        self._pending = False
+        # metal = pocket NOT device on metal_layer, computed when it is first read
+        self.metal_layer = None
+        self._metal_state = None
+        cls = self.__class__
         if not hasattr(cls, 'count'):
             cls.count = 0
         self.id = cls.count
         cls.count += 1
 
-    def rotate(self, degree):
-        for d in self.devices:
-            d.rotate(degree)
-        return self  
+    # The layouts are transformed when they are read or referenced
+    @property
+    def device(self):
+        self.flush()
+        return self._device
+
+    @device.setter
+    def device(self, value):
+        self.flush()
+        self._device = value
+        self._metal_state = None
+
+    @property
+    def metal(self):
+        self.flush()
+        if self.metal_layer is not None and not self._metal_current():
+            self._metal = Device(self._metal.name)
+            self._metal.add_ref( boolean_with_ports(self._pocket, self._device, "not", layer = self.metal_layer) )
+            self._arm_metal()
+        return self._metal
+
+    @metal.setter
+    def metal(self, value):
+        self.flush()
+        self.metal_layer = None
+        self._metal = value
 
-    def move(self, p):   
-        for d in self.devices:
-            d.move(p)         
+    def derive_metal(self, layer):
+        self.metal_layer = layer
+        self._metal_state = None
         return self
 
-    def movex(self, x):       
-        for d in self.devices:
-            d.movex(x)                      
+    def _geometry_state(self):
+        return geometry_state(self._device) + geometry_state(self._pocket)
+
+    def _arm_metal(self):
+        self._metal_state = self._geometry_state()
+
+    def _metal_current(self):
+        return same_state(self._metal_state, self._geometry_state())
+
+    @property
+    def pocket(self):
+        self.flush()
+        return self._pocket
+
+    @pocket.setter
+    def pocket(self, value):
+        self.flush()
+        self._pocket = value
+        self._metal_state = None
+
+    @property
+    def devices(self):
+        return [self.device, self.metal, self.pocket]
+
+    def _compose(self, M, t):
+        self._M = M @ self._M
+        self._t = M @ self._t + t
+        self._pending = True
         return self
 
-    def movey(self, y):  
-        for d in self.devices:
-            d.movey(y)            
+    def flush(self):
+        if not self._pending:
+            return self
+        M, t = self._M, self._t
+        self._M = np.eye(2)
+        self._t = np.zeros(2)
+        self._pending = False
+
+        # A derived metal that is up to date is transformed with the others, a stale one is rebuilt on access
+        derived = self.metal_layer is not None
+        keep_metal = not derived or self._metal_current()
+        layouts = [self._device, self._pocket] + ([self._metal] if keep_metal else [])
+
+        # M = R(angle) or R(angle) @ reflection about the x axis
+        mirrored = np.linalg.det(M) < 0
+        R = M @ np.diag([1, -1]) if mirrored else M
+        angle = round(float(np.degrees(np.arctan2(R[1, 0], R[0, 0]))), 9)
+        for d in layouts:
+            if mirrored:
+                d.mirror(p1 = (0, 0), p2 = (1, 0))
+            if angle != 0:
+                d.rotate(angle)
+            if t.any():
+                d.move(t)
+        if derived and keep_metal:
+            self._arm_metal()
         return self
-    
+
+    def rotate(self, degree):
+        theta = np.deg2rad(degree)
+        c, s = np.cos(theta), np.sin(theta)
+        return self._compose(np.array([[c, -s], [s, c]]), np.zeros(2))
+
+    def move(self, p):
+        return self._compose(np.eye(2), np.asarray(p, dtype = float))
+
+    def movex(self, x):
+        return self.move((x, 0))
+
+    def movey(self, y):
+        return self.move((0, y))
+
     def mirror(self, p1, p2):
-        for d in self.devices:
-            d.mirror(p1 = p1, p2 = p2)
-        return self
+        p1 = np.asarray(p1, dtype = float)
+        u = np.asarray(p2, dtype = float) - p1
+        u = u / np.linalg.norm(u)
+        H = 2*np.outer(u, u) - np.eye(2)
+        return self._compose(H, p1 - H @ p1)
+
+    def _layout_pairs(self, devices):
+        # A derived metal is rebuilt from device and pocket, the metal of the child is not needed
+        yield self.device, devices.device
+        yield (None, None) if self.metal_layer is not None else (self.metal, devices.metal)
+        yield self.pocket, devices.pocket
 
-    def add_ref(self, devices):    
+    def add_ref(self, devices):
+        self._metal_state = None
         refs = []
-        for a, b in zip(self.devices, devices.devices):        
-            refs.append(a.add_ref(b))
+        for a, b in self._layout_pairs(devices):
+            refs.append(None if a is None else a.add_ref(b))
         return refs # device, metal, pocket
 
+    def add_array(self, devices, columns = 2, rows = 2, spacing = (100, 100)):
+        self._metal_state = None
+        arrays = []
+        for a, b in self._layout_pairs(devices):
+            arrays.append(None if a is None else a.add_array(b, columns = columns, rows = rows, spacing = spacing))
+        return arrays # device, metal, pocket
+
+    @property
+    def bbox(self):
+        if self._pending:
+            M = self._M
+            # Rotations by multiples of 90 degrees and axis mirrors keep the box axis aligned
+            if np.isclose(M[0, 1], 0) and np.isclose(M[1, 0], 0) or np.isclose(M[0, 0], 0) and np.isclose(M[1, 1], 0):
+                (x0, y0), (x1, y1) = self._device.bbox
+                corners = np.array([[x0, y0], [x1, y0], [x0, y1], [x1, y1]]) @ M.T + self._t
+                return np.array([corners.min(axis = 0), corners.max(axis = 0)])
+        return self.device.bbox
+
     @property
     def xmin(self):
-        return self.device.xmin
+        return self.bbox[0][0]
 
     @xmin.setter
     def xmin(self, value):
         dx = value - self.xmin
-        self.movex(dx) 
+        self.movex(dx)
 
     @property
     def xmax(self):
-        return self.device.xmax
+        return self.bbox[1][0]
 
     @xmax.setter
     def xmax(self, value):
         dx = value - self.xmax
-        self.movex(dx) 
+        self.movex(dx)
 
     @property
     def ymin(self):
-        return self.device.ymin
+        return self.bbox[0][1]
 
     @ymin.setter
     def ymin(self, value):
         dy = value - self.ymin
-        self.movey(dy) 
+        self.movey(dy)
 
     @property
     def ymax(self):
-        return self.device.ymax
+        return self.bbox[1][1]
 
     @ymax.setter
     def ymax(self, value):
         dy = value - self.ymax
-        self.movey(dy) 
+        self.movey(dy)
 
     @property
     def x(self):
-        return self.device.x
+        return np.sum(self.bbox, 0)[0] / 2
 
     @x.setter
     def x(self, value):
         dx = value - self.x
-        self.movex(dx) 
+        self.movex(dx)
 
     @property
     def y(self):
-        return self.device.y
+        return np.sum(self.bbox, 0)[1] / 2
 
     @y.setter
     def y(self, value):
         dy = value - self.y
-        self.movey(dy) 
+        self.movey(dy)
 
     @property
     def center(self):
-        return self.device.center
-    
+        return np.sum(self.bbox, 0) / 2
+
     @center.setter
     def center(self, value):
         dist = value - self.center
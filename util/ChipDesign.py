@@ -1,27 +1,26 @@
 import sys
 from qubit_templates import *
 from functions import *
+from cell_cache import cell_cache
 
+@configurable
 def chipdesign_TcSample(frequency):
 
     chipdesign = Device('chipdesign')
 
     # Frame
-    FM=Device('frame')
-    rectangle = pg.rectangle((Frame_size_width, Frame_size_height), Frame_layer)
-    FM.add_ref( pg.invert(rectangle, border = Frame_width, precision = 1e-6, layer = Frame_layer) )
-    FM.center = (0, 0)
+    FM = cell_cache(device_Frame)
     chipdesign.add_ref(FM)
 
     if frequency is None:
         return chipdesign
 
     # Feed line
-    FL = device_FeedLine()
+    FL = cell_cache(device_FeedLine)
     chipdesign.add_ref(FL.device)
 
     # Corner points
-    CP = device_CornerPoints()
+    CP = cell_cache(device_CornerPoints)
     chipdesign.add_ref(CP)
 
     # Resonator
@@ -38,7 +37,7 @@ def chipdesign_TcSample(frequency):
         #norm_to_length = 3250
     )
 
-    R1 = device_Resonator(**resonator_config)
+    R1 = cell_cache(device_Resonator, **resonator_config)
     R1.rotate(-90)
     if FeedLine_path_type == "straight":
         R1.xmin = FL.device.x + 0.5*LaunchPad_trace_width + LaunchPad_trace_gap_width + Feedline_Resonator_gap
@@ -60,7 +59,7 @@ def chipdesign_TcSample(frequency):
         # norm_to_length = 3700
     )
 
-    R2 = device_Resonator(**resonator_config)
+    R2 = cell_cache(device_Resonator, **resonator_config)
     R2.rotate(90)
     if FeedLine_path_type == "straight":
         R2.xmin = FL.device.x + 0.5*LaunchPad_trace_width + LaunchPad_trace_gap_width + Feedline_Resonator_gap
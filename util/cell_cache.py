@@ -0,0 +1,626 @@
+import contextlib
+import hashlib
+import inspect
+import json
+import os
+import sys
+import tempfile
+import types
+import weakref
+from collections import OrderedDict
+from collections.abc import Mapping
+from functools import wraps
+
+import gdspy
+import numpy as np
+import phidl
+from phidl import Device
+from phidl.device_layout import CellArray, Label, _parse_layer
+from BaseDevice import BaseDevice
+from functions import DesignConfig, ConfigNamespace, bind_config, bind_globals, config_modules, config_types, record_reads, note_reads
+
+class UncacheableArgument(TypeError):
+    pass
+
+def canonical(value):
+    if isinstance(value, DesignConfig):
+        return ('DesignConfig', value.hash)
+    if isinstance(value, np.ndarray):
+        return ('ndarray', value.shape, canonical(value.tolist()))
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, type):
+        # config_types is a module global of the builders (from functions import *)
+        return ('type', value.__module__, value.__qualname__)
+    if isinstance(value, Mapping):
+        return tuple(sorted((str(k), canonical(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(canonical(v) for v in value)
+    if isinstance(value, config_types):
+        return value
+    raise UncacheableArgument(f"cannot build a cache key from {type(value).__name__}")
+
+def builder_namespace(builder):
+    builder = inspect.unwrap(builder)
+    if inspect.isclass(builder):
+        # classes bound to a DesignConfig read it through the globals of their methods
+        return getattr(builder.__init__, '__globals__', vars(sys.modules[builder.__module__]))
+    return builder.__globals__
+
+def config_fingerprint(namespace):
+    items = sorted(
+        (k, canonical(v)) for k, v in namespace.items()
+        if not k.startswith('_') and isinstance(v, config_types)
+    )
+    return hashlib.sha1(repr(items).encode()).hexdigest()
+
+def reads_module_globals(builder, kwargs):
+    # A configurable builder of qubit_templates or ChipDesign called without a config reads the globals the
+    # notebooks set (qubit_templates.__dict__.update(config)), it is keyed on its recorded reads all the same
+    if 'config' in kwargs:
+        return False
+    module = getattr(inspect.unwrap(builder), '__module__', None)
+    if module not in config_modules or module not in sys.modules:
+        return False
+    if not (getattr(builder, 'configurable', False) or (inspect.isclass(builder) and issubclass(builder, BaseDevice))):
+        return False
+    return not isinstance(builder_namespace(builder), ConfigNamespace)
+
+def config_namespace(builder, kwargs):
+    # The ConfigNamespace the builder will read, None for builders that read plain module globals
+    config = kwargs.get('config')
+    if isinstance(config, DesignConfig):
+        module = inspect.unwrap(builder).__module__
+        return bind_config(module, config) if module in config_modules else None
+    namespace = builder_namespace(builder)
+    return namespace if isinstance(namespace, ConfigNamespace) else None
+
+def site_key(builder, args, kwargs):
+    # Builder and arguments without the config
+    name = f"{builder.__module__}.{builder.__qualname__}"
+    kwargs = {k: v for k, v in kwargs.items() if k != 'config'}
+    return hashlib.sha1(repr((name, canonical(args), canonical(kwargs))).encode()).hexdigest()
+
+missing = ('missing',)
+
+def config_value(namespace, key):
+    # Builders reading the module globals (namespace None) or bound to them (bind_globals) depend on the value
+    # in every config module, a key read by a nested builder comes from that builder's module
+    if namespace is None or '__module_globals__' in namespace:
+        return tuple(canonical(vars(sys.modules[m]).get(key, missing)) for m in config_modules if m in sys.modules)
+    return canonical(dict.get(namespace, key, missing))
+
+def dependency_key(site, keys, namespace):
+    # Site plus the current values of the config keys it read, namespace None for the module globals
+    values = tuple((k, config_value(namespace, k)) for k in sorted(keys))
+    return hashlib.sha1(repr((site, values)).encode()).hexdigest()
+
+def config_changes(old, new):
+    # Keys added, removed or changed between two configs
+    return {k for k in set(old) | set(new) if k not in old or k not in new or canonical(old[k]) != canonical(new[k])}
+
+class DependencyGraph:
+    # Config keys read by every cached call (site) when it was last built, nested calls included.
+    # A cell is found again as long as none of its keys changed. With a disk cache the graph is kept in
+    # dependencies.json next to the cells, so the next run only rebuilds the sites touched by a yaml change.
+    filename = 'dependencies.json'
+
+    def __init__(self):
+        self.sites = {}
+        self.directory = None
+
+    def attach(self, directory):
+        if directory == self.directory:
+            return
+        self.directory = directory
+        path = os.path.join(directory, self.filename)
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    stored = json.load(f)
+                for site, entry in stored.items():
+                    self.sites.setdefault(site, entry)
+            except (OSError, ValueError):
+                pass
+
+    def keys(self, site):
+        entry = self.sites.get(site)
+        return None if entry is None else entry['keys']
+
+    def record(self, site, builder, args, kwargs, keys):
+        entry = dict(builder = f"{builder.__module__}.{builder.__qualname__}",
+                     arguments = repr((args, {k: v for k, v in kwargs.items() if k != 'config'})),
+                     keys = sorted(keys))
+        if self.sites.get(site) == entry:
+            return
+        self.sites[site] = entry
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok = True)
+            fd, tmp = tempfile.mkstemp(suffix = '.json', dir = self.directory)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.sites, f, indent = 1, sort_keys = True)
+            os.replace(tmp, os.path.join(self.directory, self.filename))
+
+    def affected(self, old, new):
+        # Recorded calls whose cells a change from config old to new invalidates
+        changed = config_changes(old, new)
+        return [dict(entry, changed = sorted(changed & set(entry['keys'])))
+                for entry in self.sites.values() if changed & set(entry['keys'])]
+
+    def clear(self):
+        self.sites = {}
+        if self.directory is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.directory, self.filename))
+
+def builder_key(builder, args, kwargs):
+    name = f"{builder.__module__}.{builder.__qualname__}"
+    if isinstance(kwargs.get('config'), DesignConfig):
+        # an explicit config replaces the module globals
+        fingerprint = None
+    else:
+        fingerprint = config_fingerprint(builder_namespace(builder))
+    payload = (name, canonical(args), canonical(kwargs), fingerprint)
+    return hashlib.sha1(repr(payload).encode()).hexdigest()
+
+# Cells handed out by a CellCache, every caller gets the same object
+shared_cells = weakref.WeakSet()
+
+def is_shared(cell):
+    return cell in shared_cells
+
+def reference_view(cell):
+    # Plain Devices are shared as is, the caller only places them with add_ref.
+    # BaseDevices are moved by the caller, so wrap the shared cells in references.
+    if not isinstance(cell, BaseDevice):
+        return cell
+    view = BaseDevice.__new__(type(cell))
+    BaseDevice.__init__(view, cell.device.name)
+    view.id = cell.id
+    if cell.metal_layer is not None:
+        view.derive_metal(cell.metal_layer)
+    device_ref, metal_ref, pocket_ref = view.add_ref(cell)
+    for ref, d in ((device_ref, view.device), (pocket_ref, view.pocket)):
+        for port in ref.ports.values():
+            d.add_port(port = port)
+    if metal_ref is not None:
+        for port in metal_ref.ports.values():
+            view.metal.add_port(port = port)
+    return view
+
+def stored_layouts(cell):
+    # A derived metal is not stored, it is rebuilt from device and pocket when it is read
+    prefixes = ('device', 'pocket') if cell.metal_layer is not None else ('device', 'metal', 'pocket')
+    return [(prefix, getattr(cell, prefix)) for prefix in prefixes]
+
+# Bump when the on-disk layout changes
+disk_format = 4
+
+# Modules whose sources are part of the disk cache key
+library_directory = os.path.dirname(os.path.abspath(__file__))
+
+def library_file(module):
+    source = getattr(module, '__file__', None)
+    return source if source and os.path.dirname(os.path.abspath(source)) == library_directory else None
+
+def library_sources(module):
+    # Source files of the util modules the module uses, directly or through one another
+    sources, seen, stack = set(), set(), [module]
+    while stack:
+        m = stack.pop()
+        if id(m) in seen:
+            continue
+        seen.add(id(m))
+        if m is not module:
+            if library_file(m) is None:
+                continue
+            sources.add(library_file(m))
+        for v in list(vars(m).values()):
+            name = v.__name__ if isinstance(v, types.ModuleType) else getattr(v, '__module__', None)
+            if isinstance(name, str) and name in sys.modules:
+                stack.append(sys.modules[name])
+    if library_file(module) is not None:
+        sources.add(library_file(module))
+    return sorted(sources)
+
+_source_digests = {}
+
+def source_digest(path):
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    if _source_digests.get(path, (None,))[0] != stamp:
+        with open(path, 'rb') as f:
+            _source_digests[path] = (stamp, hashlib.sha1(f.read()).hexdigest())
+    return _source_digests[path][1]
+
+def library_version(builder):
+    # Cells are stale when phidl, the builder source or one of the util modules it imports changes
+    builder = inspect.unwrap(builder)
+    module = sys.modules.get(builder.__module__)
+    digest = hashlib.sha1()
+    if library_file(module) is None:
+        # builders defined in a notebook or script
+        try:
+            digest.update(inspect.getsource(builder).encode())
+        except (OSError, TypeError):
+            pass
+    for source in library_sources(module):
+        digest.update(source_digest(source).encode())
+    return f"{disk_format}-{phidl.__version__}-{digest.hexdigest()}"
+
+class UncacheableCell(TypeError):
+    pass
+
+# Attributes every cell has. The others (builder name, attributes set by a BaseDevice subclass, Device.info)
+# are stored as json, cells with attributes json cannot hold are not stored.
+device_attributes = frozenset(vars(Device('attributes'))) - {'info'}
+base_device_attributes = frozenset(('_device', '_metal', '_pocket', '_M', '_t', '_pending', 'metal_layer', '_metal_state', 'id'))
+
+def cell_attributes(obj, common):
+    attributes = {k: v for k, v in vars(obj).items() if k not in common}
+    try:
+        text = json.dumps(attributes, sort_keys = True)
+    except (TypeError, ValueError):
+        raise UncacheableCell(f"{type(obj).__name__} has attributes that cannot be stored") from None
+    if json.loads(text) != attributes:
+        raise UncacheableCell(f"{type(obj).__name__} has attributes that cannot be stored")
+    return np.array(text)
+
+def restore_attributes(obj, text):
+    for k, v in json.loads(str(text)).items():
+        setattr(obj, k, v)
+
+def cell_hierarchy(tops):
+    # Distinct cells of tops and of everything they reference, parents first in reference order
+    cells, index = [], {}
+    stack = list(reversed(tops))
+    while stack:
+        d = stack.pop()
+        if id(d) in index:
+            continue
+        index[id(d)] = len(cells)
+        cells.append(d)
+        stack.extend(reversed([r.parent for r in d.references]))
+    return cells, index
+
+def optional(value):
+    return np.nan if value is None else float(value)
+
+def restored(value):
+    return None if np.isnan(value) else float(value)
+
+label_anchors = {code: name for name, code in reversed(gdspy.Label._anchor.items())}
+
+def offsets(counts):
+    return np.concatenate([[0], np.cumsum(counts, dtype = np.int64)]).astype(np.int64)
+
+def cells_to_arrays(tops):
+    # The cells of tops and below as flat arrays: polygons, ports, labels and json attributes per cell and
+    # the references between them (arrays and aliases included), so ports of sub cells (get_ports()) and
+    # labels survive and shared sub cells are stored once.
+    cells, index = cell_hierarchy(tops)
+    specs, vertex_counts, points = [], [], []
+    ports, labels, references, aliases = [], [], [], []
+    counts = np.zeros((4, len(cells)), dtype = np.int64)
+    for i, d in enumerate(cells):
+        for polygon in d.polygons:
+            for p, layer, datatype in zip(polygon.polygons, polygon.layers, polygon.datatypes):
+                specs.append((layer, datatype))
+                vertex_counts.append(len(p))
+                points.append(p)
+                counts[0, i] += 1
+        ports += d.ports.values()
+        labels += d.labels
+        first = len(references)
+        references += d.references
+        for name, r in d.aliases.items():
+            k = next((k for k, q in enumerate(d.references) if q is r), None)
+            if k is not None:
+                aliases.append((name, first + k))
+        counts[1:, i] = len(d.ports), len(d.labels), len(d.references)
+    return {
+        'top_cells'              : np.array([index[id(d)] for d in tops], dtype = np.int64),
+        'cell_names'             : np.array([d.name for d in cells], dtype = str),
+        'cell_attributes'        : np.array([cell_attributes(d, device_attributes) for d in cells], dtype = str),
+        'cell_polygons'          : offsets(counts[0]),
+        'polygon_specs'          : np.array(specs, dtype = np.int64).reshape(-1, 2),
+        'polygon_offsets'        : offsets(vertex_counts),
+        'points'                 : np.concatenate(points).astype(np.float64) if points else np.zeros((0, 2)),
+        'cell_ports'             : offsets(counts[1]),
+        # json keeps integer port names apart from strings
+        'port_names'             : np.array([json.dumps(p.name) for p in ports], dtype = str),
+        'port_midpoints'         : np.array([p.midpoint for p in ports], dtype = np.float64).reshape(-1, 2),
+        'port_widths'            : np.array([p.width for p in ports], dtype = np.float64),
+        'port_orientations'      : np.array([optional(p.orientation) for p in ports], dtype = np.float64),
+        'cell_labels'            : offsets(counts[2]),
+        'label_texts'            : np.array([l.text for l in labels], dtype = str),
+        'label_positions'        : np.array([l.position for l in labels], dtype = np.float64).reshape(-1, 2),
+        'label_specs'            : np.array([(l.layer, l.texttype) for l in labels], dtype = np.int64).reshape(-1, 2),
+        'label_anchors'          : np.array([l.anchor for l in labels], dtype = np.int64),
+        'label_transforms'       : np.array([(optional(l.rotation), optional(l.magnification), bool(l.x_reflection))
+                                             for l in labels], dtype = np.float64).reshape(-1, 3),
+        'cell_references'        : offsets(counts[3]),
+        'reference_cells'        : np.array([index[id(r.parent)] for r in references], dtype = np.int64),
+        'reference_origins'      : np.array([r.origin for r in references], dtype = np.float64).reshape(-1, 2),
+        'reference_transforms'   : np.array([(optional(r.rotation), optional(r.magnification), bool(r.x_reflection))
+                                             for r in references], dtype = np.float64).reshape(-1, 3),
+        # columns, rows, spacing, columns = 0 for a single reference
+        'reference_arrays'       : np.array([(r.columns, r.rows, *r.spacing) if isinstance(r, CellArray) else (0, 0, 0, 0)
+                                             for r in references], dtype = np.float64).reshape(-1, 4),
+        'alias_names'            : np.array([name for name, _ in aliases], dtype = str),
+        'alias_references'       : np.array([k for _, k in aliases], dtype = np.int64),
+    }
+
+def arrays_to_cells(data):
+    # The cells of cells_to_arrays, in the same order (the top cells are cells[data['top_cells']])
+    cells = [Device(str(name)) for name in data['cell_names']]
+    points, vertex_offsets = data['points'], data['polygon_offsets']
+    references = []
+    for i, d in enumerate(cells):
+        for j in range(*data['cell_polygons'][i:i + 2]):
+            layer, datatype = data['polygon_specs'][j]
+            d.add_polygon(points[vertex_offsets[j]:vertex_offsets[j + 1]], layer = (int(layer), int(datatype)))
+        for j in range(*data['cell_ports'][i:i + 2]):
+            d.add_port(name = json.loads(str(data['port_names'][j])), midpoint = data['port_midpoints'][j],
+                       width = float(data['port_widths'][j]), orientation = restored(data['port_orientations'][j]))
+        for j in range(*data['cell_labels'][i:i + 2]):
+            rotation, magnification, x_reflection = data['label_transforms'][j]
+            layer, texttype = data['label_specs'][j]
+            d.add(Label(text = str(data['label_texts'][j]), position = data['label_positions'][j],
+                        anchor = label_anchors[int(data['label_anchors'][j])], rotation = restored(rotation),
+                        magnification = restored(magnification), x_reflection = bool(x_reflection),
+                        layer = int(layer), texttype = int(texttype)))
+        for j in range(*data['cell_references'][i:i + 2]):
+            child = cells[data['reference_cells'][j]]
+            columns, rows, dx, dy = data['reference_arrays'][j]
+            r = d.add_array(child, columns = int(columns), rows = int(rows), spacing = (dx, dy)) if columns else d.add_ref(child)
+            rotation, magnification, x_reflection = data['reference_transforms'][j]
+            r.origin = tuple(data['reference_origins'][j])
+            r.rotation, r.magnification, r.x_reflection = restored(rotation), restored(magnification), bool(x_reflection)
+            references.append((d, r))
+    for name, j in zip(data['alias_names'], data['alias_references']):
+        d, r = references[j]
+        d.aliases[str(name)] = r
+    for d, text in zip(cells, data['cell_attributes']):
+        restore_attributes(d, text)
+    return cells
+
+def checksum(arrays):
+    h = hashlib.sha1()
+    for k in sorted(arrays):
+        h.update(k.encode())
+        h.update(np.ascontiguousarray(arrays[k]).tobytes())
+    return np.array(h.hexdigest())
+
+class DiskCellCache:
+    # Finished cells kept between runs, one .npz file per cell with its hierarchy (see cells_to_arrays).
+    # The key holds the builder inputs, the config, the phidl version and the sources of the util modules the
+    # builder uses, call invalidate() after changing other modules. Corrupt entries fail the checksum and are
+    # rebuilt, the least recently used entries are removed once the directory exceeds max_bytes.
+    # Every call returns a new Device, safe to modify (e.g. the wafer the chips are added to).
+    def __init__(self, directory = 'output/cell_cache', max_bytes = 2*1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def key(self, builder, args, kwargs):
+        return self.versioned(builder_key(builder, args, kwargs), builder)
+
+    def versioned(self, key, builder):
+        return hashlib.sha1(f"{key}-{library_version(builder)}".encode()).hexdigest()
+
+    def __call__(self, builder, *args, **kwargs):
+        try:
+            key = self.key(builder, args, kwargs)
+        except UncacheableArgument:
+            self.misses += 1
+            return builder(*args, **kwargs)
+
+        cell = self.load(key, builder)
+        if cell is not None:
+            self.hits += 1
+            return cell
+
+        self.misses += 1
+        cell = builder(*args, **kwargs)
+        self.store(key, cell)
+        return cell
+
+    def load(self, key, builder):
+        path = self.path(key)
+        try:
+            with np.load(path, allow_pickle = False) as f:
+                data = {k: f[k] for k in f.files}
+            stored = data.pop('checksum')
+            if str(data['key']) != key or str(stored) != str(checksum(data)):
+                raise ValueError(f"stale cache entry {path}")
+            cells = arrays_to_cells(data)
+            if str(data['kind']) == 'BaseDevice':
+                cls = builder if inspect.isclass(builder) else BaseDevice
+                cell = cls.__new__(cls)
+                tops = [cells[k] for k in data['top_cells']]
+                BaseDevice.__init__(cell, tops[0].name)
+                cell.id = int(data['id'])
+                if 'metal_layer' in data:
+                    cell.derive_metal(tuple(int(x) for x in data['metal_layer']))
+                for (prefix, _), d in zip(stored_layouts(cell), tops):
+                    setattr(cell, prefix, d)
+                restore_attributes(cell, data['attributes'])
+            else:
+                cell = cells[data['top_cells'][0]]
+        except FileNotFoundError:
+            # a miss, also when another process sharing the directory just removed it
+            return None
+        except Exception:
+            # Corrupt or stale entry, rebuild it
+            self.rebuilds += 1
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            return None
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(path)
+        return cell
+
+    def store(self, key, cell):
+        data = dict(key = np.array(key))
+        try:
+            if isinstance(cell, BaseDevice):
+                data['kind'] = np.array('BaseDevice')
+                data['id'] = np.array(cell.id)
+                data['attributes'] = cell_attributes(cell, base_device_attributes)
+                if cell.metal_layer is not None:
+                    data['metal_layer'] = np.array(_parse_layer(cell.metal_layer))
+                data.update(cells_to_arrays([d for _, d in stored_layouts(cell)]))
+            elif isinstance(cell, Device):
+                data['kind'] = np.array('Device')
+                data.update(cells_to_arrays([cell]))
+            else:
+                return
+        except UncacheableCell:
+            # kept in memory only
+            return
+        data['checksum'] = checksum(data)
+
+        os.makedirs(self.directory, exist_ok = True)
+        # not .npz, so evict() in another process does not take it for an entry
+        fd, tmp = tempfile.mkstemp(suffix = '.tmp', dir = self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **data)
+        os.replace(tmp, self.path(key))
+        self.evict()
+
+    def evict(self):
+        # Remove the least recently used entries until the directory fits in max_bytes
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                with contextlib.suppress(FileNotFoundError):
+                    st = os.stat(os.path.join(self.directory, name))
+                    entries.append((st.st_mtime, st.st_size, name))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def invalidate(self):
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz') or name == DependencyGraph.filename:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(self.directory, name))
+
+    def info(self):
+        return dict(hits = self.hits, misses = self.misses, rebuilds = self.rebuilds,
+                    directory = self.directory, max_bytes = self.max_bytes)
+
+class CellCache:
+    # Builds each distinct cell once and hands back the shared cell: plain Devices as is (only place them
+    # with add_ref), BaseDevices as references that can be moved. Keeps the maxsize most recently used cells,
+    # disk = DiskCellCache(...) keeps them between runs as well.
+    # Builders bound to a DesignConfig and configurable builders reading the module globals are keyed on the
+    # config keys they read (see DependencyGraph), other builders reading module globals on a fingerprint of all of them.
+    def __init__(self, maxsize = 256, disk = None):
+        self.maxsize = maxsize
+        self.disk = disk
+        self.cells = OrderedDict()
+        self.graph = DependencyGraph()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, builder, *args, **kwargs):
+        if self.disk is not None:
+            self.graph.attach(self.disk.directory)
+        try:
+            namespace = config_namespace(builder, kwargs)
+            module_globals = namespace is None and reads_module_globals(builder, kwargs)
+            recorded = namespace is not None or module_globals
+            if not recorded:
+                key = builder_key(builder, args, kwargs)
+            else:
+                site = site_key(builder, args, kwargs)
+                keys = self.graph.keys(site)
+                key = None if keys is None else dependency_key(site, keys, namespace)
+        except UncacheableArgument:
+            self.misses += 1
+            return builder(*args, **kwargs)
+
+        if key in self.cells:
+            self.hits += 1
+            self.cells.move_to_end(key)
+            if recorded:
+                # an enclosing cached call depends on these keys too
+                note_reads(keys)
+            return reference_view(self.cells[key][1])
+
+        self.misses += 1
+        if not recorded:
+            cell = self.disk(builder, *args, **kwargs) if self.disk is not None else builder(*args, **kwargs)
+        else:
+            cell = None
+            if key is not None and self.disk is not None:
+                cell = self.disk.load(self.disk.versioned(key, builder), builder)
+            if cell is not None:
+                self.disk.hits += 1
+                note_reads(keys)
+            else:
+                # bound to the current module globals, so the reads are recorded
+                build = builder
+                if module_globals:
+                    target = inspect.unwrap(builder)
+                    build = bind_globals(target.__module__)[target.__name__]
+                with record_reads() as reads:
+                    cell = build(*args, **kwargs)
+                self.graph.record(site, builder, args, kwargs, reads)
+                key = dependency_key(site, reads, namespace)
+                if self.disk is not None:
+                    self.disk.misses += 1
+                    self.disk.store(self.disk.versioned(key, builder), cell)
+        self.cells[key] = (builder, cell)
+        shared_cells.add(cell)
+        while len(self.cells) > self.maxsize:
+            self.cells.popitem(last = False)
+        return reference_view(cell)
+
+    def affected(self, old, new):
+        # Cached calls that have to be rebuilt when the config changes from old to new:
+        # [dict(builder, arguments, keys, changed)], from the recorded reads of the last builds
+        if self.disk is not None:
+            self.graph.attach(self.disk.directory)
+        return self.graph.affected(old, new)
+
+    def cached(self, builder):
+        @wraps(builder)
+        def wrapper(*args, **kwargs):
+            return self(builder, *args, **kwargs)
+        return wrapper
+
+    def invalidate(self, builder = None):
+        # Drops cells from memory, the disk cache and the recorded reads are kept
+        if builder is None:
+            self.cells.clear()
+            return
+        builder = getattr(builder, '__wrapped__', builder)
+        for key in [k for k, (b, _) in self.cells.items() if b is builder]:
+            del self.cells[key]
+
+    def clear_disk(self):
+        # Drops every cell, in memory and on disk, and the recorded reads
+        self.cells.clear()
+        self.graph.clear()
+        if self.disk is not None:
+            self.disk.invalidate()
+
+    def info(self):
+        return dict(hits = self.hits, misses = self.misses, size = len(self.cells), maxsize = self.maxsize)
+
+cell_cache = CellCache()
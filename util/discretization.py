@@ -0,0 +1,64 @@
+import math
+from collections.abc import Mapping
+from numbers import Real
+
+class DiscretizationProfile:
+    # Maximum chord error [um] of the polygons that approximate arcs, circles and fillets.
+    # layers overrides the tolerance per GDS layer, tolerance = None keeps the fixed point counts of the builders.
+    def __init__(self, tolerance = None, layers = {}, minimum_points = 8):
+        self.tolerance = tolerance
+        self.layers = {int(k): v for k, v in dict(layers).items()}
+        self.minimum_points = minimum_points
+
+    def __repr__(self):
+        return f"DiscretizationProfile(tolerance = {self.tolerance}, layers = {self.layers})"
+
+    def tolerance_for(self, layer = None):
+        if layer is not None:
+            layer = layer[0] if isinstance(layer, (list, tuple)) else layer
+            if int(layer) in self.layers:
+                return self.layers[int(layer)]
+        return self.tolerance
+
+    def points_per_turn(self, radius, layer = None, default = 720, angle = 360):
+        # Points per 360 degrees (num_pts of pp.arc, points_per_2pi of fillet) so that the chord error
+        # r(1 - cos(step/2)) of an arc of the given angle stays within the tolerance.
+        # pp.arc truncates num_pts*angle/360, the count is rounded up so that the arc still gets enough points.
+        tolerance = self.tolerance_for(layer)
+        if tolerance is None or not isinstance(radius, Real) or radius <= 0:
+            return default
+        angle = abs(angle)
+        if tolerance >= radius:
+            segments = 1
+        else:
+            segments = math.ceil(math.radians(angle)/(2*math.acos(1 - tolerance/radius)))
+        return max(self.minimum_points, math.ceil((segments + 1)*360/angle))
+
+    def angle_resolution(self, radius, layer = None, default = 2.5):
+        # Degrees per point for pg.circle
+        if self.tolerance_for(layer) is None:
+            return default
+        # pg.circle has ceil(360/angle_resolution) segments
+        tolerance = self.tolerance_for(layer)
+        segments = 1 if tolerance >= radius else math.ceil(math.pi/math.acos(1 - tolerance/radius))
+        return 360/max(self.minimum_points, segments)
+
+# legacy : the point counts the builders always used (720 points per turn for pp.arc, 2.5 deg for circles, 128 for fillets)
+# draft  : coarse previews
+# fine   : fab tolerance, override the EBL layers with layers = {...} for finer junctions
+profiles = {
+    'legacy' : DiscretizationProfile(),
+    'draft'  : DiscretizationProfile(tolerance = 1.0),
+    'fine'   : DiscretizationProfile(tolerance = 0.01),
+}
+
+def discretization_profile(spec):
+    # A profile name, a DiscretizationProfile or a mapping like {'tolerance': 0.05, 'layers': {1: 0.002}}
+    if isinstance(spec, DiscretizationProfile):
+        return spec
+    if isinstance(spec, Mapping):
+        return DiscretizationProfile(spec.get('tolerance'), spec.get('layers', {}))
+    try:
+        return profiles[spec]
+    except KeyError:
+        raise ValueError(f"unknown discretization profile {spec}, known profiles are {', '.join(profiles)}") from None
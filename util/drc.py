@@ -0,0 +1,581 @@
+import math
+from collections.abc import Mapping
+from numbers import Real
+
+import numpy as np
+import gdspy
+from phidl.device_layout import _parse_layer
+from profiling import profiled
+
+# width     : polygons of layer are at least min wide
+# spacing   : polygons of layer are at least min apart (notches included),
+#             between = [builder or cell names] only checks pairs of different instances of these builders
+# enclosure : polygons of layer are inside polygons of other with a margin of min
+# keepout   : polygons of layer keep min away from polygons of other (or from box = [[x0, y0], [x1, y1]])
+rule_types = ('width', 'spacing', 'enclosure', 'keepout')
+
+# Coordinates are merged on this grid [um]
+precision = 1e-4
+
+class Rule:
+    __slots__ = ('rule', 'layer', 'min', 'other', 'between', 'box', 'name')
+
+    def __init__(self, rule, layer, min, other = None, between = None, box = None, name = None):
+        if rule not in rule_types:
+            raise ValueError(f"DRC rule {rule} must be one of {', '.join(rule_types)}")
+        if rule == 'enclosure' and other is None:
+            raise ValueError("DRC enclosure rule needs other = enclosing layer")
+        if rule == 'keepout' and other is None and box is None:
+            raise ValueError("DRC keepout rule needs other = layer or box = [[x0, y0], [x1, y1]]")
+        if between is not None and rule != 'spacing':
+            raise ValueError("DRC between = [...] is only supported by spacing rules")
+        if not isinstance(min, Real) or min < 0:
+            raise ValueError(f"DRC rule {rule} min {min} must be a non negative number")
+        self.rule = rule
+        self.layer = _parse_layer(layer)
+        self.min = float(min)
+        self.other = None if other is None else _parse_layer(other)
+        self.between = None if between is None else tuple(between)
+        self.box = None if box is None else np.array(box, dtype = float).reshape(2, 2)
+        self.name = name or f"{rule} {self.layer[0]}"
+
+    def __repr__(self):
+        return f"Rule({self.name}: {self.rule} layer {self.layer} min {self.min})"
+
+def parse_rules(rules, namespace = {}):
+    # Rules from the DRC section of the config (a list of mappings), a string value of
+    # min, layer or other names a config key, e.g. min: Feedline_Resonator_gap
+    parsed = []
+    for spec in rules or ():
+        if isinstance(spec, Rule):
+            parsed.append(spec)
+            continue
+        if not isinstance(spec, Mapping):
+            raise ValueError(f"DRC rule {spec} must be a mapping")
+        spec = dict(spec)
+        for key in ('min', 'layer', 'other'):
+            value = spec.get(key)
+            if isinstance(value, str):
+                if value not in namespace:
+                    raise ValueError(f"DRC rule {spec}: {key} {value} is not a config key")
+                spec[key] = namespace[value]
+        try:
+            parsed.append(Rule(**spec))
+        except TypeError as e:
+            raise ValueError(f"invalid DRC rule {spec}: {e}") from None
+    return parsed
+
+class Violation:
+    __slots__ = ('rule', 'layer', 'x', 'y', 'distance', 'limit', 'builders', 'paths')
+
+    # distance is None for a polygon that is not enclosed at all, 0 for overlaps
+    def __init__(self, rule, layer, x, y, distance, limit, builders, paths):
+        self.rule = rule
+        self.layer = layer
+        self.x = x
+        self.y = y
+        self.distance = distance
+        self.limit = limit
+        self.builders = builders
+        self.paths = paths
+
+    def __repr__(self):
+        distance = 'not enclosed' if self.distance is None else f"{self.distance:.4g} < {self.limit:.4g}"
+        return f"Violation({self.rule} at ({self.x:.3f}, {self.y:.3f}): {distance}, {' / '.join(self.builders)})"
+
+# Geometry
+
+def polygon_area(points):
+    x, y = points.T
+    return 0.5*(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+def bounding_boxes(shapes):
+    if not shapes:
+        return np.zeros((0, 4))
+    return np.array([np.concatenate([s.min(axis = 0), s.max(axis = 0)]) for s in shapes])
+
+def merge(polygons):
+    # Union of the polygons, holes stay connected to their outer boundary (keyholes)
+    if not polygons:
+        return []
+    merged = gdspy.boolean(polygons, None, 'or', precision = precision, max_points = 0)
+    return [] if merged is None else [np.asarray(p, dtype = float) for p in merged.polygons]
+
+def shape_edges(shapes):
+    # Start and end points, shape index and outward normal of the edges of the shapes.
+    # Zero length edges and keyhole cuts (an edge and its reverse in the same shape) are dropped.
+    if not shapes:
+        return np.zeros((0, 2)), np.zeros((0, 2)), np.zeros(0, dtype = np.int64), np.zeros((0, 2))
+    counts = np.array([len(s) for s in shapes])
+    start = np.concatenate(shapes)
+    end = np.concatenate([np.roll(s, -1, axis = 0) for s in shapes])
+    shape = np.repeat(np.arange(len(shapes)), counts)
+    orientation = np.repeat(np.sign([polygon_area(s) for s in shapes]), counts)
+    d = end - start
+    length = np.hypot(*d.T)
+    keep = length > 0.1*precision
+
+    q = np.round(np.hstack([start, end])/precision).astype(np.int64)
+    forward = np.column_stack([shape, q])
+    reverse = np.column_stack([shape, q[:, [2, 3, 0, 1]]])
+    _, inverse = np.unique(np.concatenate([forward, reverse]), axis = 0, return_inverse = True)
+    inverse = inverse.ravel()
+    keep &= ~np.isin(inverse[:len(q)], inverse[len(q):])
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        normal = np.column_stack([d[:, 1], -d[:, 0]])*(orientation/length)[:, None]
+    return start[keep], end[keep], shape[keep], normal[keep]
+
+def join_level(boxes_a, boxes_b, distance, size, select):
+    # Pairs of boxes of a (grown by distance) and b that share a cell of a hashed uniform grid.
+    # A pair is only taken in the cell holding the lower left corner of the overlap, so it is found once.
+    lo_a = np.floor((boxes_a[:, :2] - distance)/size).astype(np.int64)
+    lo_b = np.floor(boxes_b[:, :2]/size).astype(np.int64)
+
+    def cells(boxes, lo, margin):
+        hi = np.floor((boxes[:, 2:] + margin)/size).astype(np.int64)
+        nx, ny = hi[:, 0] - lo[:, 0] + 1, hi[:, 1] - lo[:, 1] + 1
+        counts = nx*ny
+        ids = np.repeat(np.arange(len(boxes)), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return ids, lo[ids, 0] + k % nx[ids], lo[ids, 1] + k // nx[ids]
+
+    ids_a, ix_a, iy_a = cells(boxes_a, lo_a, distance)
+    ids_b, ix_b, iy_b = cells(boxes_b, lo_b, 0)
+    keys_a, keys_b = ix_a*(1 << 32) + iy_a, ix_b*(1 << 32) + iy_b
+    order = np.argsort(keys_b, kind = 'stable')
+    ids_b, keys_b = ids_b[order], keys_b[order]
+    left = np.searchsorted(keys_b, keys_a, 'left')
+    counts = np.searchsorted(keys_b, keys_a, 'right') - left
+    entry = np.repeat(np.arange(len(keys_a)), counts)
+    i = ids_a[entry]
+    j = ids_b[np.repeat(left, counts) + np.arange(len(entry)) - np.repeat(np.cumsum(counts) - counts, counts)]
+
+    corner = np.maximum(lo_a[i], lo_b[j])
+    keep = (corner[:, 0] == ix_a[entry]) & (corner[:, 1] == iy_a[entry])
+    i, j = i[keep], j[keep]
+    if select is not None:
+        keep = select(i, j)
+        i, j = i[keep], j[keep]
+    a, b = boxes_a[i], boxes_b[j]
+    gap_x = np.maximum(a[:, 0], b[:, 0]) - np.minimum(a[:, 2], b[:, 2])
+    gap_y = np.maximum(a[:, 1], b[:, 1]) - np.minimum(a[:, 3], b[:, 3])
+    keep = (gap_x <= distance) & (gap_y <= distance)
+    return i[keep], j[keep]
+
+def grid_join(boxes_a, boxes_b, distance, select = None):
+    # Candidate pairs (i, j) of boxes of a and b that are at most distance apart.
+    # Boxes go to the level of a hierarchy of hashed grids (cell size doubling per level) where they span
+    # about 2 x 2 cells, and a pair is found on the coarser level of its two boxes. The grids can span a
+    # whole wafer and the work grows with the number of boxes, long edges (frames, the wafer outline) included.
+    # select(i, j) drops pairs before the exact box test.
+    empty = np.zeros(0, dtype = np.int64)
+    if len(boxes_a) == 0 or len(boxes_b) == 0:
+        return empty, empty
+    extent_a = (boxes_a[:, 2:] - boxes_a[:, :2]).max(axis = 1)
+    extent_b = (boxes_b[:, 2:] - boxes_b[:, :2]).max(axis = 1)
+    base = max(distance, 2*float(np.median(np.concatenate([extent_a, extent_b]))), 10*precision)
+    level = lambda extent: np.maximum(0, np.ceil(np.log2(np.maximum(extent, base)/base))).astype(np.int64)
+    level_a, level_b = level(extent_a), level(extent_b)
+
+    found_i, found_j = [], []
+    for L in np.union1d(level_a, level_b):
+        for a, b in ((np.flatnonzero(level_a <= L), np.flatnonzero(level_b == L)),
+                     (np.flatnonzero(level_a == L), np.flatnonzero(level_b < L))):
+            if len(a) == 0 or len(b) == 0:
+                continue
+            sub = None if select is None else (lambda a, b: lambda i, j: select(a[i], b[j]))(a, b)
+            i, j = join_level(boxes_a[a], boxes_b[b], distance, base*2.0**L, sub)
+            found_i.append(a[i])
+            found_j.append(b[j])
+    if not found_i:
+        return empty, empty
+    return np.concatenate(found_i), np.concatenate(found_j)
+
+def edge_boxes(start, end):
+    return np.hstack([np.minimum(start, end), np.maximum(start, end)])
+
+def project(p, s0, s1):
+    d = s1 - s0
+    length2 = np.einsum('ij,ij->i', d, d)
+    t = np.clip(np.einsum('ij,ij->i', p - s0, d)/length2, 0, 1)
+    return s0 + t[:, None]*d
+
+def segment_distance(a0, a1, b0, b1):
+    # Distance, closest points and proper crossings of the segments a0-a1 and b0-b1
+    candidates = [(project(b0, a0, a1), b0), (project(b1, a0, a1), b1), (a0, project(a0, b0, b1)), (a1, project(a1, b0, b1))]
+    distances = np.array([np.hypot(*(pb - pa).T) for pa, pb in candidates])
+    best = np.argmin(distances, axis = 0)
+    index = np.arange(len(a0))
+    pa = np.stack([c[0] for c in candidates])[best, index]
+    pb = np.stack([c[1] for c in candidates])[best, index]
+    distance = distances[best, index]
+
+    cross = lambda u, v: u[:, 0]*v[:, 1] - u[:, 1]*v[:, 0]
+    o1, o2 = cross(a1 - a0, b0 - a0), cross(a1 - a0, b1 - a0)
+    o3, o4 = cross(b1 - b0, a0 - b0), cross(b1 - b0, a1 - b0)
+    crossing = (o1*o2 < 0) & (o3*o4 < 0)
+    if crossing.any():
+        t = o3[crossing]/(o3[crossing] - o4[crossing])
+        point = a0[crossing] + t[:, None]*(a1[crossing] - a0[crossing])
+        pa[crossing] = pb[crossing] = point
+        distance[crossing] = 0
+    return distance, pa, pb, crossing
+
+def inside(points, shapes):
+    # Even-odd test of each point against the shape with the same index
+    result = np.zeros(len(points), dtype = bool)
+    for k, (p, s) in enumerate(zip(points, shapes)):
+        x0, y0 = s.T
+        x1, y1 = np.roll(s, -1, axis = 0).T
+        upward = (y0 <= p[1]) != (y1 <= p[1])
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            x = x0 + (p[1] - y0)*(x1 - x0)/(y1 - y0)
+        result[k] = np.count_nonzero(upward & (x > p[0])) % 2 == 1
+    return result
+
+# Hierarchy
+
+def reference_transforms(ref):
+    # (M, t) of a reference, or of every element of an array, as applied by gdspy
+    X = np.diag([1.0, -1.0]) if ref.x_reflection else np.eye(2)
+    if ref.rotation is not None:
+        c, s = math.cos(math.radians(ref.rotation)), math.sin(math.radians(ref.rotation))
+        R = np.array([[c, -s], [s, c]]) @ X
+    else:
+        R = X
+    M = R*(ref.magnification if ref.magnification is not None else 1)
+    origin = np.zeros(2) if ref.origin is None else np.asarray(ref.origin, dtype = float)
+    if isinstance(ref, gdspy.CellArray):
+        return [(M, R @ np.array([ref.spacing[0]*i, ref.spacing[1]*j]) + origin)
+                for i in range(ref.columns) for j in range(ref.rows)]
+    return [(M, origin)]
+
+def builder_name(cell):
+    return getattr(cell, 'builder', None) or cell.name
+
+class Hierarchy:
+    # Flattened and merged layers of the cells of a design, each distinct cell is processed once
+    # and its instances are transformed copies.
+    def __init__(self, top):
+        self.top = top
+        self._own = {}
+        self._flat = {}
+        self._merged = {}
+        self._contains = {}
+
+    def own(self, cell, layer):
+        if id(cell) not in self._own:
+            by_layer = {}
+            for polygon in cell.polygons:
+                for points, l, d in zip(polygon.polygons, polygon.layers, polygon.datatypes):
+                    by_layer.setdefault((l, d), []).append(np.asarray(points, dtype = float))
+            self._own[id(cell)] = by_layer
+        return self._own[id(cell)].get(layer, [])
+
+    def flat(self, cell, layer):
+        # Polygons of cell on layer in the cell frame with the cell paths they come from
+        key = (id(cell), layer)
+        if key not in self._flat:
+            polygons = [(p, (cell,)) for p in self.own(cell, layer)]
+            for ref in cell.references:
+                child = ref.ref_cell
+                sub = self.flat(child, layer)
+                for M, t in reference_transforms(ref):
+                    polygons += [(p @ M.T + t, (cell,) + path) for p, path in sub]
+            self._flat[key] = polygons
+        return self._flat[key]
+
+    def merged(self, cell, layer):
+        key = (id(cell), layer)
+        if key not in self._merged:
+            self._merged[key] = merge([p for p, _ in self.flat(cell, layer)])
+        return self._merged[key]
+
+    def contains(self, cell, match):
+        key = (id(cell), match)
+        if key not in self._contains:
+            self._contains[key] = any(match(r.ref_cell) or self.contains(r.ref_cell, match) for r in cell.references)
+        return self._contains[key]
+
+    def units(self, match):
+        # Outermost instances below the top cell that match, as (cell, M, t, path, whole).
+        # The geometry outside of them is collected as instances of whole unmatched sub trees
+        # and of the own polygons of the cells on the way (whole = False) in rest.
+        found, rest = [], []
+        def visit(cell, M, t, path):
+            rest.append((cell, M, t, path, False))
+            for ref in cell.references:
+                child = ref.ref_cell
+                for M2, t2 in reference_transforms(ref):
+                    M3, t3 = M @ M2, M @ t2 + t
+                    if match(child):
+                        found.append((child, M3, t3, path + (child,), True))
+                    elif self.contains(child, match):
+                        visit(child, M3, t3, path + (child,))
+                    else:
+                        rest.append((child, M3, t3, path + (child,), True))
+        visit(self.top, np.eye(2), np.zeros(2), (self.top,))
+        return found, rest
+
+    def sources(self, instance, layer):
+        cell, M, t, path, whole = instance
+        return self.flat(cell, layer) if whole else [(p, (cell,)) for p in self.own(cell, layer)]
+
+class Layer:
+    # Shapes of one layer in the top frame, merged per instance, with the instance of every shape.
+    # by_instance = True reports the builder of the instance instead of the innermost builder.
+    def __init__(self, hierarchy, layer, instances, by_instance = False):
+        self.hierarchy = hierarchy
+        self.layer = layer
+        self.instances = instances
+        self.by_instance = by_instance
+        shapes, owner = [], []
+        for k, instance in enumerate(instances):
+            cell, M, t, path, whole = instance
+            local = hierarchy.merged(cell, layer) if whole else merge(hierarchy.own(cell, layer))
+            shapes += [p @ M.T + t for p in local]
+            owner += [k]*len(local)
+        self.set_shapes(shapes, owner)
+
+    def set_shapes(self, shapes, owner):
+        self.shapes = shapes
+        self.owner = np.array(owner, dtype = np.int64)
+        self.boxes = bounding_boxes(shapes)
+        self._edges = None
+
+    @property
+    def edges(self):
+        if self._edges is None:
+            self._edges = shape_edges(self.shapes)
+        return self._edges
+
+    def merge_contacts(self):
+        # Merges shapes of different instances that touch or overlap, so that a layer built from
+        # several builders is checked like the union that ends up on the mask
+        if len(set(self.owner.tolist())) < 2:
+            return
+        start, end, shape, _ = self.edges
+        boxes = edge_boxes(start, end)
+        i, j = grid_join(boxes, boxes, precision)
+        keep = self.owner[shape[i]] < self.owner[shape[j]]
+        i, j = i[keep], j[keep]
+        distance, _, _, _ = segment_distance(start[i], end[i], start[j], end[j])
+        touching = distance <= precision
+        links = [(shape[i][touching], shape[j][touching])]
+        a, b = grid_join(self.boxes, self.boxes, 0)
+        keep = self.owner[a] != self.owner[b]
+        a, b = a[keep], b[keep]
+        if len(a):
+            first = np.array([self.shapes[k][0] for k in a])
+            contained = inside(first, [self.shapes[k] for k in b])
+            links.append((a[contained], b[contained]))
+
+        parent = np.arange(len(self.shapes))
+        def find(k):
+            while parent[k] != k:
+                parent[k] = parent[parent[k]]
+                k = parent[k]
+            return k
+        linked = False
+        for a, b in links:
+            for x, y in zip(a.tolist(), b.tolist()):
+                rx, ry = find(x), find(y)
+                if rx != ry:
+                    parent[max(rx, ry)] = min(rx, ry)
+                    linked = True
+        if not linked:
+            return
+        roots = np.array([find(k) for k in range(len(self.shapes))])
+        shapes, owner = [], []
+        for root in np.unique(roots):
+            members = np.flatnonzero(roots == root)
+            if len(members) == 1:
+                shapes.append(self.shapes[root])
+                owner.append(self.owner[root])
+                continue
+            merged = merge([self.shapes[k] for k in members])
+            shapes += merged
+            owner += [self.owner[root]]*len(merged)
+        self.set_shapes(shapes, owner)
+
+    def attribute(self, point):
+        # (builder, path) of the source polygon closest to a point on the layer
+        best = (np.inf, None, None)
+        for instance in self.instances:
+            cell, M, t, path, whole = instance
+            sources = self.hierarchy.sources(instance, self.layer)
+            if not sources:
+                continue
+            q = np.linalg.solve(M, point - t)
+            for p, sub in sources:
+                lo, hi = p.min(axis = 0), p.max(axis = 0)
+                if np.any(q < lo - 1e-3) or np.any(q > hi + 1e-3):
+                    continue
+                distance = np.min(np.hypot(*(project(np.repeat(q[None], len(p), axis = 0), p, np.roll(p, -1, axis = 0)) - q).T))
+                if distance < best[0]:
+                    best = (distance, path + sub[1:], cell)
+        _, path, cell = best
+        if path is None:
+            return self.hierarchy.top.name, self.hierarchy.top.name
+        tagged = [c for c in path if getattr(c, 'builder', None)]
+        if self.by_instance:
+            builder = builder_name(cell)
+        else:
+            builder = builder_name(tagged[-1] if tagged else path[-1])
+        return builder, "/".join(c.name for c in path)
+
+# Checks
+
+def edge_pairs(layer_a, layer_b, distance, select = None, active = None):
+    # Edge pairs of the two layers at most distance apart, select(edges a, edges b, i, j) filters the candidates,
+    # active = (edges of a, edges of b) limits the search to these edges
+    edges_a, edges_b = layer_a.edges, layer_b.edges
+    index_a, index_b = active or (np.arange(len(edges_a[0])), np.arange(len(edges_b[0])))
+    start_a, end_a, shape_a, normal_a = edges_a
+    start_b, end_b, shape_b, normal_b = edges_b
+    i, j = grid_join(edge_boxes(start_a[index_a], end_a[index_a]), edge_boxes(start_b[index_b], end_b[index_b]), distance,
+                     None if select is None else lambda i, j: select(edges_a, edges_b, index_a[i], index_b[j]))
+    i, j = index_a[i], index_b[j]
+    d, pa, pb, crossing = segment_distance(start_a[i], end_a[i], start_b[j], end_b[j])
+    return dict(distance = d, pa = pa, pb = pb, crossing = crossing, shape_a = shape_a[i], shape_b = shape_b[j],
+                normal_a = normal_a[i], normal_b = normal_b[j], a = (start_a[i], end_a[i]), b = (start_b[j], end_b[j]))
+
+def near_other_instances(layer, distance):
+    # Edges within distance of the box of a shape of another instance
+    start, end, shape, _ = layer.edges
+    i, j = grid_join(edge_boxes(start, end), layer.boxes, distance,
+                     lambda i, j: layer.owner[shape[i]] != layer.owner[j])
+    return np.unique(i)
+
+def opposite(edges_a, edges_b, i, j):
+    return np.einsum('ij,ij->i', edges_a[3][i], edges_b[3][j]) < 0
+
+def projects(s0, s1, t0, t1):
+    # The segment s0-s1 projects onto the inside of the segment t0-t1
+    d = t1 - t0
+    length = np.hypot(*d.T)
+    u = d/length[:, None]
+    p0, p1 = np.einsum('ij,ij->i', s0 - t0, u), np.einsum('ij,ij->i', s1 - t0, u)
+    return (np.maximum(p0, p1) > precision) & (np.minimum(p0, p1) < length - precision)
+
+def facing(pairs, inward):
+    # Edges with opposite normals (more than 90 degrees apart) that face each other across the inside
+    # (width) or the outside (notch) of the polygon and overlap in projection, so that the chords
+    # of a round end or a bend are not measured against each other
+    v = pairs['pb'] - pairs['pa']
+    na, nb = pairs['normal_a'], pairs['normal_b']
+    sign = -1 if inward else 1
+    return ((np.einsum('ij,ij->i', na, nb) < 0) & (sign*np.einsum('ij,ij->i', v, na) > 0)
+            & (sign*np.einsum('ij,ij->i', v, nb) < 0) & (projects(*pairs['a'], *pairs['b']) | projects(*pairs['b'], *pairs['a'])))
+
+def contained_pairs(layer_a, layer_b, same_instance_ok = True):
+    # Shapes of a with a vertex inside a shape of b and vice versa (overlaps without crossing edges)
+    i, j = grid_join(layer_a.boxes, layer_b.boxes, 0)
+    if not same_instance_ok:
+        keep = layer_a.owner[i] != layer_b.owner[j]
+        i, j = i[keep], j[keep]
+    if len(i) == 0:
+        return []
+    found = []
+    a_in_b = inside(np.array([layer_a.shapes[k][0] for k in i]), [layer_b.shapes[k] for k in j])
+    b_in_a = inside(np.array([layer_b.shapes[k][0] for k in j]), [layer_a.shapes[k] for k in i])
+    for a, b, x, y in zip(i, j, a_in_b, b_in_a):
+        if x:
+            found.append((a, b, layer_a.shapes[a][0]))
+        elif y:
+            found.append((a, b, layer_b.shapes[b][0]))
+    return found
+
+@profiled
+def check_design(device, rules, namespace = {}, tolerance = 1e-3):
+    # Runs the design rules on device and returns the violations, one per rule, pair of polygons and
+    # neighbourhood. Measured distances within tolerance [um] of the limit pass.
+    rules = parse_rules(rules, namespace)
+    hierarchy = Hierarchy(device)
+    tagged = lambda cell: getattr(cell, 'builder', None) is not None
+    found, rest = hierarchy.units(tagged)
+    instances = found + rest
+    layers = {}
+    def layer(spec):
+        if spec not in layers:
+            layers[spec] = Layer(hierarchy, spec, instances)
+            layers[spec].merge_contacts()
+        return layers[spec]
+
+    violations = []
+    for rule in rules:
+        limit = rule.min - tolerance
+        side_b = None
+        contained = []
+        if rule.rule == 'width':
+            a = b = layer(rule.layer)
+            pairs = edge_pairs(a, b, rule.min, lambda ea, eb, i, j: (i < j) & (ea[2][i] == eb[2][j]) & opposite(ea, eb, i, j))
+            bad = (pairs['shape_a'] == pairs['shape_b']) & (pairs['distance'] > 0) & (pairs['distance'] < limit) & facing(pairs, True)
+        elif rule.rule == 'spacing' and rule.between is None:
+            a = b = layer(rule.layer)
+            pairs = edge_pairs(a, b, rule.min, lambda ea, eb, i, j: (i < j) & ((ea[2][i] != eb[2][j]) | opposite(ea, eb, i, j)))
+            same = pairs['shape_a'] == pairs['shape_b']
+            bad = (pairs['distance'] > 0) & (pairs['distance'] < limit) & (~same | facing(pairs, False))
+        elif rule.rule == 'spacing':
+            names = set(rule.between)
+            match = lambda cell: cell.name in names or getattr(cell, 'builder', None) in names
+            between, _ = hierarchy.units(match)
+            a = b = Layer(hierarchy, rule.layer, between, by_instance = True)
+            active = near_other_instances(a, rule.min)
+            pairs = edge_pairs(a, b, rule.min, lambda ea, eb, i, j: a.owner[ea[2][i]] < a.owner[eb[2][j]], (active, active))
+            bad = (pairs['distance'] < limit) | pairs['crossing']
+            contained = contained_pairs(a, b, same_instance_ok = False)
+            contained = [c for c in contained if c[0] < c[1]]
+        else:
+            a = layer(rule.layer)
+            if rule.other is not None:
+                b = layer(rule.other)
+            else:
+                (x0, y0), (x1, y1) = rule.box
+                b = Layer(hierarchy, None, [])
+                b.set_shapes([np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]])], [0])
+                side_b = ('keepout box', 'keepout box')
+            pairs = edge_pairs(a, b, rule.min)
+            bad = (pairs['distance'] < limit) | pairs['crossing']
+            if rule.rule == 'keepout':
+                contained = contained_pairs(a, b)
+            else:
+                # polygons of layer that are not inside any polygon of other
+                points = np.array([s[0] for s in a.shapes]).reshape(-1, 2)
+                enclosed = np.zeros(len(a.shapes), dtype = bool)
+                i, j = grid_join(np.hstack([points, points]), b.boxes, 0)
+                if len(i):
+                    hit = inside(points[i], [b.shapes[k] for k in j])
+                    enclosed[i[hit]] = True
+                for k in np.flatnonzero(~enclosed):
+                    builder, path = a.attribute(a.shapes[k][0])
+                    violations.append(Violation(rule.name, rule.layer, *a.shapes[k][0], None, rule.min, (builder,), (path,)))
+
+        # One violation per pair of shapes and neighbourhood, the closest pair of edges is reported
+        distance, pa, pb = pairs['distance'][bad], pairs['pa'][bad], pairs['pb'][bad]
+        shape_a, shape_b = pairs['shape_a'][bad], pairs['shape_b'][bad]
+        if contained:
+            sa, sb, p = zip(*contained)
+            distance = np.concatenate([distance, np.zeros(len(p))])
+            pa, pb = np.concatenate([pa, p]), np.concatenate([pb, p])
+            shape_a, shape_b = np.concatenate([shape_a, sa]), np.concatenate([shape_b, sb])
+        cell = np.floor(0.5*(pa + pb)/(10*max(rule.min, 1.0))).astype(np.int64)
+        order = np.lexsort((distance, cell[:, 1], cell[:, 0], shape_b, shape_a))
+        keys = np.column_stack([shape_a, shape_b, cell])[order]
+        first = order[np.r_[True, np.any(keys[1:] != keys[:-1], axis = 1)]] if len(order) else order
+        for k in first[np.lexsort((pa[first, 1], pa[first, 0], distance[first]))]:
+            builders, paths = zip(a.attribute(pa[k]), side_b or b.attribute(pb[k]))
+            x, y = 0.5*(pa[k] + pb[k])
+            violations.append(Violation(rule.name, rule.layer, float(x), float(y), float(distance[k]), rule.min, builders, paths))
+    return violations
+
+def print_drc_report(violations):
+    if not violations:
+        print("DRC clean")
+        return
+    print(f"{'rule':24s} {'x':>12s} {'y':>12s} {'distance':>10s} {'min':>8s}  builders")
+    for v in violations:
+        distance = 'outside' if v.distance is None else f"{v.distance:.4g}"
+        print(f"{v.rule:24s} {v.x:12.3f} {v.y:12.3f} {distance:>10s} {v.limit:8.4g}  {' <-> '.join(dict.fromkeys(v.builders))}")
+    print(f"{len(violations)} violations")
@@ -3,20 +3,230 @@ from scipy.special import ellipk
 from scipy.constants import *
 import math
 import numpy as np
+import hashlib, inspect, json, multiprocessing, os, sys, threading, types
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import wraps
+from types import MappingProxyType
 
 from phidl import quickplot as qp
 from phidl import Device
 import phidl.geometry as pg
+import gdspy
+from phidl.device_layout import _parse_layer
+from profiling import profiled, profiler
+from render import preview
+from simplify import simplify_device, print_simplify_report
+from metal_arrays import write_metal_arrays
 
 # YAML 設定ファイルを読み込む関数
-def load_config(file_path):
-    with open(file_path, 'r') as file:
-        config = yaml.safe_load(file)
-
-    flat_data = flatten_dict(config)
-    global_data = {f"{k}": v for k, v in flat_data.items()}
-
-    return global_data
+# 複数のファイルを渡すと順番に上書きする
+def load_config(*file_paths):
+    global_data = {}
+    for file_path in file_paths:
+        with open(file_path, 'r') as file:
+            config = yaml.safe_load(file)
+
+        flat_data = flatten_dict(config)
+        global_data.update({f"{k}": v for k, v in flat_data.items()})
+
+    return DesignConfig(global_data)
+
+def freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    return value
+
+def thaw(value):
+    if isinstance(value, tuple):
+        return [thaw(v) for v in value]
+    if isinstance(value, Mapping):
+        return {k: thaw(v) for k, v in value.items()}
+    return value
+
+# 変更できない設定オブジェクト (lists are stored as tuples)
+# config.hash is a content hash that is stable across processes
+class DesignConfig(Mapping):
+    __slots__ = ('_data', '_hash')
+
+    def __init__(self, data = {}):
+        object.__setattr__(self, '_data', MappingProxyType({str(k): freeze(v) for k, v in dict(data).items()}))
+        text = json.dumps(thaw(self._data), sort_keys = True, separators = (',', ':'), default = repr)
+        object.__setattr__(self, '_hash', hashlib.sha256(text.encode()).hexdigest())
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getattr__(self, key):
+        try:
+            return self._data[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def __setattr__(self, key, value):
+        raise AttributeError("DesignConfig is immutable, use replace()")
+
+    def __hash__(self):
+        return int(self._hash[:16], 16)
+
+    def __eq__(self, other):
+        if isinstance(other, DesignConfig):
+            return self._hash == other._hash
+        return NotImplemented
+
+    def __repr__(self):
+        return f"DesignConfig({len(self)} keys, hash={self._hash[:12]})"
+
+    def __reduce__(self):
+        return (DesignConfig, (thaw(self._data),))
+
+    @property
+    def hash(self):
+        return self._hash
+
+    def replace(self, **changes):
+        data = dict(self._data)
+        data.update(changes)
+        return DesignConfig(data)
+
+    def merge(self, other):
+        data = dict(self._data)
+        data.update(other)
+        return DesignConfig(data)
+
+# Modules whose builders read the config as module globals
+config_modules = ('qubit_templates', 'ChipDesign')
+_bound_namespaces = {}
+_bind_lock = threading.RLock()
+
+# Global values of these types are treated as design configuration
+config_types = (bool, int, float, str, type(None), list, tuple, Mapping)
+
+_recording = threading.local()
+
+class ConfigNamespace(dict):
+    # Globals of the builders bound to a DesignConfig.
+    # While record_reads() is active, the config values the builders read are added to the recorded key sets,
+    # cell_cache keys the cells on them (see DependencyGraph).
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        stack = getattr(_recording, 'stack', None)
+        if stack and isinstance(value, config_types) and not key.startswith('_'):
+            for reads in stack:
+                reads.add(key)
+        return value
+
+class record_reads:
+    # with record_reads() as keys: ... collects the config keys read by the bound builders, nested recordings
+    # also add their keys to the outer ones
+    def __enter__(self):
+        if not hasattr(_recording, 'stack'):
+            _recording.stack = []
+        self.keys = set()
+        _recording.stack.append(self.keys)
+        return self.keys
+
+    def __exit__(self, *exc):
+        # recordings are nested, the innermost is always the last one
+        _recording.stack.pop()
+
+def note_reads(keys):
+    # Adds keys to the active recordings, for cells taken from a cache instead of being built
+    for reads in getattr(_recording, 'stack', ()):
+        reads.update(keys)
+
+def rebind(obj, namespace):
+    # Copy a function or class so that it reads its globals from namespace
+    obj = inspect.unwrap(obj)
+    if inspect.isfunction(obj):
+        new = types.FunctionType(obj.__code__, namespace, obj.__name__, obj.__defaults__, obj.__closure__)
+        new.__kwdefaults__ = obj.__kwdefaults__
+        new.__qualname__ = obj.__qualname__
+        new.__module__ = obj.__module__
+        new.__doc__ = obj.__doc__
+        return new
+
+    # Classes become subclasses with rebound methods, super() inside them still resolves past the original class
+    attrs = {k: rebind(v, namespace) for k, v in vars(obj).items() if inspect.isfunction(v)}
+    attrs['__module__'] = obj.__module__
+    attrs['__qualname__'] = obj.__qualname__
+    return type(obj)(obj.__name__, (obj,), attrs)
+
+def bind_config(module, config):
+    # Namespace of the module where every builder reads the given config instead of the module globals.
+    # Builders imported from the other config modules are bound to the same config.
+    # Namespaces are built once per (module, config) and can be used from several threads.
+    # config is one DesignConfig for all the modules or {module name: DesignConfig} (see bind_globals).
+    name = module if isinstance(module, str) else module.__name__
+    if isinstance(config, DesignConfig):
+        key = (name, config.hash)
+    else:
+        key = (name, tuple(sorted((m, c.hash) for m, c in config.items())))
+    with _bind_lock:
+        if key in _bound_namespaces:
+            return _bound_namespaces[key]
+        module = sys.modules[name]
+        namespace = ConfigNamespace(vars(module))
+        _bound_namespaces[key] = namespace
+        if isinstance(config, DesignConfig):
+            namespace.update(config)
+        else:
+            namespace.update(config[name])
+            namespace['__module_globals__'] = True
+
+        for k, v in vars(module).items():
+            if not (inspect.isfunction(v) or inspect.isclass(v)):
+                continue
+            origin = inspect.unwrap(v).__module__
+            if origin == name:
+                namespace[k] = rebind(v, namespace)
+                if hasattr(v, 'profiled_name'):
+                    namespace[k] = profiled(tag_builder(namespace[k]), v.profiled_name)
+            elif origin in config_modules and origin in sys.modules:
+                namespace[k] = bind_config(origin, config)[k]
+        return namespace
+
+def bind_globals(module):
+    # bind_config with the current globals of each config module as its config. The bound builders read the
+    # same values as the plain ones (ChipDesign keeps its own copy of the qubit_templates globals) and their
+    # reads are recorded.
+    configs = {m: DesignConfig({k: v for k, v in vars(sys.modules[m]).items() if not k.startswith('_') and isinstance(v, config_types)})
+               for m in config_modules if m in sys.modules}
+    return bind_config(module, configs)
+
+def tag_builder(builder):
+    # Records the builder name on the Device it returns (device.builder), the DRC reports violations by builder.
+    # A Device returned as is from an inner builder keeps the inner name.
+    @wraps(builder)
+    def wrapper(*args, **kwargs):
+        result = builder(*args, **kwargs)
+        if isinstance(result, Device) and getattr(result, 'builder', None) is None:
+            result.builder = builder.__name__
+        return result
+    return wrapper
+
+def configurable(builder):
+    # Lets a builder take config = DesignConfig(...) explicitly, module globals are the fallback
+    # The builder and its bound copies are timed by the profiler and tag their Devices (see bind_config)
+    timed = profiled(tag_builder(builder))
+    @wraps(builder)
+    def wrapper(*args, config = None, **kwargs):
+        if config is None:
+            return timed(*args, **kwargs)
+        return bind_config(builder.__module__, config)[builder.__name__](*args, **kwargs)
+    wrapper.profiled_name = timed.profiled_name
+    wrapper.configurable = True
+    return wrapper
 
 # 再帰的にフラットな変数名で辞書を展開
 def flatten_dict(d, parent_key="", sep="_"):
@@ -29,27 +239,59 @@ def flatten_dict(d, parent_key="", sep="_"):
             items[new_key] = v
     return items
 
-def phidl_to_metal(device_list, outname):
-
-    chipdesign_qiskit = Device('chipdesign_qiskit')
-    chipdesign_qiskit_pocket = Device('chipdesign_qiskit_pocket')
-
-    for ilayer, device in enumerate(device_list):
-        pocket = device["device"].pocket
-        metal  = device["device"].metal
-        for i in pocket.get_layers():
-            chipdesign_qiskit_pocket.add_ref( pg.copy_layer(pocket, layer = i, new_layer=ilayer) )
-        for i in metal.get_layers():
-            chipdesign_qiskit.add_ref( pg.copy_layer(metal, layer = i, new_layer=ilayer) )            
-
-    chipdesign_qiskit = pg.union( chipdesign_qiskit, by_layer = True )
-    chipdesign_qiskit_pocket = pg.union( chipdesign_qiskit_pocket, by_layer = True )
-    chipdesign_qiskit.flatten()
-    chipdesign_qiskit_pocket.flatten()
-    qp(chipdesign_qiskit)
-    qp(chipdesign_qiskit_pocket)
-    chipdesign_qiskit.write_gds(f'output/qiskit-metal/{outname}.gds')
-    chipdesign_qiskit_pocket.write_gds(f'output/qiskit-metal/{outname}_pocket.gds')
+def process_map(function, *iterables, workers = None, chunksize = 1, initializer = None, initargs = ()):
+    # list(map(...)) in a process pool. Workers are forked where possible so they see the notebook state,
+    # spawned workers (macOS, Windows) import function from its module.
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+    with ProcessPoolExecutor(max_workers = workers, mp_context = context, initializer = initializer, initargs = initargs) as pool:
+        return list(pool.map(function, *iterables, chunksize = chunksize))
+
+def union_polygons(polygons, precision = 1e-4, max_points = 4000):
+    # pg.union of one layer, as plain arrays so that it can run in a worker process
+    unioned = pg._union_polygons(polygons, precision = precision, max_points = max_points)
+    return [] if unioned is None else unioned.polygons
+
+# Below this many vertices the unions run in this process, starting the workers takes longer
+parallel_min_vertices = 200000
+
+def union_layouts(layouts, workers = None):
+    # pg.union of all the layers of each layout, returns one list of polygons per layout.
+    # Each layout is one task in a process pool, the largest first.
+    polygons = [layout.get_polygons() for layout in layouts]
+    sizes = [sum(len(p) for p in polys) for polys in polygons]
+    order = sorted((i for i in range(len(layouts)) if polygons[i]), key = lambda i: -sizes[i])
+    workers = workers or os.cpu_count()
+    if workers > 1 and len(order) > 1 and sum(sizes) >= parallel_min_vertices:
+        results = process_map(union_polygons, [polygons[i] for i in order], workers = min(workers, len(order)))
+    else:
+        results = [union_polygons(polygons[i]) for i in order]
+    unions = [[] for _ in layouts]
+    for i, unioned in zip(order, results):
+        unions[i] = unioned
+    return unions
+
+# simplify = tolerance [um] removes duplicate and collinear vertices before writing (see simplify.py)
+@profiled
+def phidl_to_metal(device_list, outname, simplify = None, workers = None, arrays = True):
+    # All layers of device i are merged onto layer i. The metal and pocket unions of the devices run in a
+    # process pool (workers, all cores by default) and the gds and yaml files are written concurrently.
+    # arrays also writes the polygons and ports per device to {outname}.npz (see metal_arrays.py).
+    devices = [device["device"] for device in device_list]
+    unions = union_layouts([d.metal for d in devices] + [d.pocket for d in devices], workers = workers)
+
+    chipdesign_qiskit = Device('union')
+    chipdesign_qiskit_pocket = Device('union')
+    for ilayer in range(len(devices)):
+        for design, polygons in ((chipdesign_qiskit, unions[ilayer]), (chipdesign_qiskit_pocket, unions[len(devices) + ilayer])):
+            if len(polygons):
+                design.add_polygon(polygons, layer = ilayer)
+
+    if simplify is not None:
+        print_simplify_report(simplify_device(chipdesign_qiskit, tolerance = simplify))
+        print_simplify_report(simplify_device(chipdesign_qiskit_pocket, tolerance = simplify))
+    preview(chipdesign_qiskit, title = outname)
+    preview(chipdesign_qiskit_pocket, title = f'{outname}_pocket')
 
 
     # Dump port data
@@ -84,39 +326,259 @@ def phidl_to_metal(device_list, outname):
             data[key]["jj"] = jj_data            
 
     print(data)
-    with open(f'output/qiskit-metal/{outname}.yaml', 'w') as f:
-        yaml.safe_dump(data, f, sort_keys=False)
+    def write_yaml():
+        with open(f'output/qiskit-metal/{outname}.yaml', 'w') as f:
+            yaml.safe_dump(data, f, sort_keys=False)
+
+    with ThreadPoolExecutor(max_workers = 4) as pool:
+        writes = [pool.submit(chipdesign_qiskit.write_gds, f'output/qiskit-metal/{outname}.gds'),
+                  pool.submit(chipdesign_qiskit_pocket.write_gds, f'output/qiskit-metal/{outname}_pocket.gds'),
+                  pool.submit(write_yaml)]
+        if arrays:
+            polygons = {}
+            for kind, design in (('metal', chipdesign_qiskit), ('pocket', chipdesign_qiskit_pocket)):
+                by_layer = design.get_polygons(by_spec = True)
+                polygons[kind] = [by_layer.get((ilayer, 0), []) for ilayer in range(len(devices))]
+            writes.append(pool.submit(write_metal_arrays, f'output/qiskit-metal/{outname}.npz', [d["name"] for d in device_list],
+                                      polygons, [d.pocket.get_ports() for d in devices]))
+        for write in writes:
+            write.result()
+
+# 名前をキーにしたポートの索引 (midpoint, width, orientation は numpy 配列)
+# 同じ名前のポートは最初のものを残す (get_ports() の順番)
+class PortRegistry:
+    def __init__(self, names = (), midpoints = None, widths = None, orientations = None):
+        self.names = []
+        self.index = {}
+        self.midpoints = np.zeros((0, 2))
+        self.widths = np.zeros(0)
+        self.orientations = np.zeros(0)
+        if names:
+            self.add(names, midpoints, widths, orientations)
+
+    @classmethod
+    def from_device(cls, device):
+        ports = list(device.ports.values())
+        registry = cls(
+            names = [p.name for p in ports],
+            midpoints = [p.midpoint for p in ports],
+            widths = [p.width for p in ports],
+            orientations = [p.orientation for p in ports],
+        )
+        for r in device.references:
+            # Elements of a CellArray share names, only element (0, 0) is kept
+            child = cls.from_device(r.parent)
+            registry.merge(child.transformed(r.origin, r.rotation, r.x_reflection))
+        return registry
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        i = self.index[name]
+        return dict(name = name, midpoint = self.midpoints[i], width = self.widths[i], orientation = self.orientations[i])
+
+    def add(self, names, midpoints, widths, orientations):
+        keep = []
+        for i, name in enumerate(names):
+            if name not in self.index:
+                self.index[name] = len(self.names)
+                self.names.append(name)
+                keep.append(i)
+        if keep:
+            self.midpoints = np.concatenate([self.midpoints, np.asarray(midpoints, dtype = float).reshape(-1, 2)[keep]])
+            self.widths = np.concatenate([self.widths, np.asarray(widths, dtype = float)[keep]])
+            self.orientations = np.concatenate([self.orientations, np.asarray(orientations, dtype = float)[keep]])
+        return self
+
+    def merge(self, other):
+        return self.add(other.names, other.midpoints, other.widths, other.orientations)
+
+    def transformed(self, origin = (0, 0), rotation = None, x_reflection = False):
+        # Same transformation as phidl applies to the ports of a reference
+        midpoints = self.midpoints.copy()
+        orientations = self.orientations.copy()
+        if x_reflection:
+            midpoints[:, 1] = -midpoints[:, 1]
+            orientations = -orientations
+        if rotation is not None:
+            theta = np.deg2rad(rotation)
+            c, s = np.cos(theta), np.sin(theta)
+            midpoints = midpoints @ np.array([[c, s], [-s, c]])
+            orientations = orientations + rotation
+        if origin is not None:
+            midpoints = midpoints + np.asarray(origin, dtype = float)
+        return PortRegistry(self.names, midpoints, self.widths, np.mod(orientations, 360))
+
+    def apply(self, device):
+        for i, name in enumerate(self.names):
+            if name not in device.ports:
+                device.add_port(
+                    name=name,
+                    midpoint=self.midpoints[i],
+                    width=self.widths[i],
+                    orientation =self.orientations[i]
+                )
+        return device
 
+def carry_ports(target, *devices):
+    registry = PortRegistry()
+    for device in devices:
+        registry.merge(PortRegistry.from_device(device))
+    return registry.apply(target)
+
+@profiled(geometry = True)
 def extract_with_ports(device, layers_to_extract):
 
-    print(device.get_ports())
     extracted = pg.extract(device, layers_to_extract)
-    
-    for port in device.get_ports():
-        if port.name not in [x.name for x in extracted.get_ports()]:
-            extracted.add_port(
-                name=port.name, 
-                midpoint=port.midpoint, 
-                width=port.width, 
-                orientation =port.orientation
-            )
-    
-    return extracted
+    return carry_ports(extracted, device)
 
+@profiled(geometry = True)
 def boolean_with_ports(deviceA, deviceB, logic, layer):
 
     boolean = pg.boolean(deviceA, deviceB, logic, layer = layer)
-    
-    for port in deviceA.get_ports() + deviceB.get_ports():
-        if port.name not in [x.name for x in boolean.get_ports()]:
-            boolean.add_port(
-                name=port.name, 
-                midpoint=port.midpoint, 
-                width=port.width, 
-                orientation =port.orientation
-            ) 
-
-    return boolean
+    return carry_ports(boolean, deviceA, deviceB)
+
+# 連続する同じ演算をまとめて1回のclipperで処理する
+# operations = [("not", deviceB), ("not", deviceC), ("or", deviceD), ...]
+@profiled(geometry = True)
+def boolean_pipeline(base, operations, layer, precision = 1e-4, max_points = 4000):
+
+    groups = []
+    for logic, device in operations:
+        logic = logic.lower()
+        if logic not in ["not", "and", "or", "xor"]:
+            raise ValueError(f"boolean_pipeline() operation {logic} must be one of 'not', 'and', 'or', 'xor'")
+        # A - B - C = A - (B + C), A + B + C = A + (B + C)
+        if groups and groups[-1][0] == logic and logic in ["not", "or"]:
+            groups[-1][1].append(device)
+        else:
+            groups.append((logic, [device]))
+
+    gds_layer, gds_datatype = _parse_layer(layer)
+    polygons = base.get_polygons()
+    for logic, devices in groups:
+        operand = [p for d in devices for p in d.get_polygons()]
+        if not operand:
+            if logic in ["not", "or", "xor"]:
+                continue
+            polygons = []
+        elif not polygons and logic in ["not", "and"]:
+            continue
+        else:
+            result = gdspy.boolean(polygons, operand, logic, precision = precision, max_points = max_points)
+            polygons = [] if result is None else result.polygons
+
+    boolean = Device('boolean')
+    if polygons:
+        for polygon in boolean.add_polygon(polygons, layer = (gds_layer, gds_datatype)):
+            polygon.fracture(max_points = max_points, precision = precision)
+
+    return carry_ports(boolean, base, *[d for _, d in operations])
+
+# pg.circle の多角形 (終点の重複なし)
+def circle_polygon(radius, angle_resolution = 2.5):
+    t = np.linspace(0, 2*np.pi, int(np.ceil(360/angle_resolution) + 1))[:-1]
+    return np.stack([radius*np.cos(t), radius*np.sin(t)], axis = 1)
+
+def clip_halfplane(points, axis, bound, sign):
+    # Sutherland-Hodgman step, keeps sign*(x[axis] - bound) <= 0
+    d = sign*(points[:, axis] - bound)
+    inside = d <= 0
+    following = np.roll(points, -1, axis = 0)
+    d_following = np.roll(d, -1)
+    crossing = inside != (d_following <= 0)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        t = np.where(crossing, d/(d - d_following), 0)
+    candidates = np.stack([points, points + t[:, None]*(following - points)], axis = 1)
+    return candidates[np.stack([inside, crossing], axis = 1)]
+
+def clip_rectangle_to_polygon(rectangle, polygon):
+    # Intersection of an axis-aligned rectangle [[xmin, ymin], [xmax, ymax]] with a convex polygon
+    (xmin, ymin), (xmax, ymax) = rectangle
+    points = polygon
+    for axis, bound, sign in ((0, xmin, -1), (0, xmax, 1), (1, ymin, -1), (1, ymax, 1)):
+        if len(points) == 0:
+            break
+        points = clip_halfplane(points, axis, bound, sign)
+    return points
+
+def convex_chains(polygon):
+    # Lower and upper chain of a counterclockwise convex polygon, both with increasing x
+    i0, i1 = np.argmin(polygon[:, 0]), np.argmax(polygon[:, 0])
+    rolled = np.roll(polygon, -i0, axis = 0)
+    k = (i1 - i0) % len(polygon)
+    return rolled[:k + 1], np.concatenate([rolled[k:], rolled[:1]])[::-1]
+
+def clip_strip(x0, x1, chains):
+    # Part of the convex polygon between x0 and x1: the chords at x0 and x1 and the vertices in between
+    lower, upper = chains
+    x0, x1 = max(x0, lower[0, 0]), min(x1, lower[-1, 0])
+    if x0 >= x1:
+        return np.zeros((0, 2))
+    def cut(chain):
+        inner = chain[(chain[:, 0] > x0) & (chain[:, 0] < x1)]
+        y0, y1 = np.interp([x0, x1], chain[:, 0], chain[:, 1])
+        return np.concatenate([[[x0, y0]], inner, [[x1, y1]]])
+    return np.concatenate([cut(lower), cut(upper)[::-1]])
+
+def clip_box_to_polygon(box, polygon, chains):
+    # A line (box longer than the polygon in one direction) is cut by the chords in closed form,
+    # other boxes (corners) by Sutherland-Hodgman
+    for axis in (0, 1):
+        swap = [axis, 1 - axis]
+        (x0, y0), (x1, y1) = box[:, swap]
+        points = clip_strip(x0, x1, chains[axis])
+        if len(points) == 0:
+            return points
+        if y0 <= points[:, 1].min() and points[:, 1].max() <= y1:
+            return points[:, swap]
+    return clip_rectangle_to_polygon(box, polygon)
+
+def axis_aligned_box(points):
+    # [[xmin, ymin], [xmax, ymax]] if points is an axis-aligned rectangle, otherwise None
+    points = np.asarray(points)
+    if len(points) != 4:
+        return None
+    edges = np.roll(points, -1, axis = 0) - points
+    if not np.all((np.abs(edges[:, 0]) < 1e-9) | (np.abs(edges[:, 1]) < 1e-9)):
+        return None
+    return np.array([points.min(axis = 0), points.max(axis = 0)])
+
+@profiled(geometry = True)
+def clip_to_circle(polygons, radius, angle_resolution = 2.5, precision = 1e-6, max_points = 4000):
+    # polygons AND pg.circle(radius, angle_resolution) without a boolean over the whole wafer.
+    # Polygons inside the inscribed circle are kept, polygons outside the circle are dropped and
+    # axis-aligned rectangles are clipped in closed form. Only the other polygons crossing the edge go through gdspy.boolean.
+    circle = circle_polygon(radius, angle_resolution)
+    chains = (convex_chains(circle), convex_chains(circle[:, ::-1][::-1]))
+    inscribed = radius*np.cos(np.pi/len(circle))
+    result = []
+    partial = []
+    for points in polygons:
+        points = np.asarray(points)
+        if np.max(np.hypot(points[:, 0], points[:, 1])) <= inscribed:
+            result.append(points)
+            continue
+        lower, upper = points.min(axis = 0), points.max(axis = 0)
+        nearest = np.clip(0, lower, upper)
+        if np.hypot(*nearest) >= radius:
+            continue
+        box = axis_aligned_box(points)
+        if box is None:
+            partial.append(points)
+            continue
+        clipped = clip_box_to_polygon(box, circle, chains)
+        if len(clipped) >= 3:
+            result.append(np.round(clipped/precision)*precision)
+    if partial:
+        clipped = gdspy.boolean(partial, [circle], 'and', precision = precision, max_points = max_points)
+        if clipped is not None:
+            result.extend(clipped.polygons)
+    return result
 
 def phidl_port_to_metal_pin(port):
     x0, y0 = port.midpoint
@@ -130,18 +592,38 @@ def phidl_port_to_metal_pin(port):
 
     return point1, point2
 
+# 基板の比誘電率
+substrate_permittivity = {
+    "silicon"  : 11.9, # 11.45
+    "sapphire" : 9.4,
+}
+
+def substrate_eps_r(material):
+    # material is a name or an array of names
+    materials = np.asarray(material)
+    if materials.ndim == 0:
+        eps_r = np.array(substrate_permittivity.get(str(materials), np.nan))
+    else:
+        # one comparison per known material, faster than looking up every name
+        eps_r = np.full(materials.shape, np.nan)
+        for name, value in substrate_permittivity.items():
+            eps_r[materials == name] = value
+    unknown = np.isnan(eps_r)
+    if unknown.any():
+        names = sorted(set(np.atleast_1d(materials)[np.atleast_1d(unknown)].tolist()))
+        raise ValueError(f"unknown substrate material {names}, known: {sorted(substrate_permittivity)}")
+    return eps_r if materials.ndim else float(eps_r)
+
+# All calculators broadcast over numpy arrays, scalars in give scalars out
 def calculate_effective_permittivity(w, s, h, eps_r):
+    w, s, h, eps_r = np.broadcast_arrays(*(np.asarray(x, dtype = float) for x in (w, s, h, eps_r)))
     k0 = w/(w + 2*s)
-    k0_prime = math.sqrt(1-pow(k0, 2))
-    k3 = math.tanh((math.pi*w)/(4*h))/math.tanh((math.pi*(w+2*s))/(4*h))
-    k3_prime = math.sqrt(1-pow(k3, 2))
-    K_k0 = ellipk(k0**2)
-    K_k0_prime=ellipk(k0_prime**2)
-    K_k3 = ellipk(k3**2)
-    K_k3_prime=ellipk(k3_prime**2)
+    k3 = np.tanh((np.pi*w)/(4*h))/np.tanh((np.pi*(w+2*s))/(4*h))
+    # K(k0), K(k0'), K(k3), K(k3') in one call
+    K_k0, K_k0_prime, K_k3, K_k3_prime = ellipk(np.stack([k0**2, 1 - k0**2, k3**2, 1 - k3**2]))
     K_tilde = (K_k0_prime/K_k0)*(K_k3/K_k3_prime)
     eps_eff = (1 + eps_r * K_tilde)/(1 + K_tilde)
-    return eps_eff
+    return eps_eff[()]
 
 def calculate_resonator_frequency(
         length = 3000, # um
@@ -152,25 +634,18 @@ def calculate_resonator_frequency(
         ):
 
     # convert um to m
-    l = length * 1e-6
-    w = core_width * 1e-6
-    s = gap_width * 1e-6
-    h = height * 1e-6
-
-    if material == "silicon":
-        eps_r = 11.9
-        #eps_r = 11.45
-    elif material == "sapphire":
-        eps_r = 9.4
-    else:
-        ValueError()
+    l = np.asarray(length) * 1e-6
+    w = np.asarray(core_width) * 1e-6
+    s = np.asarray(gap_width) * 1e-6
+    h = np.asarray(height) * 1e-6
 
+    eps_r = substrate_eps_r(material)
     eps_eff = calculate_effective_permittivity(w, s, h, eps_r)
     #eps_eff = 0.5*(1 + eps_r)
-    c_eff = c / math.sqrt(eps_eff)
+    c_eff = c / np.sqrt(eps_eff)
     f = c_eff / (4*l)
 
-    return f*1e-6
+    return (f*1e-6)[()]
 
 def calculate_resonator_length(
         frequency = 5000, # MHz
@@ -181,22 +656,15 @@ def calculate_resonator_length(
         ):
 
     # convert um to m & MHz to Hz
-    f = frequency * 1e+6
-    w = core_width * 1e-6
-    s = gap_width * 1e-6
-    h = height * 1e-6
-
-    if material == "silicon":
-        eps_r = 11.9
-        #eps_r = 11.45
-    elif material == "sapphire":
-        eps_r = 9.4
-    else:
-        ValueError()
+    f = np.asarray(frequency) * 1e+6
+    w = np.asarray(core_width) * 1e-6
+    s = np.asarray(gap_width) * 1e-6
+    h = np.asarray(height) * 1e-6
 
+    eps_r = substrate_eps_r(material)
     eps_eff = calculate_effective_permittivity(w, s, h, eps_r)
     #eps_eff = 0.5*(1 + eps_r)
-    c_eff = c / math.sqrt(eps_eff)
+    c_eff = c / np.sqrt(eps_eff)
     l = c_eff / (4*f)
 
-    return l*1e+6
\ No newline at end of file
+    return (l*1e+6)[()]
@@ -0,0 +1,157 @@
+import warnings
+import weakref
+
+import gdspy
+import numpy as np
+from phidl import Device
+from BaseDevice import BaseDevice
+from cell_cache import builder_key, is_shared, UncacheableArgument
+from profiling import profiled
+from simplify import simplify_cells
+
+def release(device):
+    # Drop the geometry of a written cell, shared sub cells stay alive as long as something else uses them
+    device.polygons = []
+    device.paths = []
+    device.labels = []
+    device.references = []
+    device.aliases = {}
+    device._bb_valid = False
+
+class GdsStreamWriter:
+    # Writes cells to a GDS file as soon as they are finished, the top cell is written by close().
+    # Placements in the top cell refer to the written cells by name, so chips nobody else uses can be released
+    # right away (release_device = True, stream_array does it for the chips it builds).
+    # simplify = tolerance [um] runs simplify_cells on every cell before it is written, snapped to the file precision
+    def __init__(self, filename, unit = 1e-6, precision = 1e-9, cellname = 'toplevel', max_cellname_length = 28, simplify = None):
+        if isinstance(filename, str) and filename[-4:] != '.gds':
+            filename += '.gds'
+        self.filename = filename
+        self.writer = gdspy.GdsWriter(filename, unit = unit, precision = precision)
+        self.top = gdspy.Cell(cellname, exclude_from_current = True)
+        self.max_cellname_length = max_cellname_length
+        self.used_names = {cellname}
+        self.written = {} # id(cell) -> (weakref, name)
+        self.n = 1
+        self.cells_written = 0
+        self.simplify = simplify
+        self.grid = precision/unit
+        self.simplify_report = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def unique_name(self, name):
+        # Same scheme as Device.write_gds(auto_rename = True)
+        if self.max_cellname_length is not None:
+            name = name[:self.max_cellname_length]
+        new_name = name
+        while new_name in self.used_names:
+            self.n += 1
+            new_name = name + ("%0.3i" % self.n)
+        self.used_names.add(new_name)
+        return new_name
+
+    def written_name(self, cell):
+        entry = self.written.get(id(cell))
+        # ids are reused after a cell is garbage collected, check that it is the same object
+        if entry is not None and entry[0]() is cell:
+            return entry[1]
+        return None
+
+    @profiled(name = 'GdsStreamWriter.write')
+    def write(self, device, release_device = False):
+        # Write device and the sub cells that are not in the file yet, returns the name of the cell in the file.
+        # release_device = True drops the geometry of device afterwards, only for cells nobody else uses:
+        # cells shared by a CellCache are never released.
+        if isinstance(device, BaseDevice):
+            device = device.device
+        name = self.written_name(device)
+        if name is not None:
+            return name
+
+        cells = sorted([device] + list(device.get_dependencies(recursive = True)), key = lambda c: c.uid)
+        original = [c.name for c in cells]
+        new = []
+        for c in cells:
+            name = self.written_name(c)
+            if name is None:
+                name = self.unique_name(c.name)
+                new.append(c)
+                self.written[id(c)] = (weakref.ref(c), name)
+            c.name = name
+        if self.simplify is not None:
+            simplify_cells(new, self.simplify, self.grid, report = self.simplify_report)
+        try:
+            for c in new:
+                self.writer.write_cell(c)
+        finally:
+            for c, name in zip(cells, original):
+                c.name = name
+        self.cells_written += len(new)
+
+        name = self.written[id(device)][1]
+        if release_device and not is_shared(device):
+            release(device)
+        return name
+
+    # gdspy warns about references to cells it does not know, here the cells are already in the file
+    def place(self, name, origin = (0, 0), rotation = None, magnification = None, x_reflection = False):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.top.add(gdspy.CellReference(name, origin = origin, rotation = rotation,
+                                             magnification = magnification, x_reflection = x_reflection))
+
+    def place_array(self, name, columns, rows, spacing, origin = (0, 0)):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.top.add(gdspy.CellArray(name, columns, rows, spacing, origin = origin))
+
+    def add(self, device, origin = (0, 0), release_device = False):
+        # Write a cell and place it in the top cell
+        self.place(self.write(device, release_device = release_device), origin = origin)
+
+    @profiled(name = 'GdsStreamWriter.close')
+    def close(self):
+        if self.writer is None:
+            return
+        self.writer.write_cell(self.top)
+        self.writer.close()
+        self.writer = None
+
+def stream_array(writer, function, kwargs_array, pitch, center = (0, 0), empty = None):
+    # Build the chips of a 2D kwargs array one by one and write each of them right away.
+    # The pitch is needed up front since the chips are gone before the last one is built.
+    # Row 0 is on top like pg.grid and every chip is centered on its lattice point (lattice centered on center).
+    # Chips with the same builder, kwargs and config are built once, None entries get the empty cell (if any).
+    kwargs_array = np.array(kwargs_array, dtype = object)
+    if kwargs_array.ndim == 1:
+        kwargs_array = kwargs_array.reshape(1, -1)
+    nrows, ncols = kwargs_array.shape
+    pitch = np.broadcast_to(np.asarray(pitch, dtype = float), 2)
+
+    chips = {} # key -> (name, center)
+    for (r, c), kwargs in np.ndenumerate(kwargs_array):
+        point = np.asarray(center) + np.array([(c - (ncols - 1)/2)*pitch[0], ((nrows - 1)/2 - r)*pitch[1]])
+        if kwargs is None:
+            if empty is None:
+                continue
+            key, build = 'empty', lambda: empty
+        else:
+            try:
+                key = builder_key(function, (), kwargs)
+            except UncacheableArgument:
+                key = f'{r},{c}'
+            build = lambda: function(**kwargs)
+        if key not in chips:
+            chip = build()
+            if isinstance(chip, BaseDevice):
+                chip = chip.device
+            # the empty cell belongs to the caller, chips built here are released once written
+            chips[key] = (chip.center, writer.write(chip, release_device = chip is not empty))
+        chip_center, name = chips[key]
+        writer.place(name, origin = point - chip_center)
+    return writer
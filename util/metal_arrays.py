@@ -0,0 +1,126 @@
+import zipfile
+
+import numpy as np
+
+# Bump when the layout of the file changes
+metal_arrays_format = 1
+
+# Columnar export of phidl_to_metal, one uncompressed npz (np.load works as well):
+#   names, layers                      (devices,)      device i is on layer layers[i] of the gds files
+#   {kind}_polygon_offsets             (devices + 1,)  polygons of device i are polygon_offsets[i]:[i+1]
+#   {kind}_vertex_offsets              (polygons + 1,) vertices of polygon j are vertex_offsets[j]:[j+1] of {kind}_points
+#   {kind}_points                      (vertices, 2)   for kind in metal, pocket (the merged polygons of the gds files)
+#   port_offsets                       (devices + 1,)  pocket ports of device i
+#   port_names, port_midpoints, port_widths, port_orientations
+#   jj                                 (devices, 5)    start x, y, end x, y, width of the junction, nan without one
+kinds = ('metal', 'pocket')
+
+def polygon_columns(polygon_lists):
+    # Offsets and points of one polygon list per device
+    polygons = [p for polys in polygon_lists for p in polys]
+    polygon_offsets = np.concatenate([[0], np.cumsum([len(polys) for polys in polygon_lists])]).astype(np.int64)
+    vertex_offsets = np.concatenate([[0], np.cumsum([len(p) for p in polygons])]).astype(np.int64)
+    points = np.concatenate(polygons).astype(np.float64) if polygons else np.zeros((0, 2))
+    return polygon_offsets, vertex_offsets, points
+
+def junction(ports):
+    jj = np.full(5, np.nan)
+    for port in ports:
+        if port.name == "Junction_up":
+            jj[0:2] = port.midpoint
+        elif port.name == "Junction_down":
+            jj[2:4] = port.midpoint
+            jj[4] = port.width
+    return jj
+
+def write_metal_arrays(path, names, polygons, ports):
+    # polygons = {kind: [polygons of device i]}, ports = [pocket ports of device i]
+    data = dict(format = np.array(metal_arrays_format), names = np.array(names, dtype = str),
+                layers = np.arange(len(names), dtype = np.int64))
+    for kind in kinds:
+        data[f'{kind}_polygon_offsets'], data[f'{kind}_vertex_offsets'], data[f'{kind}_points'] = polygon_columns(polygons[kind])
+    flat = [port for device_ports in ports for port in device_ports]
+    data['port_offsets'] = np.concatenate([[0], np.cumsum([len(p) for p in ports])]).astype(np.int64)
+    data['port_names'] = np.array([str(p.name) for p in flat], dtype = str)
+    data['port_midpoints'] = np.array([p.midpoint for p in flat], dtype = np.float64).reshape(-1, 2)
+    data['port_widths'] = np.array([p.width for p in flat], dtype = np.float64)
+    data['port_orientations'] = np.array([p.orientation for p in flat], dtype = np.float64)
+    data['jj'] = np.array([junction(p) for p in ports], dtype = np.float64).reshape(-1, 5)
+    # np.savez stores the members uncompressed, so they can be memory mapped
+    with open(path, 'wb') as f:
+        np.savez(f, **data)
+
+def npz_members(path):
+    # {name: (offset, dtype, shape, fortran_order)} of the arrays in an uncompressed npz
+    members = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{path} member {info.filename} is compressed and cannot be memory mapped")
+            # local file header: 30 bytes, then the file name and the extra field
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = np.frombuffer(f.read(4), dtype = '<u2')
+            f.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(f)
+            members[info.filename[:-len('.npy')]] = (f.tell(), dtype, shape, fortran_order)
+    return members
+
+class MetalArrays:
+    # Reader of write_metal_arrays files. The offset tables and names are read, the points and ports are
+    # memory mapped, so device(name) returns views into the file without reading the other devices.
+    def __init__(self, path):
+        self.path = path
+        self.members = npz_members(path)
+        self.arrays = {}
+        self.format = int(self.load('format'))
+        if self.format != metal_arrays_format:
+            raise ValueError(f"{path} has format {self.format}, expected {metal_arrays_format}")
+        self.names = [str(n) for n in self.load('names')]
+        self.index = {name: i for i, name in enumerate(self.names)}
+
+    def load(self, key):
+        offset, dtype, shape, fortran_order = self.members[key]
+        if dtype.hasobject:
+            raise ValueError(f"{key} holds python objects")
+        if dtype.kind == 'U' or len(shape) == 0 or 0 in shape:
+            # names and scalars are read
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                array = np.fromfile(f, dtype = dtype, count = int(np.prod(shape)))
+            return array.reshape(shape, order = 'F' if fortran_order else 'C')
+        return np.memmap(self.path, dtype = dtype, mode = 'r', offset = offset, shape = shape,
+                         order = 'F' if fortran_order else 'C')
+
+    def __getitem__(self, key):
+        if key not in self.arrays:
+            self.arrays[key] = self.load(key)
+        return self.arrays[key]
+
+    def __len__(self):
+        return len(self.names)
+
+    def polygons(self, name, kind = 'metal'):
+        # Polygons of one device as views of {kind}_points
+        if kind not in kinds:
+            raise ValueError(f"kind {kind} must be one of {', '.join(kinds)}")
+        i = self.index[name]
+        first, last = self[f'{kind}_polygon_offsets'][i:i + 2]
+        offsets = self[f'{kind}_vertex_offsets'][first:last + 1]
+        points = self[f'{kind}_points']
+        return [points[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+
+    def ports(self, name):
+        i = self.index[name]
+        a, b = self['port_offsets'][i:i + 2]
+        return dict(names = self['port_names'][a:b], midpoints = self['port_midpoints'][a:b],
+                    widths = self['port_widths'][a:b], orientations = self['port_orientations'][a:b])
+
+    def device(self, name):
+        # dict(layer, metal, pocket, ports, jj), jj is None without a junction
+        i = self.index[name]
+        jj = self['jj'][i]
+        return dict(layer = int(self['layers'][i]), metal = self.polygons(name, 'metal'), pocket = self.polygons(name, 'pocket'),
+                    ports = self.ports(name),
+                    jj = None if np.isnan(jj).all() else dict(start = jj[0:2], end = jj[2:4], width = float(jj[4])))
@@ -0,0 +1,193 @@
+import threading
+import time
+from functools import wraps
+
+import gdspy
+import phidl.geometry as pg
+from phidl import Device
+
+class ProfileNode:
+    __slots__ = ('name', 'count', 'time', 'children', 'polygons_in', 'vertices_in', 'polygons_out', 'vertices_out')
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.time = 0.0
+        self.children = {}
+        self.polygons_in = 0
+        self.vertices_in = 0
+        self.polygons_out = 0
+        self.vertices_out = 0
+
+    def child(self, name):
+        node = self.children.get(name)
+        if node is None:
+            node = self.children.setdefault(name, ProfileNode(name))
+        return node
+
+    @property
+    def self_time(self):
+        return self.time - sum(c.time for c in self.children.values())
+
+    def walk(self, path = ()):
+        path = path + (self.name,)
+        yield path, self
+        for c in self.children.values():
+            yield from c.walk(path)
+
+def geometry_size(obj):
+    # (polygons, vertices) of the geometry in a boolean argument or result
+    if isinstance(obj, (list, tuple)):
+        sizes = [geometry_size(o) for o in obj]
+        return sum(s[0] for s in sizes), sum(s[1] for s in sizes)
+    if isinstance(obj, (Device, gdspy.CellReference)):
+        polygons = obj.get_polygons()
+    elif isinstance(obj, gdspy.PolygonSet):
+        polygons = obj.polygons
+    else:
+        return 0, 0
+    return len(polygons), sum(len(p) for p in polygons)
+
+class Section:
+    __slots__ = ('profiler', 'node', 'parent', 'start')
+
+    def __init__(self, profiler, name, inputs):
+        self.profiler = profiler
+        stack = profiler.stack()
+        self.parent = stack[-1]
+        with profiler.lock:
+            self.node = self.parent.child(name)
+            if inputs:
+                polygons, vertices = geometry_size(inputs)
+                self.node.polygons_in += polygons
+                self.node.vertices_in += vertices
+        stack.append(self.node)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.profiler.stack().pop()
+        with self.profiler.lock:
+            self.node.count += 1
+            self.node.time += elapsed
+
+    def output(self, result):
+        polygons, vertices = geometry_size(result)
+        with self.profiler.lock:
+            self.node.polygons_out += polygons
+            self.node.vertices_out += vertices
+
+class Profiler:
+    # Opt-in timing tree of builder calls, booleans and exports.
+    # While disabled the library functions are the original ones and the builders only test self.enabled.
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.patched = {}
+        self.reset()
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    def reset(self):
+        self.root = ProfileNode('build')
+        self.local = threading.local()
+
+    def stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = [self.root]
+        return stack
+
+    def section(self, name, inputs = None):
+        return Section(self, name, inputs)
+
+    def call(self, name, function, args, kwargs, geometry = False):
+        with self.section(name, (args, tuple(kwargs.values())) if geometry else None) as s:
+            result = function(*args, **kwargs)
+            if geometry:
+                s.output(result)
+        return result
+
+    # Library calls timed while enabled, (owner, attribute, name, geometry)
+    targets = [
+        (pg, 'boolean', 'pg.boolean', True),
+        (pg, 'union', 'pg.union', True),
+        (pg, 'invert', 'pg.invert', True),
+        (pg, 'extract', 'pg.extract', True),
+        (gdspy.PolygonSet, 'fillet', 'fillet', False),
+        (Device, 'write_gds', 'write_gds', False),
+    ]
+
+    def enable(self):
+        if self.enabled:
+            return
+        for owner, attribute, name, geometry in self.targets:
+            original = getattr(owner, attribute)
+            self.patched[(owner, attribute)] = original
+            setattr(owner, attribute, self.wrap(original, name, geometry))
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        for (owner, attribute), original in self.patched.items():
+            setattr(owner, attribute, original)
+        self.patched = {}
+
+    def wrap(self, function, name, geometry):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            return self.call(name, function, args, kwargs, geometry)
+        return wrapper
+
+    def nodes(self):
+        # (path, node) for every recorded call site, depth first
+        for path, node in self.root.walk():
+            if node is not self.root:
+                yield path[1:], node
+
+    def summary(self, min_time = 0.0):
+        lines = [f"{'section':50s} {'calls':>7s} {'total ms':>10s} {'self ms':>10s} {'polygons in/out':>17s} {'vertices in/out':>21s}"]
+        for path, node in self.nodes():
+            if node.time < min_time:
+                continue
+            polygons = f"{node.polygons_in}/{node.polygons_out}" if node.polygons_in or node.polygons_out else ""
+            vertices = f"{node.vertices_in}/{node.vertices_out}" if node.vertices_in or node.vertices_out else ""
+            lines.append(f"{'  '*(len(path) - 1) + node.name:50s} {node.count:7d} {node.time*1e3:10.2f} {node.self_time*1e3:10.2f} "
+                         f"{polygons:>17s} {vertices:>21s}")
+        return "\n".join(lines)
+
+    def print_summary(self, min_time = 0.0):
+        print(self.summary(min_time))
+
+    def write_folded(self, filename):
+        # Folded stacks ("a;b;c self_time_in_us"), readable by flamegraph.pl and speedscope
+        with open(filename, 'w') as f:
+            for path, node in self.nodes():
+                us = int(round(node.self_time*1e6))
+                if us > 0:
+                    f.write(";".join(path) + f" {us}\n")
+
+profiler = Profiler()
+
+def profiled(function = None, name = None, geometry = False):
+    # Times every call while the profiler is enabled, geometry = True also counts the polygons in and out
+    if function is None:
+        return lambda f: profiled(f, name, geometry)
+    name = name or function.__name__
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if not profiler.enabled:
+            return function(*args, **kwargs)
+        return profiler.call(name, function, args, kwargs, geometry)
+    wrapper.profiled_name = name
+    return wrapper
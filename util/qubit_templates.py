@@ -1,6 +1,5 @@
 import numpy as np
 import math, pprint
-import matplotlib.pyplot as plt
 from scipy import constants as const
 from phidl import quickplot as qp
 from phidl import Device
@@ -11,10 +10,50 @@ import phidl.routing as pr
 import phidl.path as pp
 from functions import *
 from BaseDevice import *
+from render import preview, render_policy
+from discretization import discretization_profile
+from drc import check_design, print_drc_report
 
 finger_layer = 1
 box_layer = 2
 
+# Fixed straight before the first turn of a side resonator
+side_straight_length = 250
+# Points per 360 degrees used by pp.arc (legacy discretization profile)
+arc_num_pts = 720
+# Name in discretization.profiles or {'tolerance': ..., 'layers': {layer: tolerance}}
+Discretization_profile = 'legacy'
+# Design rules (DRC: rules: in the yaml), see design_rule_check
+DRC_rules = ()
+
+def arc_points(radius, layer, default = arc_num_pts, angle = 90):
+    # Points per 360 degrees of an arc of angle on layer under the discretization profile
+    return discretization_profile(Discretization_profile).points_per_turn(radius, layer, default, angle)
+
+def circle_resolution(radius, layer, default = 2.5):
+    # angle_resolution of pg.circle under the discretization profile
+    return discretization_profile(Discretization_profile).angle_resolution(radius, layer, default)
+
+def fillet(polygon, radius, layer):
+    polygon.fillet(radius, points_per_2pi = arc_points(radius, layer, default = 128))
+
+def meander_segments(resonator_straight1 = 240,
+                     resonator_straight2 = 290,
+                     resonator_straight3 = 475,
+                     resonator_straight4 = 1400,
+                     n_step = 3,
+                     side = False ):
+    # ("straight", length) or ("arc", angle) in the order make_Path appends them
+    segments = []
+    if side:
+        segments += [("straight", side_straight_length), ("arc", -90)]
+    segments += [("straight", resonator_straight4), ("arc", -90), ("straight", resonator_straight3), ("arc", -180)]
+    for i in range(n_step):
+        segments += [("straight", resonator_straight2), ("arc", 180 if i % 2 == 0 else -180)]
+    segments += [("straight", resonator_straight1)]
+    return segments
+
+@configurable
 def make_Path(resonator_straight1 = 240, 
               resonator_straight2 = 290, 
               resonator_straight3 = 475, # determines the inductive coupling
@@ -23,59 +62,198 @@ def make_Path(resonator_straight1 = 240,
               side = False ):
 
     P = Path()
-    left180_turn = pp.arc(radius = Resonator_radius, angle = 180)
-    right180_turn = pp.arc(radius = Resonator_radius, angle = -180)
     # left_turn = pp.euler(radius = resonator_radius, angle = 90)
     # right_turn = pp.euler(radius = resonator_radius, angle = -90)
-    left_turn = pp.arc(radius = Resonator_radius, angle = 90)
-    right_turn = pp.arc(radius = Resonator_radius, angle = -90)
-    straight1 = pp.straight(length = resonator_straight1)
-    straight2 = pp.straight(length = resonator_straight2)
-    straight3 = pp.straight(length = resonator_straight3)
-    straight4 = pp.straight(length = resonator_straight4)
-    straight5 = pp.straight(length = 250)
-
+    turns = {}
     path_list = []
-    if side:
-        path_list = [
-            straight5,
-            right_turn,
-        ]
-
-    path_list.extend([
-        straight4,
-        right_turn,
-        straight3,
-        right180_turn
-    ])
-
-    for i in range(n_step):
-        if i % 2 == 0:
-            turn = left180_turn
+    for kind, value in meander_segments(resonator_straight1, resonator_straight2, resonator_straight3,
+                                        resonator_straight4, n_step, side):
+        if kind == "straight":
+            path_list.append(pp.straight(length = value))
         else:
-            turn = right180_turn
-        path_list.extend([
-            straight2,
-            turn
-        ])
-    path_list.extend([straight1])
+            if value not in turns:
+                turns[value] = pp.arc(radius = Resonator_radius, angle = value, num_pts = arc_points(Resonator_radius, Resonator_layer, angle = value))
+            path_list.append(turns[value])
     P.append(path_list)
     
     return P
 
-
+def arc_length(radius, angle, num_pts = None):
+    # Length of the polyline pp.arc builds (slightly shorter than the true arc)
+    if num_pts is None:
+        num_pts = arc_points(radius, Resonator_layer, angle = angle)
+    n = abs(int(num_pts * angle / 360))
+    step = np.deg2rad(abs(angle)) / (n - 1)
+    return (n - 1) * 2 * radius * np.sin(step / 2)
+
+@configurable
+def meander_length(resonator_straight1 = 240,
+                   resonator_straight2 = 290,
+                   resonator_straight3 = 475,
+                   resonator_straight4 = 1400,
+                   n_step = 3,
+                   side = False,
+                   radius = None ):
+    # P.length() of make_Path without building it, broadcasts over numpy arrays
+    radius = Resonator_radius if radius is None else radius
+    n_step = np.asarray(n_step)
+    straights = resonator_straight4 + resonator_straight3 + n_step*resonator_straight2 + resonator_straight1
+    arcs = arc_length(radius, 90) + (1 + n_step)*arc_length(radius, 180)
+    if side:
+        straights = straights + side_straight_length
+        arcs = arcs + arc_length(radius, 90)
+    return (straights + arcs)[()]
+
+@configurable
+def meander_straights(norm_to_length,
+                      resonator_straight1 = 240,
+                      resonator_straight2 = 290,
+                      resonator_straight3 = 475,
+                      resonator_straight4 = 1400,
+                      n_step = 3,
+                      side = False,
+                      radius = None ):
+    # Scale the four straights so that the path is norm_to_length long, turns and the side straight are fixed
+    scaled = resonator_straight4 + resonator_straight3 + n_step*resonator_straight2 + resonator_straight1
+    fixed = meander_length(0, 0, 0, 0, n_step = n_step, side = side, radius = radius)
+    norm_factor = (norm_to_length - fixed) / scaled
+    if np.any(norm_factor <= 0):
+        raise ValueError(f"norm_to_length {norm_to_length} is shorter than the turns of the meander ({fixed})")
+    return tuple(norm_factor * np.asarray(x) for x in (resonator_straight1, resonator_straight2, resonator_straight3, resonator_straight4))
+
+@configurable
+def meander_bbox(resonator_straight1 = 240,
+                 resonator_straight2 = 290,
+                 resonator_straight3 = 475,
+                 resonator_straight4 = 1400,
+                 n_step = 3,
+                 side = False,
+                 radius = None ):
+    # Bounding box of the resonator pocket (without the coupling pad) in device_Resonator coordinates.
+    # Turns are multiples of 90 degrees, so the extremes of the centerline are the segment ends and the arc apexes.
+    radius = Resonator_radius if radius is None else radius
+    half_width = 0.5*Resonator_width + Resonator_gap_width
+    position = np.zeros(2)
+    heading = 0
+    points = []
+    for kind, value in meander_segments(resonator_straight1, resonator_straight2, resonator_straight3,
+                                        resonator_straight4, n_step, side):
+        normal = np.array([-np.sin(np.deg2rad(heading)), np.cos(np.deg2rad(heading))]).round()
+        if kind == "straight":
+            end = position + value*np.array([normal[1], -normal[0]])
+            points += [position + half_width*normal, position - half_width*normal, end + half_width*normal, end - half_width*normal]
+            position = end
+            continue
+        turn = np.sign(value)
+        center = position + turn*radius*normal
+        for k in range(abs(value) // 90):
+            heading += 90*turn
+            normal = np.array([-np.sin(np.deg2rad(heading)), np.cos(np.deg2rad(heading))]).round()
+            position = center - turn*radius*normal
+            points += [position + half_width*normal, position - half_width*normal]
+    points = np.array(points)
+    (x0, y0), (x1, y1) = points.min(axis = 0), points.max(axis = 0)
+    # device_Resonator rotates the path by 90 degrees and moves the end of straight1 to x = 0
+    dx = -(resonator_straight1 + radius)
+    return np.array([[-y1 + dx, x0], [-y0 + dx, x1]])
+
+@configurable
+def meander_report(cases, radius = None):
+    # Analytic model vs. P.length() and the pocket bounding box of the built path, one line per case (dict of make_Path kwargs)
+    rows = []
+    for kwargs in cases:
+        P = make_Path(**kwargs)
+        model = float(meander_length(**kwargs, radius = radius))
+        measured = P.length()
+        X = P.extrude(Resonator_width + 2*Resonator_gap_width)
+        X.rotate(90)
+        X.movex(-(kwargs.get('resonator_straight1', 240) + Resonator_radius))
+        bbox_error = float(np.abs(meander_bbox(**kwargs, radius = radius) - X.bbox).max())
+        rows.append(dict(kwargs, model = model, measured = measured, error = model - measured, bbox_error = bbox_error))
+        print(f"{kwargs}  model {model:.6f}  P.length() {measured:.6f}  error {model - measured:.2e}  bbox error {bbox_error:.2e}")
+    return rows
+
+@configurable
+def meander_solve(frequency,
+                  box = (1500, 2000),
+                  min_pitch = 50,
+                  resonator_straight3 = 475,
+                  min_straight = 0,
+                  radius = None,
+                  max_step = 50,
+                  material = "silicon",
+                  height = 525 ):
+    # make_Path parameters (side = False) for resonators of the given frequencies [MHz] (any array shape).
+    # box = (width, height) of the resonator pocket without the pad in device_Resonator orientation.
+    # The meander lines are 2*radius apart, min_pitch is the centerline clearance to straight4 and the pad.
+    # Uses the fewest n_step that reach the length, the free straights are scaled together between their limits.
+    radius = Resonator_radius if radius is None else radius
+    half_width = 0.5*Resonator_width + Resonator_gap_width
+    width, length = box
+    if 2*radius < min_pitch:
+        raise ValueError(f"meander lines are 2*radius = {2*radius} apart, less than min_pitch = {min_pitch}")
+    if resonator_straight3 + 2*radius + 2*half_width > width:
+        raise ValueError(f"resonator_straight3 = {resonator_straight3} does not fit in the box width {width}")
+
+    target = np.asarray(calculate_resonator_length(frequency = frequency, core_width = Resonator_width,
+                                                   gap_width = Resonator_gap_width, height = height, material = material), dtype = float)
+    n = np.arange(max_step + 1)
+
+    # straight2: meander arms, their turns stay min_pitch below straight4
+    s2_min = np.full(n.shape, float(min_straight))
+    s2_max = np.full(n.shape, resonator_straight3 - min_pitch, dtype = float)
+    # straight4 covers the meander and keeps min_pitch to the pad, the pocket ends within the box length
+    s4_min = radius + 2*radius*n + min_pitch
+    s4_max = np.full(n.shape, length - radius - half_width, dtype = float)
+    # straight1 runs up (n even) below straight4 or down (n odd) no further than the meander bottom
+    s1_min = s2_min
+    s1_max = np.where(n % 2 == 0, resonator_straight3 + radius - min_pitch, s2_max)
+
+    arcs = meander_length(0, 0, 0, 0, n_step = n, radius = radius)
+    L_min = s4_min + resonator_straight3 + n*s2_min + s1_min + arcs
+    L_max = s4_max + resonator_straight3 + n*s2_max + s1_max + arcs
+    valid = (s2_max >= s2_min) & (s4_max >= s4_min) & (s1_max >= s1_min)
+
+    feasible = valid & (L_min <= target[..., None]) & (target[..., None] <= L_max)
+    if not feasible.any(axis = -1).all():
+        missed = np.asarray(frequency)[~feasible.any(axis = -1)] if np.ndim(frequency) else frequency
+        raise ValueError(f"no meander in box {box} reaches the length for frequency {missed} MHz")
+    k = feasible.argmax(axis = -1)
+
+    span = L_max[k] - L_min[k]
+    t = np.divide(target - L_min[k], span, out = np.zeros_like(target), where = span > 0)
+    def scale(lo, hi):
+        return (lo[k] + t*(hi[k] - lo[k]))[()]
+    return dict(
+        resonator_straight1 = scale(s1_min, s1_max),
+        resonator_straight2 = scale(s2_min, s2_max),
+        resonator_straight3 = resonator_straight3,
+        resonator_straight4 = scale(s4_min, s4_max),
+        n_step = n[k][()],
+    )
+
+@configurable
 def device_Wafer(inch = 4):
     wafer = Device('wafer')
     wafer_radius = 0.5 * inch * 25.4 * 1e3 # inch to um
-    circle = pg.circle(radius = wafer_radius, angle_resolution = 2.5, layer = Wafer_layer)
+    circle = pg.circle(radius = wafer_radius, angle_resolution = circle_resolution(wafer_radius, Wafer_layer), layer = Wafer_layer)
     inv_circle = pg.invert(circle, border = 7000, precision = 1e-6, layer = Wafer_layer)
     wafer.add_ref( inv_circle )
     return wafer
 
+@configurable
+def device_Frame():
+    FM = Device('frame')
+    rectangle = pg.rectangle((Frame_size_width, Frame_size_height), Frame_layer)
+    FM.add_ref( pg.invert(rectangle, border = Frame_width, precision = 1e-6, layer = Frame_layer) )
+    FM.center = (0, 0)
+    return FM
+
 class device_ShortToGround(BaseDevice):
     def __init__(self):
         
         super().__init__("short")
+        self.derive_metal(layer = LaunchPad_layer)
 
         # LP oriented in x direction (x = length, y = width)
         components = {}
@@ -92,12 +270,11 @@ class device_ShortToGround(BaseDevice):
         self.pocket.add_port(name = 'out', midpoint = [0, 0.], width = pocket_width, orientation = 180)        
         self.center = (0,0)
 
-        self.metal.add_ref( boolean_with_ports(self.pocket, self.device, "not", layer = LaunchPad_layer) )
-
 class device_OpenToGround(BaseDevice):
     def __init__(self):
         
         super().__init__("open")
+        self.derive_metal(layer = LaunchPad_layer)
 
         # LP oriented in x direction (x = length, y = width)
         components = {}
@@ -114,12 +291,11 @@ class device_OpenToGround(BaseDevice):
         self.pocket.add_port(name = 'out', midpoint = [0, 0.], width = pocket_width, orientation = 180)        
         self.center = (0,0)
 
-        self.metal.add_ref( boolean_with_ports(self.pocket, self.device, "not", layer = LaunchPad_layer) )
-
 class device_LaunchPad(BaseDevice):
     def __init__(self):
         
         super().__init__("launchpad")
+        self.derive_metal(layer = LaunchPad_layer)
 
         # LP oriented in x direction (x = length, y = width)
         components = {}
@@ -155,21 +331,19 @@ class device_LaunchPad(BaseDevice):
         self.center = (0,0)
         self.xmin = 0
 
-        self.metal.add_ref( boolean_with_ports(self.pocket, self.device, "not", layer = LaunchPad_layer) )
-
 class device_Pad(BaseDevice):
     def __init__(self):
         super().__init__("PAD")    
 
         rectangle_up = pg.rectangle(( Pad_width, Pad_height), Pad_layer)
-        rectangle_up.polygons[0].fillet( Pad_rounding )
+        fillet( rectangle_up.polygons[0], Pad_rounding, Pad_layer )
         rectangle_up.movex(-0.5*Pad_width)
         #rectangle_up.add_port(name = 'Junction_up', midpoint = [0., 0], width = 10, orientation = -90)
         rectangle_up.movey(0.5*Pad_gap)
         self.metal.add_ref( rectangle_up )
 
         rectangle_down = pg.rectangle(( Pad_width, Pad_height), Pad_layer)
-        rectangle_down.polygons[0].fillet( Pad_rounding )
+        fillet( rectangle_down.polygons[0], Pad_rounding, Pad_layer )
         rectangle_down.mirror(p1 = (0, 0), p2 = (200, 0))
         rectangle_down.movex(-0.5*Pad_width)
         #rectangle_down.add_port(name = f'LaunchPad{self.id}_{str(Pad_gap)}', midpoint = [0, 0.], width = Pad_gap, orientation = 90)
@@ -218,6 +392,7 @@ class device_FeedLine(BaseDevice):
     def __init__(self):
         # make 2 pads
         super().__init__("feedline")
+        self.derive_metal(layer = LaunchPad_layer)
 
         LP_in = globals()[f"device_{FeedLine_input_type}"]()
         LP_in.rotate(FeedLine_input_angle).move(FeedLine_input_pos)
@@ -238,9 +413,9 @@ class device_FeedLine(BaseDevice):
             P = Path()
             for pathtype, length in FeedLine_path_points:
                 if pathtype == "left":
-                    path = pp.arc(radius = length, angle = 90)
+                    path = pp.arc(radius = length, angle = 90, num_pts = arc_points(length, LaunchPad_layer))
                 elif pathtype == "right":
-                    path = pp.arc(radius = length, angle = -90)
+                    path = pp.arc(radius = length, angle = -90, num_pts = arc_points(length, LaunchPad_layer))
                 elif pathtype == "straight":
                     path = pp.straight(length = length)
                 P.append(path)
@@ -267,7 +442,7 @@ class device_FeedLine(BaseDevice):
             pocket_ref.connect(port = "out", destination = FeedLine_pocket.ports['out'])   
         
         elif FeedLine_path_type == "manual":
-            manual_path = [ LP_in.device.ports['out'].midpoint ] + FeedLine_path_points +  [ LP_out.device.ports['out'].midpoint ]
+            manual_path = [ LP_in.device.ports['out'].midpoint ] + list(FeedLine_path_points) +  [ LP_out.device.ports['out'].midpoint ]
             print(manual_path)
             D3 = pr.route_smooth(LP_in.device.ports['out'], 
                                     LP_out.device.ports['out'], 
@@ -275,14 +450,14 @@ class device_FeedLine(BaseDevice):
                                     path_type='manual', 
                                     manual_path=manual_path, 
                                     radius = FeedLine_path_radius,
-                                    smooth_options={'corner_fun': pp.arc})
+                                    smooth_options={'corner_fun': pp.arc, 'num_pts': arc_points(FeedLine_path_radius, LaunchPad_layer)})
             D4 = pr.route_smooth(LP_in.device.ports['out'], 
                                     LP_out.device.ports['out'], 
                                     path_type='manual', 
                                     manual_path=manual_path,
                                     radius = FeedLine_path_radius, 
                                     layer = LaunchPad_layer,
-                                    smooth_options={'corner_fun': pp.arc})
+                                    smooth_options={'corner_fun': pp.arc, 'num_pts': arc_points(FeedLine_path_radius, LaunchPad_layer)})
             
             self.device.add_ref(D3)
             self.pocket.add_ref(D4)
@@ -296,26 +471,25 @@ class device_FeedLine(BaseDevice):
                                  length1 = FeedLine_path_length1,
                                  length2 = FeedLine_path_length2,
                                  radius = FeedLine_path_radius,
-                                 smooth_options={'corner_fun': pp.arc})
+                                 smooth_options={'corner_fun': pp.arc, 'num_pts': arc_points(FeedLine_path_radius, LaunchPad_layer)})
             D4 = pr.route_smooth(LP_in.pocket.ports['out'], 
                                  LP_out.pocket.ports['out'], 
                                  path_type = FeedLine_path_type,
                                  length1 = FeedLine_path_length1,
                                  length2 = FeedLine_path_length2,
                                  radius = FeedLine_path_radius,
-                                 smooth_options={'corner_fun': pp.arc})
+                                 smooth_options={'corner_fun': pp.arc, 'num_pts': arc_points(FeedLine_path_radius, LaunchPad_layer)})
 
             self.device.add_ref(D3)
             self.pocket.add_ref(D4)
             self.add_ref(LP_out)
 
-        self.metal.add_ref( boolean_with_ports(self.pocket, self.device, "not", layer = LaunchPad_layer) )
-
 
 class device_EntangleLine(BaseDevice):
     def __init__(self, config):
         # make 2 pads
         super().__init__("entangleline")
+        self.derive_metal(layer = 4)
         pprint.pprint(config)
         X = CrossSection()
         line_width = 10
@@ -328,19 +502,18 @@ class device_EntangleLine(BaseDevice):
         config["width"] = line_width + 2*line_gap_width
         self.pocket = pr.route_smooth( **config )
 
-        self.metal.add_ref( boolean_with_ports(self.pocket, self.device, "not", layer = 4) )
-
 class device_DCLine(BaseDevice):
     def __init__(self):
         super().__init__("DCLine")
+        self.derive_metal(layer = LaunchPad_layer)
 
         LP = device_LaunchPad()
         LP.move((1650, -1300))
         device_ref, metal_ref, pocket_ref = self.add_ref(LP)
 
         P = Path()
-        left_turn = pp.arc(radius = DCLine_radius, angle = 90)
-        right_turn = pp.arc(radius = DCLine_radius, angle = -90)
+        left_turn = pp.arc(radius = DCLine_radius, angle = 90, num_pts = arc_points(DCLine_radius, LaunchPad_layer))
+        right_turn = pp.arc(radius = DCLine_radius, angle = -90, num_pts = arc_points(DCLine_radius, LaunchPad_layer))
         straight1 = pp.straight(length = 235)
         straight2 = pp.straight(length = 805)
         straight3 = pp.straight(length = 2973)
@@ -374,8 +547,7 @@ class device_DCLine(BaseDevice):
         DCLine_pocket = self.pocket.add_ref( DCLine_pocket )
         DCLine_pocket.connect(port = 'out1', destination = pocket_ref.ports['out'])
 
-        self.metal.add_ref( boolean_with_ports(self.pocket, self.device, "not", layer = LaunchPad_layer) )
-
+@configurable
 def device_CornerPoints():
     CP = Device("CornerPoints")
     rectangle = pg.rectangle( (CornerPoint_width, CornerPoint_width), layer = CornerPoint_layer)
@@ -385,6 +557,7 @@ def device_CornerPoints():
         cp.center = center
     return CP
 
+@configurable
 def device_TestAreas(DCLine = False):
 
     if DCLine:
@@ -413,7 +586,7 @@ def device_TestAreas(DCLine = False):
     ]
     TP.add_polygon(polpoints)
     TP = pg.union(TP, by_layer = False, layer = TestPoint_layer)
-    qp(TP)
+    preview(TP)
 
     for center in point_pos:
         tp = TPs.add_ref( TP )
@@ -422,6 +595,7 @@ def device_TestAreas(DCLine = False):
 
     return TPs
 
+@configurable
 def device_TestBoxes(DCLine = False):
 
     if DCLine:
@@ -460,6 +634,7 @@ class device_Resonator(BaseDevice):
                  ):
         # make 2 pads
         super().__init__("resonator")
+        self.derive_metal(layer = Resonator_layer)
 
         # Create a blank CrossSection
         X = CrossSection()
@@ -469,6 +644,19 @@ class device_Resonator(BaseDevice):
         X.add(width=Resonator_gap_width, offset = -0.5*(Resonator_width + Resonator_gap_width), layer = Resonator_layer)
         
         # Combine the Path and the CrossSection
+        if norm_to_length:
+            # solve the straights before building any geometry
+            resonator_straight1, resonator_straight2, resonator_straight3, resonator_straight4 = (
+                float(x) for x in meander_straights(
+                    norm_to_length,
+                    resonator_straight1 = resonator_straight1,
+                    resonator_straight2 = resonator_straight2,
+                    resonator_straight3 = resonator_straight3,
+                    resonator_straight4 = resonator_straight4,
+                    n_step = n_step,
+                    side = side
+                )
+            )
         P = make_Path(
                  resonator_straight1 = resonator_straight1, 
                  resonator_straight2 = resonator_straight2, 
@@ -477,20 +665,6 @@ class device_Resonator(BaseDevice):
                  n_step = n_step,
                  side = side 
         )
-        if norm_to_length:
-            norm_factor = float( (norm_to_length - (3 + 2*n_step)*(math.pi/2)*Resonator_radius) /(P.length() - (3 + 2*n_step)*(math.pi/2)*Resonator_radius) )
-            resonator_straight1 = norm_factor * resonator_straight1
-            resonator_straight2 = norm_factor * resonator_straight2
-            resonator_straight3 = norm_factor * resonator_straight3
-            resonator_straight4 = norm_factor * resonator_straight4       
-            P = make_Path(
-                 resonator_straight1 = resonator_straight1, 
-                 resonator_straight2 = resonator_straight2, 
-                 resonator_straight3 = resonator_straight3,
-                 resonator_straight4 = resonator_straight4,
-                 n_step = n_step,
-                 side = side 
-            )                             
 
         device = P.extrude(X)
         pocket = P.extrude(Resonator_width + 2*Resonator_gap_width, layer = Resonator_layer)
@@ -541,11 +715,10 @@ class device_Resonator(BaseDevice):
                     pad.add_port(name = port.name, midpoint = port.midpoint, width = port.width, orientation = port.orientation)
 
             pad_pocket = extract_with_ports(pad, [0])
-            pad_device = boolean_with_ports(pad, cap, "not", layer = 4)
-            pad_device = boolean_with_ports(pad_device, cap_qubit_up, "not", layer = 4)    
-            pad_device = boolean_with_ports(pad_device, cap_qubit_down, "not", layer = 4)        
+            subtract = [cap, cap_qubit_up, cap_qubit_down]
             if entangle:
-                pad_device = boolean_with_ports(pad_device, cap_entangle, "not", layer = 4)        
+                subtract.append(cap_entangle)
+            pad_device = boolean_pipeline(pad, [("not", d) for d in subtract], layer = 4)
         
             # Quickplot the resulting Device
             pad_device = self.device.add_ref(pad_device)
@@ -577,12 +750,9 @@ class device_Resonator(BaseDevice):
             print(f"Length : {P.length()} [um]")
         if plot_curvature:
             s, K = P.curvature()
-            plt.plot(s, K, ".-")
-            plt.xlabel("Position along curve (arc length)")
-            plt.ylabel("Curvature")
-
-        self.metal.add_ref( boolean_with_ports(self.pocket, self.device, "not", layer = Resonator_layer) )
+            render_policy.curve(s, K, xlabel = "Position along curve (arc length)", ylabel = "Curvature")
 
+@configurable
 def device_JJ( width = 0.135, bridge_width = 1.0, finger_width = 0.2, JJtype = "manhattan", squid = False, bandage = True, photolitho = False):
     JJ=Device('JJ')
     JJ_half=Device('JJ_half')
@@ -620,7 +790,7 @@ def device_JJ( width = 0.135, bridge_width = 1.0, finger_width = 0.2, JJtype = "
             #     finger_outer2.connect(port = 'out', destination = finger_inner2.ports['in'])
 
             JJ_half = pg.union(JJ_half)
-            JJ_half.polygons[0].fillet( finger_rounding_radius )
+            fillet( JJ_half.polygons[0], finger_rounding_radius, finger_layer )
             JJ_half = pg.union(JJ_half)
 
             JJ.add_ref( JJ_half )
@@ -629,7 +799,7 @@ def device_JJ( width = 0.135, bridge_width = 1.0, finger_width = 0.2, JJtype = "
 
             # Remove corner in JJ
             JJ = pg.union(JJ)
-            JJ.polygons[0].fillet( JJ_rounding )
+            fillet( JJ.polygons[0], JJ_rounding, finger_layer )
             JJ = pg.union(JJ)        
             
             if squid:
@@ -863,7 +1033,7 @@ def device_JJ( width = 0.135, bridge_width = 1.0, finger_width = 0.2, JJtype = "
             pad_triangle = JJ_half.add_ref( pad_triangle )
             pad_triangle.connect(port = 1, destination = pad_box.ports['out'])
             JJ_half = pg.union(JJ_half, by_layer = False, layer = finger_layer)
-            JJ_half.polygons[0].fillet( pad_rounding_radius )
+            fillet( JJ_half.polygons[0], pad_rounding_radius, finger_layer )
 
             # make finger
             finger = pg.taper(length = finger_length + pad_finger_overlay, width1 = finger_width, width2 = finger_width, port = None, layer = finger_layer)
@@ -1057,6 +1227,7 @@ def device_JJ( width = 0.135, bridge_width = 1.0, finger_width = 0.2, JJtype = "
 
     return JJ
 
+@configurable
 def device_EBLine():
     EBLine=Device('EBLine')
 
@@ -1089,6 +1260,7 @@ def device_EBLine():
     EBLine.center = (0,0)
     return EBLine
 
+@configurable
 def device_EBmarkers(marker_pos = [(0,0),(0,38400),(-19200,-28800),(38400,0), (0,-38400),(-19200,-38400),(-38400,0)],layer = 3):
     EBmarkers = Device("EBmarkers")
     EBmarker = Device("EBmarker")
@@ -1128,6 +1300,7 @@ def device_EBmarkers(marker_pos = [(0,0),(0,38400),(-19200,-28800),(38400,0), (0
     return EBmarkers
 
 
+@configurable
 def device_DicingMarkers(width = 100, length = 400, layer = 3):
     DicingMarkers = Device("DicingMarkers")
     tmp1 = pg.bbox([(-0.5*width,-0.5*length), (0.5*width,0.5*length)])
@@ -1137,9 +1310,34 @@ def device_DicingMarkers(width = 100, length = 400, layer = 3):
     DicingMarkers.add_ref(marker)
     return DicingMarkers
 
-def device_Grid(inch = 4):
+def grid_line_boxes(count, pitch, width, length, axis):
+    # Boxes of count lines of the given width, centered on (0, 0) with a center to center pitch
+    centers = (np.arange(count) - 0.5*(count - 1))*pitch
+    boxes = np.zeros((count, 2, 2))
+    boxes[:, 0, axis] = centers - 0.5*width
+    boxes[:, 1, axis] = centers + 0.5*width
+    boxes[:, 0, 1 - axis] = -0.5*length
+    boxes[:, 1, 1 - axis] = 0.5*length
+    return boxes
+
+@configurable
+def device_Grid(inch = 4, clip = "analytic"):
+    # clip = "analytic" cuts the lines at the wafer edge in closed form, "boolean" runs pg.boolean against the inverted wafer
     grid = Device("Grid")
     wafer_radius = 0.5 * inch * 25.4 * 1e3 # inch to um
+    if clip == "analytic":
+        boxes = np.concatenate([
+            grid_line_boxes(Grid_lines_x, Frame_width + Frame_size_width, Frame_width, 2*wafer_radius, axis = 0),
+            grid_line_boxes(Grid_lines_y, Frame_width + Frame_size_height, Frame_width, 2*wafer_radius, axis = 1),
+        ])
+        rectangles = [[(x0, y0), (x1, y0), (x1, y1), (x0, y1)] for (x0, y0), (x1, y1) in boxes]
+        polygons = clip_to_circle(rectangles, wafer_radius, angle_resolution = circle_resolution(wafer_radius, Wafer_layer))
+        if polygons:
+            grid.add_polygon(polygons, layer = Grid_layer)
+        return grid
+    if clip != "boolean":
+        raise ValueError(f"device_Grid() clip {clip} must be 'analytic' or 'boolean'")
+
     device_list_perp = [pg.rectangle(size = (Frame_width, 2*wafer_radius), layer = Grid_layer) for i in range(Grid_lines_x)]
     device_list_horiz = [pg.rectangle(size = (2*wafer_radius, Frame_width), layer = Grid_layer) for i in range(Grid_lines_y)]
     grid_perp = pg.grid(device_list_perp,
@@ -1152,7 +1350,7 @@ def device_Grid(inch = 4):
                 separation = False,
                 shape = (1, Grid_lines_y)) 
     grid_horiz.center = (0, 0)
-    circle = pg.circle(radius = wafer_radius, angle_resolution = 2.5, layer = 21)
+    circle = pg.circle(radius = wafer_radius, angle_resolution = circle_resolution(wafer_radius, Wafer_layer), layer = 21)
     inv_circle = pg.invert(circle, border = 7000, precision = 1e-6, layer = 21)
     grid_perp = pg.boolean(A = grid_perp, B = inv_circle, operation = 'not', precision = 1e-6,
                 num_divisions = [1,1], layer = Grid_layer)
@@ -1160,4 +1358,12 @@ def device_Grid(inch = 4):
                 num_divisions = [1,1], layer = Grid_layer)    
     grid.add_ref( grid_perp )
     grid.add_ref( grid_horiz )    
-    return grid
\ No newline at end of file
+    return grid
+
+@configurable
+def design_rule_check(device, rules = None, tolerance = 1e-3):
+    # Checks device (a Device or BaseDevice, up to a full wafer) against DRC_rules or the given rules.
+    # Returns a list of drc.Violation with the position, measured distance and the builders involved.
+    if isinstance(device, BaseDevice):
+        device = device.device
+    return check_design(device, DRC_rules if rules is None else rules, globals(), tolerance = tolerance)
@@ -0,0 +1,103 @@
+import os
+
+# inline   : draw when the builder asks for it (notebooks, the default)
+# deferred : keep the previews and draw them with render_policy.render()
+# off      : never draw, matplotlib is not imported
+render_modes = ('off', 'deferred', 'inline')
+
+class RenderPolicy:
+    def __init__(self, mode = None):
+        self.mode = mode or os.environ.get('QGDS_RENDER', 'inline')
+        self.previews = []
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @mode.setter
+    def mode(self, value):
+        if value not in render_modes:
+            raise ValueError(f"render mode {value} must be one of {', '.join(render_modes)}")
+        self._mode = value
+
+    def __call__(self, mode):
+        # with render_policy('off'): ...
+        return RenderMode(self, mode)
+
+    def preview(self, item, title = None):
+        # quickplot of a Device or a list of Devices
+        if self._mode == 'off':
+            return
+        if self._mode == 'deferred':
+            self.previews.append(('layout', title, item))
+            return
+        draw_layout(item, title)
+
+    def curve(self, x, y, xlabel = None, ylabel = None, title = None):
+        if self._mode == 'off':
+            return
+        if self._mode == 'deferred':
+            self.previews.append(('curve', title, (x, y, xlabel, ylabel)))
+            return
+        draw_curve(x, y, xlabel, ylabel, title)
+
+    def render(self, directory = None, dpi = 100, figsize = (8, 6)):
+        # Draw the deferred previews, saved as png files in directory or shown.
+        # A Device is drawn as it is at render time.
+        import matplotlib.pyplot as plt
+        previews, self.previews = self.previews, []
+        files = []
+        for i, (kind, title, item) in enumerate(previews):
+            if kind == 'layout':
+                fig = draw_layout(item, title)
+            else:
+                fig = draw_curve(*item, title)
+            fig.set_size_inches(figsize)
+            fig.set_dpi(dpi)
+            if directory is None:
+                plt.show()
+                continue
+            os.makedirs(directory, exist_ok = True)
+            name = f"{i:03d}_{title or getattr(item, 'name', kind)}.png"
+            fig.savefig(os.path.join(directory, name), dpi = dpi)
+            plt.close(fig)
+            files.append(os.path.join(directory, name))
+        return files
+
+    def clear(self):
+        self.previews = []
+
+class RenderMode:
+    def __init__(self, policy, mode):
+        self.policy = policy
+        self.mode = mode
+
+    def __enter__(self):
+        self.previous = self.policy.mode
+        self.policy.mode = self.mode
+        return self.policy
+
+    def __exit__(self, *exc):
+        self.policy.mode = self.previous
+
+def draw_layout(item, title = None):
+    import matplotlib.pyplot as plt
+    from phidl import quickplot
+    quickplot(item)
+    fig = plt.gcf()
+    if title is not None:
+        fig.axes[0].set_title(title)
+    return fig
+
+def draw_curve(x, y, xlabel = None, ylabel = None, title = None):
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots()
+    ax.plot(x, y, ".-")
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    if title is not None:
+        ax.set_title(title)
+    return fig
+
+render_policy = RenderPolicy()
+preview = render_policy.preview
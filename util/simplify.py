@@ -0,0 +1,89 @@
+import numpy as np
+
+def segment_distance(points, start, end):
+    # Distance of points to the segments start-end (all arrays of shape (n, 2))
+    d = end - start
+    length2 = np.einsum('ij,ij->i', d, d)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        t = np.clip(np.einsum('ij,ij->i', points - start, d)/length2, 0, 1)
+    t = np.where(length2 > 0, t, 0)
+    nearest = start + t[:, None]*d
+    return np.hypot(*(points - nearest).T)
+
+def alternate(mask):
+    # Every other True of each run of True (cyclic), so no two selected vertices are neighbors
+    n = len(mask)
+    if mask.all():
+        return np.arange(n) % 2 == 0 if n % 2 == 0 else (np.arange(n) % 2 == 0) & (np.arange(n) < n - 1)
+    shift = np.argmin(mask)     # start on a False so that no run wraps around
+    rolled = np.roll(mask, -shift)
+    index = np.arange(n)
+    start = rolled & ~np.roll(rolled, 1)
+    run_start = np.maximum.accumulate(np.where(start, index, 0))
+    return np.roll(rolled & ((index - run_start) % 2 == 0), shift)
+
+def area(points):
+    x, y = points.T
+    return 0.5*(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+def simplify_polygon(points, tolerance = 1e-3, grid = 1e-3):
+    # Snap to the grid and remove duplicate and (nearly) collinear vertices.
+    # error[i] bounds the distance of the removed vertices to edge i -> i+1, a vertex is removed only while
+    # max(error of its two edges) + its distance to the new edge <= tolerance, so the result stays within tolerance of the input.
+    points = np.asarray(points, dtype = float)
+    if grid:
+        points = np.round(points/grid)*grid
+    error = np.zeros(len(points))
+    while len(points) > 3:
+        previous, following = np.roll(points, 1, axis = 0), np.roll(points, -1, axis = 0)
+        bound = np.maximum(np.roll(error, 1), error) + segment_distance(points, previous, following)
+        remove = alternate(bound <= tolerance)
+        if not remove.any():
+            break
+        removed = np.flatnonzero(remove)
+        remove[removed[len(points) - 3:]] = False
+        # the edge before a removed vertex becomes the merged edge
+        error = np.where(np.roll(remove, -1), np.roll(bound, -1), error)
+        points, error = points[~remove], error[~remove]
+    return points
+
+def simplify_cells(cells, tolerance = 1e-3, grid = 1e-3, layers = None, report = None):
+    # Simplifies the polygons of the cells in place, per layer.
+    # Polygons that would degenerate (fewer than 3 vertices or a flipped orientation) are kept as they are,
+    # so every layer keeps its polygons and the ports are not touched.
+    # Returns {(layer, datatype): dict(polygons, vertices_before, vertices_after)}, added to report if given.
+    if layers is not None:
+        layers = {l if isinstance(l, tuple) else (l, 0) for l in layers}
+    report = {} if report is None else report
+    for cell in cells:
+        changed = False
+        for polygon in cell.polygons:
+            for i, (points, layer, datatype) in enumerate(zip(polygon.polygons, polygon.layers, polygon.datatypes)):
+                if layers is not None and (layer, datatype) not in layers:
+                    continue
+                entry = report.setdefault((layer, datatype), dict(polygons = 0, vertices_before = 0, vertices_after = 0))
+                simplified = simplify_polygon(points, tolerance, grid)
+                if len(simplified) < 3 or np.sign(area(simplified)) != np.sign(area(points)):
+                    simplified = points
+                entry['polygons'] += 1
+                entry['vertices_before'] += len(points)
+                entry['vertices_after'] += len(simplified)
+                if len(simplified) != len(points) or not np.array_equal(simplified, points):
+                    polygon.polygons[i] = simplified
+                    changed = True
+        if changed:
+            cell._bb_valid = False
+    return report
+
+def simplify_device(device, tolerance = 1e-3, grid = 1e-3, layers = None):
+    # simplify_cells on device and all its sub cells
+    cells = [device] + sorted(device.get_dependencies(recursive = True), key = lambda c: c.uid)
+    return simplify_cells(cells, tolerance, grid, layers)
+
+def print_simplify_report(report):
+    before = sum(r['vertices_before'] for r in report.values())
+    after = sum(r['vertices_after'] for r in report.values())
+    for (layer, datatype), r in sorted(report.items()):
+        print(f"layer {layer:3d}/{datatype:<3d} {r['polygons']:7d} polygons  {r['vertices_before']:9d} -> {r['vertices_after']:9d} vertices")
+    if before:
+        print(f"total {before} -> {after} vertices ({100*(1 - after/before):.1f} % fewer)")
@@ -0,0 +1,395 @@
+import importlib
+import itertools
+import os
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import numpy as np
+import phidl.geometry as pg
+from phidl import Device
+from cell_cache import cells_to_arrays, arrays_to_cells, builder_key, canonical, UncacheableArgument, UncacheableCell
+from functions import process_map
+
+def init_worker(config, modules):
+    # Spawned workers start from a clean interpreter, inject the config like the notebooks do
+    for name in modules:
+        importlib.import_module(name).__dict__.update(config)
+
+def build_cell(function, kwargs):
+    # None for cells the arrays cannot hold (Device subclasses, attributes json cannot hold),
+    # build_parallel builds those in its own process
+    cell = function(**kwargs)
+    if type(cell) is not Device:
+        return None
+    try:
+        return cells_to_arrays([cell])
+    except UncacheableCell:
+        return None
+
+def build_parallel(function, kwargs_list, workers = None, config = None, modules = ('qubit_templates', 'ChipDesign')):
+    # Build one cell per kwargs in a process pool, None entries stay None.
+    # Forked workers see the config injected in the notebook. Where workers are spawned (macOS, Windows) pass
+    # config = config, it is injected into modules in each worker, and define function in a module.
+    # Cells come back as numpy arrays of their hierarchy (see cells_to_arrays) to keep pickling cheap, so
+    # ports of sub cells and labels are kept. Cells the arrays cannot hold are built again in this process.
+    kwargs_list = list(kwargs_list)
+    workers = workers or os.cpu_count()
+    if workers <= 1 or len(kwargs_list) <= 1:
+        return [None if kw is None else function(**kw) for kw in kwargs_list]
+
+    tasks = [kw for kw in kwargs_list if kw is not None]
+    results = iter(process_map(build_cell, itertools.repeat(function, len(tasks)), tasks, workers = workers,
+                               chunksize = max(1, len(tasks) // (4*workers)),
+                               initializer = init_worker, initargs = (config or {}, modules if config else ())))
+    cells = []
+    for kw in kwargs_list:
+        if kw is None:
+            cells.append(None)
+            continue
+        data = next(results)
+        cells.append(function(**kw) if data is None else arrays_to_cells(data)[data['top_cells'][0]])
+    return cells
+
+def parameter_combinations(params):
+    keys = list(params.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*params.values())]
+
+def gridsweep_parallel(
+    function,
+    param_x = {"width": [1, 5, 6, 7]},
+    param_y = {"length": [1.1, 2, 70]},
+    param_defaults = {},
+    param_override = {},
+    spacing = (50, 100),
+    separation = True,
+    align_x = "x",
+    align_y = "y",
+    edge_x = "x",
+    edge_y = "ymin",
+    label_layer = 255,
+    workers = None,
+    config = None,
+    modules = ('qubit_templates', 'ChipDesign'),
+):
+    # Same arguments and layout as pg.gridsweep, the cells are built in a process pool
+    if param_x is None:
+        param_x = {(None, "x"): [None]}
+    elif isinstance(param_x, int):
+        param_x = {(None, "x"): [None] * param_x}
+    if param_y is None:
+        param_y = {(None, "y"): [None]}
+    elif isinstance(param_y, int):
+        param_y = {(None, "y"): [None] * param_y}
+
+    param_variations = OrderedDict()
+    param_variations.update(param_y)
+    param_variations.update(param_x)
+
+    parameter_list = parameter_combinations(param_variations)
+    for params in parameter_list:
+        params.pop((None, "x"), None)
+        params.pop((None, "y"), None)
+
+    kwargs_list = []
+    for params in parameter_list:
+        kwargs = dict(param_defaults)
+        kwargs.update(params)
+        kwargs.update(param_override)
+        kwargs_list.append(kwargs)
+
+    D_list = build_parallel(function, kwargs_list, workers = workers, config = config, modules = modules)
+
+    if label_layer is not None:
+        for D_new, params in zip(D_list, parameter_list):
+            label_text = ""
+            for name, value in params.items():
+                label_text += (f"{name}={value}") + "\n"
+            D_new.add_label(text = label_text, position = D_new.center, layer = label_layer)
+
+    D = pg.grid(
+        D_list,
+        spacing = spacing,
+        separation = separation,
+        shape = (len(parameter_combinations(param_x)), len(parameter_combinations(param_y))),
+        align_x = align_x,
+        align_y = align_y,
+        edge_x = edge_x,
+        edge_y = edge_y,
+    )
+
+    if label_layer is not None:
+        label_text = {}
+        label_text.update(param_defaults)
+        label_text.update(param_override)
+        D.add_label(text = str(label_text), position = (D.xmin, D.ymin), layer = label_layer)
+
+    return D
+
+def grid_parallel(function, kwargs_list, workers = None, config = None, modules = ('qubit_templates', 'ChipDesign'), **grid_options):
+    # pg.grid over cells built in a process pool, None entries leave an empty slot
+    D_list = build_parallel(function, kwargs_list, workers = workers, config = config, modules = modules)
+    return pg.grid(D_list, **grid_options)
+
+def gridsweep_kwargs(param_x, param_y, param_defaults = {}, param_override = {}):
+    # 2D list of kwargs (rows = param_y, columns = param_x) in pg.gridsweep order
+    rows = []
+    for py in parameter_combinations(param_y):
+        row = []
+        for px in parameter_combinations(param_x):
+            kwargs = dict(param_defaults)
+            kwargs.update(py)
+            kwargs.update(px)
+            kwargs.update(param_override)
+            row.append(kwargs)
+        rows.append(row)
+    return rows
+
+def lattice_blocks(mask):
+    # Split a boolean mask into rectangles (row, col, rows, cols), largest runs first
+    mask = mask.copy()
+    blocks = []
+    nrows, ncols = mask.shape
+    for r in range(nrows):
+        for c in range(ncols):
+            if not mask[r, c]:
+                continue
+            w = 1
+            while c + w < ncols and mask[r, c + w]:
+                w += 1
+            h = 1
+            while r + h < nrows and mask[r + h, c:c + w].all():
+                h += 1
+            mask[r:r + h, c:c + w] = False
+            blocks.append((r, c, h, w))
+    return blocks
+
+def assemble_array(function, kwargs_array, spacing = (0, 0), separation = True, name = 'assembly'):
+    # Hierarchical version of pg.grid: identical chips (same builder, kwargs and config) are
+    # built once and placed with GDS array references (AREF), single chips with SREF.
+    # Row 0 is on top like pg.grid, and every chip is centered on its lattice point.
+    kwargs_array = np.array(kwargs_array, dtype = object)
+    if kwargs_array.ndim == 1:
+        kwargs_array = kwargs_array.reshape(1, -1)
+    nrows, ncols = kwargs_array.shape
+
+    cells = {}
+    keys = np.full(kwargs_array.shape, None, dtype = object)
+    for (r, c), kwargs in np.ndenumerate(kwargs_array):
+        if kwargs is None:
+            continue
+        try:
+            key = builder_key(function, (), kwargs)
+        except UncacheableArgument:
+            key = f'{r},{c}'
+        if key not in cells:
+            cells[key] = function(**kwargs)
+        keys[r, c] = key
+
+    if not cells:
+        return Device(name)
+    spacing = np.broadcast_to(spacing, 2)
+    pitch = np.array(spacing, dtype = float)
+    if separation:
+        pitch += np.max([cell.size for cell in cells.values()], axis = 0)
+
+    D = Device(name)
+    for key, cell in cells.items():
+        for r, c, h, w in lattice_blocks(keys == key):
+            # lattice point of the bottom left chip in the block
+            corner = np.array([c*pitch[0], (nrows - 1 - (r + h - 1))*pitch[1]]) - cell.center
+            if h == 1 and w == 1:
+                D.add_ref(cell).move(corner)
+            else:
+                D.add_array(cell, columns = w, rows = h, spacing = pitch).move(corner)
+    return D
+
+def gridsweep_array(function, param_x, param_y, param_defaults = {}, param_override = {}, spacing = (0, 0), separation = True):
+    # pg.gridsweep with duplicate chips shared through assemble_array
+    return assemble_array(function, gridsweep_kwargs(param_x, param_y, param_defaults, param_override),
+                          spacing = spacing, separation = separation, name = 'gridsweep')
+
+def sweep_axes(axes):
+    # {name: values} or a yaml list [{name: ..., values: [...]}], outermost axis first
+    if isinstance(axes, Mapping):
+        return [(name, list(values)) for name, values in axes.items()]
+    return [(axis['name'], list(axis['values'])) for axis in axes]
+
+def nested_shape(points, ndim):
+    # Shape of the first ndim levels of nested lists, which have to be rectangular
+    shape = []
+    level = [points]
+    for _ in range(ndim):
+        lengths = {len(p) for p in level if p is not None}
+        if len(lengths) != 1:
+            raise ValueError(f"points are not a rectangular {ndim}D array (lengths {sorted(lengths)} at level {len(shape)})")
+        shape.append(lengths.pop())
+        level = [q for p in level for q in (p if p is not None else [None]*shape[-1])]
+    return tuple(shape)
+
+def point_depth(points):
+    # Nesting depth of a list of points, a point is a mapping of keyword arguments or None
+    depth = 0
+    while isinstance(points, (list, tuple)):
+        depth += 1
+        points = next((p for p in points if p is not None), None)
+    if points is not None and not isinstance(points, Mapping):
+        raise ValueError(f"points must be mappings of keyword arguments or None, got {type(points).__name__} (pass parameter = ...)")
+    return depth
+
+def sweep_points(axes = None, points = None, parameter = None, ndim = 2):
+    # N-D object array of point parameters, None leaves an empty slot.
+    # axes  : the product of the axes, the array has one dimension per axis
+    # points: nested lists of mappings (or of values for the single keyword argument parameter, ndim levels deep)
+    if (axes is None) == (points is None):
+        raise ValueError("give either axes or points")
+    if axes is not None:
+        axes = sweep_axes(axes)
+        array = np.empty(tuple(len(values) for _, values in axes), dtype = object)
+        for index in np.ndindex(array.shape):
+            array[index] = {name: values[i] for (name, values), i in zip(axes, index)}
+        return array
+    if parameter is None:
+        ndim = point_depth(points)
+    array = np.empty(nested_shape(points, ndim), dtype = object)
+    for index in np.ndindex(array.shape):
+        point = points
+        for i in index:
+            point = None if point is None else point[i]
+        if point is not None and parameter is not None:
+            point = {parameter: point}
+        array[index] = point
+    return array
+
+def block_points(param_x, param_y):
+    # 4D points of a grid of blocks like the yaml Grid of transmon3D: param_x = {'x': [[...], [...]]} sweeps
+    # the values of block i along x inside the i-th column of blocks, param_y likewise inside the rows
+    def blocks(param):
+        counts = {len(v) for v in param.values()}
+        if len(counts) != 1:
+            raise ValueError(f"parameters {', '.join(param)} have different numbers of blocks")
+        return [parameter_combinations({k: v[i] for k, v in param.items()}) for i in range(counts.pop())]
+    blocks_x, blocks_y = blocks(param_x), blocks(param_y)
+    return [[[[dict(py, **px) for px in bx] for py in by] for bx in blocks_x] for by in blocks_y]
+
+def per_level(value, levels, name):
+    # One value for every level or a list of values, innermost level first
+    if np.ndim(value) == 0 or (name == 'spacing' and np.ndim(value) == 1):
+        return [value]*levels
+    if len(value) != levels:
+        raise ValueError(f"{name} has {len(value)} entries for {levels} levels")
+    return list(value)
+
+def parameter_sweep(
+    function,
+    axes = None,
+    points = None,
+    parameter = None,
+    ndim = 2,
+    param_defaults = {},
+    param_override = {},
+    spacing = (50, 100),
+    separation = True,
+    align_x = "x",
+    align_y = "y",
+    edge_x = "x",
+    edge_y = "ymin",
+    label_layer = 255,
+    center = None,
+    empty = None,
+    workers = 1,
+    config = None,
+    modules = ('qubit_templates', 'ChipDesign'),
+):
+    # pg.gridsweep over any number of axes (or an N-D array of points, see sweep_points).
+    # The last dimension runs along x and the one before along y (row 0 on top) like pg.grid, every further
+    # pair of dimensions places the blocks of the previous level on a grid again. spacing and separation
+    # are per level (innermost first) or one value for all levels, with the pg.grid meaning.
+    # Points with the same keyword arguments are built once (in a process pool with workers > 1) and
+    # identical blocks are shared, so the cells are placed as references to the same cells.
+    # empty is placed in the slots without a point (e.g. a bare frame).
+    # Returns the sweep Device and a manifest with one dict(index, parameters, cell, build, center) per point,
+    # center being the center of the placed cell in the returned Device (after moving it to center).
+    array = sweep_points(axes, points, parameter, ndim)
+    if array.ndim == 0 or array.size == 0:
+        raise ValueError("the sweep has no points")
+    # an odd number of dimensions gets a single row on top
+    padding = array.ndim % 2
+    array = array.reshape((1,)*padding + array.shape)
+    levels = array.ndim // 2
+    spacing = per_level(spacing, levels, 'spacing')
+    separation = per_level(separation, levels, 'separation')
+
+    # one build per distinct set of keyword arguments
+    builds = {}
+    unique = []
+    keys = np.full(array.shape, None, dtype = object)
+    for index, params in np.ndenumerate(array):
+        if params is None:
+            continue
+        kwargs = dict(param_defaults)
+        kwargs.update(params)
+        kwargs.update(param_override)
+        try:
+            key = canonical(kwargs)
+        except UncacheableArgument:
+            key = ('point', index)
+        if key not in builds:
+            builds[key] = len(unique)
+            unique.append((kwargs, params))
+        keys[index] = builds[key]
+    cells = build_parallel(function, [kwargs for kwargs, _ in unique], workers = workers, config = config, modules = modules)
+
+    if label_layer is not None:
+        for cell, (_, params) in zip(cells, unique):
+            label_text = ""
+            for name, value in params.items():
+                label_text += (f"{name}={value}") + "\n"
+            cell.add_label(text = label_text, position = cell.center, layer = label_layer)
+
+    # grid the innermost blocks first, identical blocks are gridded once
+    blocks = np.empty(array.shape, dtype = object)
+    for index, build in np.ndenumerate(keys):
+        blocks[index] = empty if build is None else cells[build]
+    if empty is not None:
+        keys = np.where(keys == None, 'empty', keys)
+    for level in range(levels):
+        gridded = {}
+        outer = np.full(keys.shape[:-2], None, dtype = object)
+        outer_keys = np.full(keys.shape[:-2], None, dtype = object)
+        for index in np.ndindex(outer.shape):
+            key = tuple(keys[index].flat)
+            if all(k is None for k in key):
+                continue
+            if key not in gridded:
+                gridded[key] = pg.grid(blocks[index], spacing = spacing[level], separation = separation[level], shape = None,
+                                       align_x = align_x, align_y = align_y, edge_x = edge_x, edge_y = edge_y)
+            outer[index] = gridded[key]
+            outer_keys[index] = (level, key)
+        blocks, keys = outer, outer_keys
+    D = blocks[()] if blocks[()] is not None else Device('grid')
+    D.name = 'parameter_sweep'
+
+    if label_layer is not None:
+        label_text = {}
+        label_text.update(param_defaults)
+        label_text.update(param_override)
+        D.add_label(text = str(label_text), position = (D.xmin, D.ymin), layer = label_layer)
+    if center is not None:
+        D.center = center
+
+    # pg.grid adds one reference per slot in row major order, follow them down to the cells
+    manifest = []
+    build_index = {id(cell): i for i, cell in enumerate(cells)}
+    build_index[id(empty)] = None
+    for index, params in np.ndenumerate(array):
+        if params is None:
+            continue
+        device, offset = D, np.zeros(2)
+        for dim in range(0, array.ndim, 2):
+            ref = device.references[index[dim]*array.shape[dim + 1] + index[dim + 1]]
+            if dim + 2 < array.ndim:
+                offset = offset + ref.origin
+                device = ref.parent
+        manifest.append(dict(index = index[padding:], parameters = params, cell = ref.parent.name,
+                             build = build_index[id(ref.parent)], center = tuple(float(v) for v in offset + ref.center)))
+    return D, manifest